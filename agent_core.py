@@ -1,14 +1,23 @@
 import os
 import logging
 import json
+import time
+import threading
 from dotenv import load_dotenv
-from langchain_gigachat import GigaChat
-from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage, AIMessage
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.prebuilt import create_react_agent
-from langchain_tavily import TavilySearch
-from langchain_community.tools import tool
-import base64
+
+from llm_executor import (
+    run_scheduled, iterate_scheduled, get_llm_scheduler, LLMRateLimited, PRIORITY_INTERACTIVE
+)
+from http_pool import get_shared_gigachat
+from moderation import ModerationBatcher, ModerationPipeline, create_prefilter, parse_batch_verdicts
+from answer_cache import AnswerCache
+from search_cache import SearchCache
+from user_stats import stats_store, format_user_stats
+from leaderboard import leaderboard
+from agent_memory import create_checkpointer, make_history_hook
+from prompt_budget import budgeter
+from hedging import Hedger
+from metrics import span, registry, llm_callbacks
 
 # --- Базовая настройка ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -23,6 +32,15 @@ GIGACHAT_API_BASE = os.getenv("GIGACHAT_API_BASE")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 TELEGRAM_CHAT_INVITE_LINK = os.getenv("TELEGRAM_CHAT_INVITE_LINK")
 MAX_POST_LENGTH = int(os.getenv("MAX_POST_LENGTH", 450))
+# Конвейер /generate по умолчанию: agent (ReAct-агент) или fast (поиск, один вызов LLM, локальное оформление)
+POST_PIPELINE = os.getenv("POST_PIPELINE", "agent")
+# Выполнять ли один веб-поиск по теме в быстром конвейере
+POST_FAST_SEARCH = os.getenv("POST_FAST_SEARCH", "true").lower() in ("1", "true", "yes")
+POST_PIPELINES = ("agent", "fast")
+# Хеджирование агента: прямая генерация запускается через POST_HEDGE_DELAY секунд (0 — сразу),
+# побеждает первый годный пост, второй способ отменяется
+POST_HEDGE = os.getenv("POST_HEDGE", "false").lower() in ("1", "true", "yes")
+POST_HEDGE_DELAY = float(os.getenv("POST_HEDGE_DELAY", 10))
 
 # --- Проверка обязательных переменных окружения ---
 if not all([GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET, GIGACHAT_SCOPE]):
@@ -30,21 +48,30 @@ if not all([GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET, GIGACHAT_SCOPE]):
 if not TAVILY_API_KEY:
     raise ValueError("TAVILY_API_KEY must be set in the environment variables.")
 
-# --- Кодирование учетных данных GigaChat в Base64 ---
-client_credentials = f"{GIGACHAT_CLIENT_ID}:{GIGACHAT_CLIENT_SECRET}"
-encoded_credentials = base64.b64encode(client_credentials.encode("utf-8")).decode("utf-8")
-
-# --- Инициализация GigaChat ---
-llm = GigaChat(
-    credentials=encoded_credentials,
-    scope=GIGACHAT_SCOPE,
-    verify_ssl_certs=False,
-    base_url=GIGACHAT_API_BASE if GIGACHAT_API_BASE else None,
-    model=os.getenv("GIGACHAT_MODEL_NAME", "GigaChat-2")
-)
+# --- Ленивая инициализация ---
+# GigaChat, Tavily и граф агента (вместе с langchain/langgraph) создаются при первом обращении,
+# а не при импорте модуля: бот быстрее запускается, а /start и /help их не ждут.
+_init_lock = threading.Lock()
+_tavily_search_tool = None
+_tools = None
+_agent_executor = None
+_checkpointer = None
+
+def get_llm():
+    """Общий для процесса клиент GigaChat: один пул соединений для всех запросов."""
+    return get_shared_gigachat()
+
+def get_tavily_search_tool():
+    global _tavily_search_tool
+    if _tavily_search_tool is None:
+        with _init_lock:
+            if _tavily_search_tool is None:
+                from langchain_tavily import TavilySearch
+                _tavily_search_tool = TavilySearch(max_results=5)
+    return _tavily_search_tool
 
 # --- Инструменты агента ---
-@tool
+# Обычные функции; в инструменты LangChain они оборачиваются в get_tools() при построении агента.
 def generate_telegram_post(topic: str, content_ideas: str = "") -> str:
     """
     Генерирует ФИНАЛЬНЫЙ черновик поста для Telegram-канала на заданную тему.
@@ -99,9 +126,13 @@ def generate_telegram_post(topic: str, content_ideas: str = "") -> str:
     logger.info(f"Пост успешно сгенерирован инструментом, итоговая длина: {len(final_post_content)}")
     return final_post_content
 
-tavily_search_tool = TavilySearch(max_results=5)
+# Кэш результатов поиска: одинаковые запросы (в том числе одновременные) не дублируют вызов Tavily
+def _tavily_search(query: str):
+    with span("tavily", "search"):
+        return get_tavily_search_tool().invoke({"query": query})
+
+search_cache = SearchCache(_tavily_search)
 
-@tool
 def web_search(query: str) -> str:
     """
     Выполняет поиск в интернете по заданному запросу, используя Tavily Search.
@@ -110,17 +141,17 @@ def web_search(query: str) -> str:
     """
     logger.info(f"Выполняю веб-поиск для: {query} через Tavily Search")
     try:
-        results = tavily_search_tool.invoke({"query": query})
-        snippets = [res.get('content', '') for res in results if res.get('content')]
-        if snippets:
-            return "\n".join(snippets[:3])
+        results = search_cache.search(query)
+        # Фрагменты без повторов, в пределах бюджета токенов на результаты поиска
+        context = budgeter.fit_search_results(results)
+        if context:
+            return context
         else:
             return "Поиск не дал релевантных результатов."
     except Exception as e:
         logger.error(f"Ошибка при вызове Tavily Search: {e}", exc_info=True)
         return "Не удалось выполнить поиск в интернете."
 
-@tool
 def analyze_message(message_text: str) -> dict:
     """
     ## ИСПРАВЛЕННАЯ ФУНКЦИЯ
@@ -146,7 +177,8 @@ def analyze_message(message_text: str) -> dict:
 Пример для безопасного сообщения: {{ "is_toxic": false, "toxicity_score": 1, "reason": "Обычное приветствие." }}
 """
 
-        response = llm.invoke([HumanMessage(content=analysis_prompt)])
+        from langchain_core.messages import HumanMessage
+        response = get_llm().invoke([HumanMessage(content=analysis_prompt)])
 
         if response and response.content:
             try:
@@ -163,7 +195,38 @@ def analyze_message(message_text: str) -> dict:
         logger.error(f"Ошибка при анализе сообщения: {e}")
         return {"is_toxic": False, "toxicity_score": 1, "reason": f"Исключение при анализе: {str(e)}"}
 
-@tool
+def analyze_messages_batch(messages: list) -> list:
+    """
+    Анализирует пакет сообщений на токсичность одним запросом к LLM.
+    Возвращает список вердиктов (is_toxic/toxicity_score/reason) в том же порядке, что и сообщения.
+    """
+    logger.info(f"Анализирую пакет из {len(messages)} сообщений")
+    numbered_messages = "\n".join(
+        f"{i}. {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(messages, 1)
+    )
+    analysis_prompt = f"""
+Ты — модератор чата. Проанализируй каждое сообщение из списка на предмет оскорблений, агрессии, хейт-спича и грубого поведения.
+Не реагируй на обычные, нейтральные или позитивные сообщения, такие как "привет", "как дела?" и т.д.
+Твоя задача — выявлять только реальную токсичность. Оценивай каждое сообщение независимо от остальных.
+
+Сообщения для анализа (номер и текст):
+{numbered_messages}
+
+Верни ответ СТРОГО в виде JSON-массива, по одному объекту на каждое сообщение, со следующими полями:
+- "id": номер сообщения из списка
+- "is_toxic": boolean (true, если сообщение токсично, иначе false)
+- "toxicity_score": число от 1 до 10 (где 1 - абсолютно безопасно, 10 - крайне токсично)
+- "reason": краткое объяснение на русском языке, почему сообщение токсично (если оно таково).
+
+Пример: [{{ "id": 1, "is_toxic": false, "toxicity_score": 1, "reason": "Обычное приветствие." }}, {{ "id": 2, "is_toxic": true, "toxicity_score": 8, "reason": "Прямое оскорбление участников чата." }}]
+"""
+    from langchain_core.messages import HumanMessage
+    response = get_llm().invoke([HumanMessage(content=analysis_prompt)])
+    content = response.content if response else ""
+    verdicts = parse_batch_verdicts(content, len(messages))
+    logger.info(f"Результат пакетного анализа: {verdicts}")
+    return verdicts
+
 def get_user_stats(user_id: str) -> str:
     """
     Получает статистику пользователя из базы данных.
@@ -171,12 +234,14 @@ def get_user_stats(user_id: str) -> str:
     """
     logger.info(f"Запрашиваю статистику пользователя: {user_id}")
     try:
-        return f"Статистика пользователя {user_id}:\n- Сообщений: 0\n- Активность: 0\n- JK заработано: 0\n- Рейтинг: N/A"
+        stats = stats_store.get(user_id)
+        if stats is None:
+            return f"Статистика пользователя {user_id} пока недоступна: нет данных об активности."
+        return format_user_stats(user_id, stats, leaderboard.rank(user_id))
     except Exception as e:
         logger.error(f"Ошибка при получении статистики пользователя: {e}")
         return f"Ошибка получения статистики: {str(e)}"
 
-@tool
 def get_community_rating() -> str:
     """
     Получает рейтинг сообщества (топ-10 активных участников).
@@ -184,18 +249,25 @@ def get_community_rating() -> str:
     """
     logger.info("Запрашиваю рейтинг сообщества")
     try:
-        return "Рейтинг сообщества JK Coin:\n1. Пользователь 1 - 1000 очков\n2. Пользователь 2 - 800 очков\n3. Пользователь 3 - 600 очков\n...\n\nРейтинг обновляется автоматически."
+        return leaderboard.format_top()
     except Exception as e:
         logger.error(f"Ошибка при получении рейтинга сообщества: {e}")
         return f"Ошибка получения рейтинга: {str(e)}"
 
-@tool
+# Кэш ответов на похожие вопросы (FAQ в разных формулировках)
+answer_cache = AnswerCache()
+
 def answer_question(question: str) -> str:
     """
     Отвечает на вопросы пользователей, используя базу знаний сообщества.
     Используй этот инструмент для ответов на технические вопросы и FAQ.
     """
     logger.info(f"Отвечаю на вопрос: {question[:100]}...")
+    cached = answer_cache.get(question)
+    if cached:
+        answer, similarity = cached
+        logger.info(f"Ответ найден в кэше (сходство {similarity:.2f}).")
+        return f"Ответ на вопрос:\n{answer}"
     try:
         answer_prompt = f"""
 Ответь на вопрос пользователя, используя знания о сообществе JK Coin, TON блокчейне, и технологиях.
@@ -204,8 +276,10 @@ def answer_question(question: str) -> str:
 
 Дай подробный, полезный ответ. Если не знаешь ответа, предложи обратиться к администраторам.
 """
-        response = llm.invoke([HumanMessage(content=answer_prompt)])
+        from langchain_core.messages import HumanMessage
+        response = get_llm().invoke([HumanMessage(content=answer_prompt)])
         if response and response.content:
+            answer_cache.set(question, response.content)
             return f"Ответ на вопрос:\n{response.content}"
         else:
             return "Не удалось сгенерировать ответ. Обратитесь к администраторам."
@@ -213,7 +287,21 @@ def answer_question(question: str) -> str:
         logger.error(f"Ошибка при ответе на вопрос: {e}")
         return f"Ошибка генерации ответа: {str(e)}"
 
-tools = [web_search, generate_telegram_post, analyze_message, get_user_stats, get_community_rating, answer_question]
+def get_tools() -> list:
+    """Инструменты агента LangChain (создаются при первом обращении)."""
+    global _tools
+    if _tools is None:
+        with _init_lock:
+            if _tools is None:
+                from langchain_community.tools import tool
+                _tools = [tool(func) for func in (
+                    web_search, generate_telegram_post, analyze_message,
+                    get_user_stats, get_community_rating, answer_question
+                )]
+                # Каждый вызов инструмента агентом попадает в гистограмму задержек
+                for agent_tool in _tools:
+                    agent_tool.callbacks = llm_callbacks()
+    return _tools
 
 system_prompt = f"""
 Ты — Нейро Jekardos, интеллектуальный агент сообщества Jekardos Coin. Твоя задача — быть многофункциональным помощником для сообщества.
@@ -239,15 +327,85 @@ system_prompt = f"""
 **ВАЖНО:** Всегда будь полезным и конструктивным.
 """
 
-agent_executor = create_react_agent(
-    llm,
-    tools,
-    checkpointer=MemorySaver(),
-    system_message=system_prompt,
-    recursion_limit=15
-)
-
-def run_agent_for_post(user_message: str, thread_id: str = "default_thread") -> str:
+def get_checkpointer():
+    """
+    Хранилище истории диалогов агента: по потоку на пользователя, с ограничением размера и простоя.
+    Тип (в памяти или SQLite) задается переменной AGENT_CHECKPOINTER.
+    """
+    global _checkpointer
+    if _checkpointer is None:
+        with _init_lock:
+            if _checkpointer is None:
+                _checkpointer = create_checkpointer()
+    return _checkpointer
+
+def close_checkpointer() -> None:
+    """Закрывает хранилище контрольных точек (вызывается при завершении бота)."""
+    global _checkpointer, _agent_executor
+    with _init_lock:
+        if _checkpointer is not None and hasattr(_checkpointer, "close"):
+            _checkpointer.close()
+        _checkpointer = None
+        _agent_executor = None
+
+def get_agent_memory_stats() -> dict:
+    """Использование памяти историей диалогов агента."""
+    if _checkpointer is None:
+        return {"threads": 0, "checkpoints": 0, "blobs": 0, "bytes": 0, "evicted_threads": 0}
+    return _checkpointer.stats()
+
+def get_prompt_budget_stats() -> dict:
+    """Размеры промптов до и после укладки в бюджет токенов."""
+    return budgeter.stats()
+
+def get_search_cache_stats() -> dict:
+    """Попадания в кэш веб-поиска и задержка запросов к Tavily."""
+    return search_cache.stats()
+
+def get_answer_cache_stats() -> dict:
+    """Попадания в кэш ответов на похожие вопросы."""
+    return answer_cache.stats()
+
+def get_agent_executor():
+    """Граф ReAct-агента (строится при первом обращении)."""
+    global _agent_executor
+    if _agent_executor is None:
+        llm = get_llm()
+        tools = get_tools()
+        checkpointer = get_checkpointer()
+        with _init_lock:
+            if _agent_executor is None:
+                from langgraph.prebuilt import create_react_agent
+                _agent_executor = create_react_agent(
+                    llm,
+                    tools,
+                    checkpointer=checkpointer,
+                    prompt=system_prompt,
+                    pre_model_hook=make_history_hook(budgeter=budgeter, system_prompt=system_prompt)
+                )
+                logger.info("Агент LangGraph инициализирован.")
+    return _agent_executor
+
+def _last_message(update):
+    # Шаг графа отдает либо сообщение, либо обновление состояния {"messages": [...]}
+    if isinstance(update, dict):
+        messages = update.get("messages") or []
+        return messages[-1] if messages else None
+    return update
+
+# Что показать пользователю, пока агент вызывает инструмент
+AGENT_TOOL_STATUS = {
+    "web_search": "🔎 Ищу материалы в интернете...",
+    "generate_telegram_post": "✍️ Оформляю пост...",
+}
+AGENT_DEFAULT_STATUS = "⚙️ Агент работает над постом..."
+
+def stream_agent_for_post(user_message: str, thread_id: str = "default_thread", cancel_event=None):
+    """
+    Цикл агента для поста как генератор событий: ("status", текст) — агент вызывает инструмент,
+    ("token", фрагмент) — токены ответа модели по мере генерации, последним — ("post", итоговый текст).
+    """
+    from langchain_core.messages import HumanMessage, ToolMessage, AIMessage
     config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 15}
     logger.info(f"Запуск агента для запроса: '{user_message}' в потоке {thread_id}")
 
@@ -257,7 +415,23 @@ def run_agent_for_post(user_message: str, thread_id: str = "default_thread") ->
         step_count = 0
         max_steps = 20
 
-        for s in agent_executor.stream({"messages": messages}, config=config):
+        # Контрольные точки записываются в фоне, пока выполняется следующий шаг, а не на пути ответа
+        step_started = time.perf_counter()
+        for mode, s in get_agent_executor().stream({"messages": messages}, config=config,
+                                                   stream_mode=["updates", "messages"], durability="async"):
+            if cancel_event is not None and cancel_event.is_set():
+                logger.info("Агент остановлен: пост уже получен другим способом.")
+                break
+            if mode == "messages":
+                # Токены модели в узле агента; ход с вызовом инструмента не показывается
+                chunk, metadata = s
+                if (metadata.get("langgraph_node") == "agent" and isinstance(chunk.content, str) and chunk.content
+                        and not getattr(chunk, "tool_call_chunks", None) and not getattr(chunk, "tool_calls", None)):
+                    yield "token", chunk.content
+                continue
+
+            # Шаг — время от предыдущего обновления графа до этого (узел агента или инструментов)
+            registry.observe("agent_step", next(iter(s), "unknown"), time.perf_counter() - step_started)
             step_count += 1
             if step_count > max_steps:
                 logger.warning(f"Превышен лимит шагов ({max_steps}).")
@@ -265,27 +439,47 @@ def run_agent_for_post(user_message: str, thread_id: str = "default_thread") ->
             
             logger.info(f"Шаг агента {step_count}: {list(s.keys())}")
             
-            if 'agent' in s and isinstance(s['agent'], AIMessage):
-                if not (hasattr(s['agent'], 'tool_calls') and s['agent'].tool_calls):
-                    response_content = s['agent'].content
-                    return response_content
-            elif 'tools' in s and isinstance(s['tools'], ToolMessage):
-                if s['tools'].name == "generate_telegram_post":
-                    return s['tools'].content
+            agent_message = _last_message(s.get('agent'))
+            tool_message = _last_message(s.get('tools'))
+            if isinstance(agent_message, AIMessage):
+                if not (hasattr(agent_message, 'tool_calls') and agent_message.tool_calls):
+                    yield "post", agent_message.content
+                    return
+                for call in agent_message.tool_calls:
+                    yield "status", AGENT_TOOL_STATUS.get(call["name"], AGENT_DEFAULT_STATUS)
+            elif isinstance(tool_message, ToolMessage):
+                if tool_message.name == "generate_telegram_post":
+                    yield "post", tool_message.content
+                    return
             elif '__end__' in s:
-                return response_content
+                break
+            step_started = time.perf_counter()
         
-        return response_content
+        yield "post", response_content
 
     except Exception as e:
-        logger.error(f"Исключение в run_agent_for_post: {e}", exc_info=True)
-        return f"Извините, произошла внутренняя ошибка: {str(e)}."
-
-def create_telegram_post(topic: str) -> str:
+        logger.error(f"Исключение в цикле агента: {e}", exc_info=True)
+        yield "post", f"Извините, произошла внутренняя ошибка: {str(e)}."
+
+def run_agent_for_post(user_message: str, thread_id: str = "default_thread", cancel_event=None) -> str:
+    post_text = "Извините, агент не смог сгенерировать пост."
+    for kind, value in stream_agent_for_post(user_message, thread_id, cancel_event):
+        if kind == "post":
+            post_text = value
+    return post_text
+
+def is_valid_post(post_text: str) -> bool:
+    """Годится ли результат генерации как пост (а не сообщение об ошибке)."""
+    return bool(post_text) and len(post_text) > 50 and not post_text.startswith("Извините")
+
+def create_telegram_post(topic: str, thread_id: str = "default_thread", pipeline: str = None) -> str:
+    pipeline = pipeline or POST_PIPELINE
+    if pipeline == "fast":
+        return generate_post_fast(topic)
     logger.info(f"Начало генерации текстового поста по теме: '{topic}'")
     try:
-        post_text = run_agent_for_post(topic)
-        if post_text and len(post_text) > 50 and not post_text.startswith("Извините"):
+        post_text = run_agent_for_post(topic, thread_id)
+        if is_valid_post(post_text):
             return post_text
         else:
             logger.warning(f"Агент не сработал, используем прямой вызов LLM.")
@@ -294,12 +488,18 @@ def create_telegram_post(topic: str) -> str:
         logger.error(f"Ошибка в run_agent_for_post: {e}")
         return generate_post_directly(topic)
 
-def generate_post_directly(topic: str) -> str:
-    logger.info(f"Прямая генерация поста по теме: '{topic}'")
-    try:
-        prompt = f"""
+def _direct_post_prompt(topic: str, search_context: str = "", avoid: str = "") -> str:
+    context_block = f"""
+Используй факты из результатов веб-поиска, если они относятся к теме:
+{search_context}
+""" if search_context else ""
+    avoid_block = f"""
+Этот пост уже опубликован в канале. Не повторяй его: выбери другой заголовок, другой угол и другие примеры:
+{avoid}
+""" if avoid else ""
+    return f"""
 Создай пост для Telegram канала на тему: "{topic}"
-
+{context_block}{avoid_block}
 Пост должен:
 - Быть длиной от 400 до 500 символов
 - Включать заголовок и основной текст
@@ -309,39 +509,136 @@ def generate_post_directly(topic: str) -> str:
 
 Не включай призыв к действию, хештеги или подпись - это будет добавлено автоматически.
 """
-        response = llm.invoke([HumanMessage(content=prompt)])
+
+def generate_post_directly(topic: str, cancel_event=None) -> str:
+    if cancel_event is not None and cancel_event.is_set():
+        return "Извините, генерация отменена."
+    logger.info(f"Прямая генерация поста по теме: '{topic}'")
+    try:
+        from langchain_core.messages import HumanMessage
+        response = get_llm().invoke([HumanMessage(content=_direct_post_prompt(topic))])
         
         if response and response.content:
-            call_to_action = "Вступай в чат https://t.me/JekardosCoinForever"
-            hashtags = "#путешествия #выживание #кочевники #jekardos #jk"
-            post_signature = "*Нейро Jekardos*"
-            
-            final_content = response.content.strip()
-            if final_content.startswith("##"):
-                final_content = final_content[2:].strip()
-            
-            final_content = "\n".join(line.strip() for line in final_content.split("\n") if line.strip())
-            
-            if len(final_content) > 500:
-                final_content = final_content[:500]
-                last_space = final_content.rfind(' ')
-                final_content = final_content[:last_space] if last_space > 400 else final_content[:497] + "..."
-            
-            final_post = final_content + "\n\n" + call_to_action + "\n\n" + hashtags + "\n\n" + post_signature
-            
-            if len(final_post) > 750:
-                available_space = 750 - len(call_to_action) - len(hashtags) - len(post_signature) - 6
-                if available_space > 100:
-                    final_content = final_content[:available_space]
-                    last_space = final_content.rfind(' ')
-                    final_content = final_content[:last_space] if last_space > available_space - 50 else final_content[:available_space-3] + "..."
-                    final_post = final_content + "\n\n" + call_to_action + "\n\n" + hashtags + "\n\n" + post_signature
-                else:
-                    final_post = "Краткий пост на тему: " + topic + "\n\n" + call_to_action + "\n\n" + hashtags + "\n\n" + post_signature
-            
-            return final_post
+            return generate_telegram_post(topic, response.content)
         else:
             return "Извините, не удалось сгенерировать пост."
     except Exception as e:
         logger.error(f"Ошибка при прямой генерации поста: {e}")
-        return f"Извините, произошла ошибка: {str(e)}."
\ No newline at end of file
+        return f"Извините, произошла ошибка: {str(e)}."
+
+# --- Быстрый конвейер /generate ---
+# Фиксированная последовательность без цикла агента: один поиск (по желанию),
+# один вызов LLM для черновика и локальное оформление инструментом generate_telegram_post.
+def search_context(topic: str) -> str:
+    """Контекст веб-поиска по теме в пределах бюджета токенов (пустая строка, если поиск не удался)."""
+    try:
+        return budgeter.fit_search_results(search_cache.search(topic))
+    except Exception as e:
+        logger.warning(f"Поиск для быстрого конвейера не удался, продолжаем без него: {e}")
+        return ""
+
+def generate_post_fast(topic: str, search: bool = None, avoid: str = "") -> str:
+    logger.info(f"Быстрая генерация поста по теме: '{topic}'")
+    search = POST_FAST_SEARCH if search is None else search
+    try:
+        from langchain_core.messages import HumanMessage
+        context = search_context(topic) if search else ""
+        response = get_llm().invoke([HumanMessage(content=_direct_post_prompt(topic, context, avoid))])
+        if response and response.content:
+            return generate_telegram_post(topic, response.content)
+        return "Извините, не удалось сгенерировать пост."
+    except Exception as e:
+        logger.error(f"Ошибка быстрой генерации поста: {e}")
+        return f"Извините, произошла ошибка: {str(e)}."
+
+def stream_post_directly(topic: str, search: bool = None):
+    """Потоковый вариант быстрого конвейера: отдает фрагменты черновика по мере прихода токенов от GigaChat."""
+    logger.info(f"Потоковая генерация поста по теме: '{topic}'")
+    search = POST_FAST_SEARCH if search is None else search
+    from langchain_core.messages import HumanMessage
+    context = search_context(topic) if search else ""
+    for chunk in get_llm().stream([HumanMessage(content=_direct_post_prompt(topic, context))]):
+        if chunk.content:
+            yield chunk.content
+
+# --- Асинхронные обертки для обработчиков Telegram ---
+# Синхронные вызовы GigaChat выполняются в ограниченном пуле потоков,
+# чтобы медленный ответ модели не блокировал цикл событий бота.
+# Все вызовы идут через общий планировщик LLM: команды пользователей (priority по умолчанию)
+# получают слоты раньше фоновой модерации, user_id включает ограничение частоты для пользователя.
+async def analyze_message_async(message_text: str, user_id: str = None) -> dict:
+    return await run_scheduled(PRIORITY_INTERACTIVE, user_id, analyze_message, message_text)
+
+# Сообщения из чата сначала проверяются локальным классификатором,
+# а неоднозначные модерируются пакетами: один запрос к LLM на несколько сообщений.
+moderation_pipeline = ModerationPipeline(ModerationBatcher(analyze_messages_batch), create_prefilter())
+
+async def moderate_message_async(message_text: str) -> dict:
+    return await moderation_pipeline.moderate(message_text)
+
+def get_moderation_stats() -> dict:
+    return moderation_pipeline.stats()
+
+async def answer_question_async(question: str, user_id: str = None, priority: int = PRIORITY_INTERACTIVE) -> str:
+    return await run_scheduled(priority, user_id, answer_question, question)
+
+# Агент и прямая генерация как основной и резервный способы получить пост.
+# Запрос списывается из лимита пользователя агентом; если лимит исчерпан, резервный способ не запускается
+post_hedger = Hedger(POST_HEDGE_DELAY, is_valid_post, names=("agent", "direct"), fatal=(LLMRateLimited,))
+
+async def _agent_post_with_progress(topic: str, thread_id: str, cancel_event, on_progress, user_id: str = None,
+                                    charge: bool = True) -> str:
+    """Агент для поста, ход работы которого передается в on_progress(вид, значение) по мере шагов и токенов."""
+    post_text = "Извините, агент не смог сгенерировать пост."
+    async for kind, value in iterate_scheduled(PRIORITY_INTERACTIVE, user_id, stream_agent_for_post,
+                                               topic, thread_id, cancel_event, charge=charge):
+        if kind == "post":
+            post_text = value
+        else:
+            await on_progress(kind, value)
+    return post_text
+
+async def create_telegram_post_async(topic: str, thread_id: str = "default_thread", pipeline: str = None,
+                                     user_id: str = None, on_progress=None, charge: bool = True) -> str:
+    """
+    Пост выбранным конвейером. on_progress — корутина (вид, значение), в которую агент передает
+    ход работы: ("status", текст) при вызове инструмента и ("token", фрагмент) при генерации ответа.
+    Запрос списывается из лимита пользователя один раз (charge=False — уже списан, например потоком).
+    """
+    pipeline = pipeline or POST_PIPELINE
+    if pipeline == "agent" and (POST_HEDGE or on_progress is not None):
+        if on_progress is not None:
+            agent = lambda cancel_event: _agent_post_with_progress(topic, thread_id, cancel_event, on_progress,
+                                                                         user_id, charge)
+        else:
+            agent = lambda cancel_event: run_scheduled(PRIORITY_INTERACTIVE, user_id, run_agent_for_post,
+                                                       topic, thread_id, cancel_event, charge=charge)
+        direct = lambda cancel_event: run_scheduled(PRIORITY_INTERACTIVE, user_id, generate_post_directly,
+                                                    topic, cancel_event, charge=False)
+        if POST_HEDGE:
+            return await post_hedger.run(agent, direct)
+        post_text = await agent(None)
+        if is_valid_post(post_text):
+            return post_text
+        logger.warning("Агент не сработал, используем прямой вызов LLM.")
+        return await direct(None)
+    return await run_scheduled(PRIORITY_INTERACTIVE, user_id, create_telegram_post, topic, thread_id, pipeline,
+                               charge=charge)
+
+async def regenerate_post_async(topic: str, avoid: str, user_id: str = None) -> str:
+    """
+    Новый пост быстрым конвейером вместо черновика, повторившего опубликованный пост (avoid —
+    текст этого поста как отрицательный пример). Не списывается из лимита пользователя: повтор — не его запрос.
+    """
+    return await run_scheduled(PRIORITY_INTERACTIVE, user_id, generate_post_fast, topic, None, avoid, charge=False)
+
+def get_hedge_stats() -> dict:
+    return post_hedger.stats()
+
+async def stream_post_async(topic: str, user_id: str = None):
+    """Асинхронный поток фрагментов черновика поста (оформление — generate_telegram_post после завершения)."""
+    async for delta in iterate_scheduled(PRIORITY_INTERACTIVE, user_id, stream_post_directly, topic):
+        yield delta
+
+def get_llm_scheduler_stats() -> dict:
+    return get_llm_scheduler().stats()
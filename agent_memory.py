@@ -0,0 +1,308 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Сколько последних сообщений и токенов истории видит агент в одном потоке диалога
+AGENT_MEMORY_MAX_MESSAGES = int(os.getenv("AGENT_MEMORY_MAX_MESSAGES", 20))
+AGENT_MEMORY_MAX_TOKENS = int(os.getenv("AGENT_MEMORY_MAX_TOKENS", 3000))
+# Сколько потоков диалога держать в памяти и через сколько секунд простоя поток удаляется
+AGENT_MEMORY_MAX_THREADS = int(os.getenv("AGENT_MEMORY_MAX_THREADS", 1000))
+AGENT_MEMORY_THREAD_TTL = float(os.getenv("AGENT_MEMORY_THREAD_TTL", 3600))
+# Сколько последних контрольных точек хранить на поток (остальные не нужны для продолжения диалога)
+AGENT_MEMORY_CHECKPOINTS_PER_THREAD = int(os.getenv("AGENT_MEMORY_CHECKPOINTS_PER_THREAD", 2))
+# Хранилище контрольных точек: memory (в памяти процесса) или sqlite (файл на диске, общий для процессов)
+AGENT_CHECKPOINTER = os.getenv("AGENT_CHECKPOINTER", "memory")
+AGENT_CHECKPOINT_DB = os.getenv("AGENT_CHECKPOINT_DB", "agent_checkpoints.sqlite")
+# Через сколько секунд простоя поток удаляется из базы и как часто запускается уплотнение
+AGENT_CHECKPOINT_THREAD_TTL = float(os.getenv("AGENT_CHECKPOINT_THREAD_TTL", 7 * 24 * 3600))
+AGENT_CHECKPOINT_COMPACT_INTERVAL = float(os.getenv("AGENT_CHECKPOINT_COMPACT_INTERVAL", 300))
+
+def trim_history(messages: list, max_messages: int = AGENT_MEMORY_MAX_MESSAGES,
+                 max_tokens: int = AGENT_MEMORY_MAX_TOKENS) -> list:
+    """
+    Оставляет последние сообщения диалога в пределах лимитов по числу и по токенам (оценка).
+    История всегда начинается с сообщения пользователя, чтобы не осталось ответов инструментов без вызова.
+    """
+    from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+
+    trimmed = trim_messages(messages, max_tokens=max_messages, token_counter=len,
+                            strategy="last", start_on="human", include_system=True)
+    return trim_messages(trimmed, max_tokens=max_tokens, token_counter=count_tokens_approximately,
+                         strategy="last", start_on="human", include_system=True)
+
+def make_history_hook(max_messages: int = AGENT_MEMORY_MAX_MESSAGES, max_tokens: int = AGENT_MEMORY_MAX_TOKENS,
+                      budgeter=None, system_prompt: str = ""):
+    """
+    Хук перед вызовом модели для ReAct-агента: обрезает историю потока.
+    Если история превысила лимиты, она заменяется в состоянии, поэтому не растет и в контрольных точках.
+    С budgeter промпт каждого вызова (вместе с system_prompt) дополнительно укладывается в бюджет токенов.
+    """
+    def history_hook(state: dict) -> dict:
+        from langchain_core.messages import RemoveMessage
+        from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+        messages = state["messages"]
+        trimmed = trim_history(messages, max_messages, max_tokens)
+        update = {"llm_input_messages": budgeter.fit_messages(trimmed, system_prompt) if budgeter else trimmed}
+        if len(trimmed) != len(messages):
+            update["messages"] = [RemoveMessage(id=REMOVE_ALL_MESSAGES), *trimmed]
+        return update
+
+    return history_hook
+
+def create_bounded_checkpointer(max_threads: int = AGENT_MEMORY_MAX_THREADS, thread_ttl: float = AGENT_MEMORY_THREAD_TTL,
+                                checkpoints_per_thread: int = AGENT_MEMORY_CHECKPOINTS_PER_THREAD, clock=time.monotonic):
+    """Создает ограниченное хранилище контрольных точек (langgraph импортируется при вызове)."""
+    from langgraph.checkpoint.memory import MemorySaver
+
+    class BoundedMemorySaver(MemorySaver):
+        """
+        MemorySaver с ограничениями: хранит только последние контрольные точки каждого потока,
+        удаляет потоки, простаивающие дольше thread_ttl, и самые давние при превышении max_threads.
+        """
+
+        def __init__(self):
+            super().__init__()
+            self.max_threads = max_threads
+            self.thread_ttl = thread_ttl
+            self.checkpoints_per_thread = max(1, checkpoints_per_thread)
+            self.clock = clock
+            self.evicted_threads = 0
+            self._last_seen = OrderedDict()
+            self._lock = threading.RLock()
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            with self._lock:
+                result = super().put(config, checkpoint, metadata, new_versions)
+                thread_id = config["configurable"]["thread_id"]
+                self._touch(thread_id)
+                self._prune_checkpoints(thread_id, config["configurable"]["checkpoint_ns"])
+                self._evict_idle()
+                return result
+
+        def put_writes(self, config, writes, task_id, task_path=""):
+            with self._lock:
+                return super().put_writes(config, writes, task_id, task_path)
+
+        def get_tuple(self, config):
+            with self._lock:
+                return super().get_tuple(config)
+
+        def delete_thread(self, thread_id):
+            with self._lock:
+                super().delete_thread(thread_id)
+                self._last_seen.pop(thread_id, None)
+
+        def _touch(self, thread_id) -> None:
+            self._last_seen[thread_id] = self.clock()
+            self._last_seen.move_to_end(thread_id)
+
+        def _prune_checkpoints(self, thread_id, checkpoint_ns) -> None:
+            checkpoints = self.storage[thread_id][checkpoint_ns]
+            stale_ids = list(checkpoints)[:-self.checkpoints_per_thread]
+            if not stale_ids:
+                return
+            for checkpoint_id in stale_ids:
+                del checkpoints[checkpoint_id]
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            live_versions = set()
+            for saved, _, _ in checkpoints.values():
+                for channel, version in self.serde.loads_typed(saved)["channel_versions"].items():
+                    live_versions.add((channel, version))
+            for key in [k for k in self.blobs if k[0] == thread_id and k[1] == checkpoint_ns]:
+                if (key[2], key[3]) not in live_versions:
+                    del self.blobs[key]
+
+        def _evict_idle(self) -> None:
+            deadline = self.clock() - self.thread_ttl
+            while self._last_seen:
+                thread_id, last_seen = next(iter(self._last_seen.items()))
+                if len(self._last_seen) <= self.max_threads and last_seen >= deadline:
+                    break
+                self.delete_thread(thread_id)
+                self.evicted_threads += 1
+                logger.info(f"Поток диалога агента {thread_id} удален из памяти.")
+
+        def stats(self) -> dict:
+            """Датчик использования памяти: число потоков, контрольных точек и объем сериализованных данных."""
+            with self._lock:
+                checkpoints = sum(len(ns) for thread in self.storage.values() for ns in thread.values())
+                size = sum(len(saved[1]) + len(meta[1]) for thread in self.storage.values()
+                           for ns in thread.values() for saved, meta, _ in ns.values())
+                size += sum(len(blob[1]) for blob in self.blobs.values())
+                size += sum(len(write[2][1]) for writes in self.writes.values() for write in writes.values())
+                return {
+                    "threads": len(self._last_seen),
+                    "checkpoints": checkpoints,
+                    "blobs": len(self.blobs),
+                    "bytes": size,
+                    "evicted_threads": self.evicted_threads,
+                }
+
+    return BoundedMemorySaver()
+
+def create_sqlite_checkpointer(path: str = AGENT_CHECKPOINT_DB, thread_ttl: float = AGENT_CHECKPOINT_THREAD_TTL,
+                               checkpoints_per_thread: int = AGENT_MEMORY_CHECKPOINTS_PER_THREAD,
+                               compact_interval: float = AGENT_CHECKPOINT_COMPACT_INTERVAL, clock=time.time):
+    """
+    Создает хранилище контрольных точек в SQLite (режим WAL): состояние агента переживает
+    перезапуск и доступно нескольким процессам бота на одной машине.
+    Требует пакет langgraph-checkpoint-sqlite (импортируется при вызове).
+    """
+    import sqlite3
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    def connect():
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL NORMAL не теряет целостность, а фиксация не ждет fsync
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    class CompactingSqliteSaver(SqliteSaver):
+        """
+        SqliteSaver, который запоминает время последней активности потоков и в фоне уплотняет базу:
+        оставляет последние контрольные точки каждого потока и удаляет потоки, простаивающие дольше thread_ttl.
+        Уплотнение идет через отдельное соединение и не держит блокировку, нужную ответам агента.
+        """
+
+        def __init__(self):
+            super().__init__(connect())
+            self.path = path
+            self.thread_ttl = thread_ttl
+            self.checkpoints_per_thread = max(1, checkpoints_per_thread)
+            self.compact_interval = compact_interval
+            self.clock = clock
+            self.evicted_threads = 0
+            self.compactions = 0
+            self._stop = threading.Event()
+            self._thread = None
+
+        def setup(self) -> None:
+            if self.is_setup:
+                return
+            super().setup()
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)"
+            )
+            self.conn.commit()
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            result = super().put(config, checkpoint, metadata, new_versions)
+            with self.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO thread_activity (thread_id, last_seen) VALUES (?, ?) "
+                    "ON CONFLICT(thread_id) DO UPDATE SET last_seen = excluded.last_seen",
+                    (str(config["configurable"]["thread_id"]), self.clock()),
+                )
+            return result
+
+        def delete_thread(self, thread_id) -> None:
+            super().delete_thread(thread_id)
+            with self.cursor() as cur:
+                cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+        # --- Уплотнение ---
+        def compact(self) -> dict:
+            """Удаляет простаивающие потоки и старые контрольные точки, затем сбрасывает журнал WAL."""
+            with self.cursor():
+                pass  # создает таблицы, если база новая
+            conn = connect()
+            try:
+                with conn:
+                    deadline = self.clock() - self.thread_ttl
+                    idle = [row[0] for row in conn.execute(
+                        "SELECT thread_id FROM thread_activity WHERE last_seen < ?", (deadline,))]
+                    for thread_id in idle:
+                        conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                        conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                        conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+                    removed = conn.execute(
+                        "DELETE FROM checkpoints WHERE rowid IN ("
+                        " SELECT rowid FROM (SELECT rowid, ROW_NUMBER() OVER ("
+                        "  PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS position"
+                        "  FROM checkpoints) WHERE position > ?)",
+                        (self.checkpoints_per_thread,),
+                    ).rowcount
+                    conn.execute(
+                        "DELETE FROM writes WHERE NOT EXISTS (SELECT 1 FROM checkpoints c"
+                        " WHERE c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns"
+                        " AND c.checkpoint_id = writes.checkpoint_id)"
+                    )
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+            self.evicted_threads += len(idle)
+            self.compactions += 1
+            result = {"evicted_threads": len(idle), "removed_checkpoints": removed}
+            logger.info(f"База контрольных точек агента уплотнена: {result}")
+            return result
+
+        def start_compaction(self) -> None:
+            """Запускает фоновое периодическое уплотнение."""
+            if self._thread is not None:
+                return
+            self._stop.clear()
+
+            def run():
+                while not self._stop.wait(self.compact_interval):
+                    try:
+                        self.compact()
+                    except sqlite3.Error as e:
+                        logger.error(f"Ошибка уплотнения базы контрольных точек: {e}")
+
+            self._thread = threading.Thread(target=run, name="checkpoint-compaction", daemon=True)
+            self._thread.start()
+
+        def close(self) -> None:
+            """Останавливает уплотнение и закрывает соединение (вызывается при завершении бота)."""
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            with self.lock:
+                self.conn.close()
+
+        def stats(self) -> dict:
+            """Датчик использования: число потоков и контрольных точек, размер базы и журнала WAL."""
+            with self.cursor(transaction=False) as cur:
+                threads = cur.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0]
+                checkpoints = cur.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+                size = cur.execute("PRAGMA page_count").fetchone()[0] * cur.execute("PRAGMA page_size").fetchone()[0]
+            wal_file = f"{self.path}-wal"
+            if os.path.exists(wal_file):
+                size += os.path.getsize(wal_file)
+            return {
+                "threads": threads,
+                "checkpoints": checkpoints,
+                "bytes": size,
+                "evicted_threads": self.evicted_threads,
+                "compactions": self.compactions,
+            }
+
+    saver = CompactingSqliteSaver()
+    logger.info(f"Контрольные точки агента сохраняются в SQLite: {path}")
+    return saver
+
+CHECKPOINTERS = {
+    "memory": create_bounded_checkpointer,
+    "sqlite": create_sqlite_checkpointer,
+}
+
+def create_checkpointer(name: str = AGENT_CHECKPOINTER):
+    """Создает хранилище контрольных точек по имени; для sqlite запускает фоновое уплотнение."""
+    if name not in CHECKPOINTERS:
+        logger.warning(f"Неизвестное хранилище контрольных точек '{name}', используется memory.")
+        name = "memory"
+    checkpointer = CHECKPOINTERS[name]()
+    if hasattr(checkpointer, "start_compaction"):
+        checkpointer.start_compaction()
+    return checkpointer
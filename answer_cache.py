@@ -0,0 +1,183 @@
+import os
+import re
+import math
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+from dotenv import load_dotenv
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Минимальное косинусное сходство вопросов, при котором возвращается сохраненный ответ
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.8))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 86400))
+
+WORD_RE = re.compile(r"[a-zа-я0-9]+")
+
+STOP_WORDS = {
+    "а", "и", "в", "во", "на", "с", "со", "к", "ко", "о", "об", "от", "по", "за", "из", "у", "для", "до", "же", "ли",
+    "бы", "то", "это", "что", "чем", "как", "так", "такое", "такой", "такая", "какой", "какая", "какие",
+    "где", "когда", "почему", "зачем", "кто", "мне", "меня", "мы", "нам", "вы", "вам", "ты", "тебе", "он", "она",
+    "они", "их", "его", "ее", "есть", "был", "была", "было", "быть", "можно", "нужно", "надо", "подскажи",
+    "подскажите", "скажи", "скажите", "расскажи", "расскажите", "объясни", "объясните", "пожалуйста", "вообще",
+    "ну", "вот", "там", "тут", "бот", "the", "a", "an", "is", "what", "how",
+}
+
+# Отрицания меняют смысл вопроса («Почему не работает TON?» — не «Как работает TON?»),
+# поэтому они остаются признаками, а ответ на вопрос с другим набором отрицаний не выдается
+NEGATIONS = {"не", "ни", "нет", "нельзя", "no", "not"}
+
+# Окончания русских слов, отбрасываемые простым стеммером (от длинных к коротким)
+RU_SUFFIXES = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ие", "ые", "ой", "ей",
+    "ий", "ый", "ую", "юю", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ет", "ит", "ут", "ют", "ат", "ят",
+    "ешь", "ишь", "ть", "ться", "ется", "ится", "ся", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь",
+], key=len, reverse=True)
+
+def _stem(word: str) -> str:
+    for suffix in RU_SUFFIXES:
+        if len(word) - len(suffix) >= 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+def _negations(features: Counter) -> frozenset:
+    return frozenset(feature for feature in features if feature.startswith("n:"))
+
+def question_features(question: str) -> Counter:
+    """
+    Признаки вопроса: основы значимых слов и их символьные триграммы
+    (триграммы сглаживают опечатки и разные формы слова).
+    """
+    text = (question or "").casefold().replace("ё", "е")
+    features = Counter()
+    for word in WORD_RE.findall(text):
+        if word in NEGATIONS:
+            features["n:" + word] += 2
+            continue
+        if word in STOP_WORDS:
+            continue
+        stem = _stem(word)
+        features["w:" + stem] += 2
+        padded = f"^{stem}$"
+        for i in range(len(padded) - 2):
+            features["c:" + padded[i:i + 3]] += 1
+    return features
+
+class AnswerCache:
+    """
+    Кэш ответов с поиском похожих вопросов по TF-IDF и косинусному сходству.
+    Ограничен по размеру (LRU) и времени жизни записей, потокобезопасен.
+    Веса записей считаются при добавлении и пересчитываются, когда размер корпуса
+    меняется вдвое, поэтому поиск проходит только по спискам вхождений признаков запроса.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, maxsize: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL, clock=time.monotonic):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # id -> (признаки, ответ, expires_at)
+        self._df = Counter()           # признак -> число вопросов с ним
+        self._postings = {}            # признак -> {id: нормированный вес}
+        self._indexed_size = 1
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _weights(self, features: Counter) -> dict:
+        total = len(self._entries)
+        weights = {
+            feature: count * (math.log((1 + total) / (1 + self._df.get(feature, 0))) + 1)
+            for feature, count in features.items()
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {feature: w / norm for feature, w in weights.items()}
+
+    def _index_entry(self, entry_id, features: Counter) -> None:
+        for feature, weight in self._weights(features).items():
+            self._postings.setdefault(feature, {})[entry_id] = weight
+
+    def _reindex_if_needed(self) -> None:
+        size = len(self._entries)
+        if self._indexed_size // 2 <= size <= self._indexed_size * 2:
+            return
+        self._postings = {}
+        for entry_id, (features, _, _) in self._entries.items():
+            self._index_entry(entry_id, features)
+        self._indexed_size = max(size, 1)
+
+    def _remove(self, entry_id) -> None:
+        features, _, _ = self._entries.pop(entry_id)
+        for feature in features:
+            self._df[feature] -= 1
+            if self._df[feature] <= 0:
+                del self._df[feature]
+            postings = self._postings.get(feature)
+            if postings is not None:
+                postings.pop(entry_id, None)
+                if not postings:
+                    del self._postings[feature]
+
+    def get(self, question: str):
+        """Возвращает (ответ, сходство) для самого похожего вопроса или None."""
+        features = question_features(question)
+        with self._lock:
+            if not features or not self._entries:
+                self.misses += 1
+                return None
+            now = self._clock()
+            negations = _negations(features)
+            scores = {}
+            for feature, weight in self._weights(features).items():
+                for entry_id, entry_weight in self._postings.get(feature, {}).items():
+                    scores[entry_id] = scores.get(entry_id, 0.0) + weight * entry_weight
+
+            best_id, best_score = None, 0.0
+            expired = []
+            for entry_id, score in scores.items():
+                if now >= self._entries[entry_id][2]:
+                    expired.append(entry_id)
+                elif score > best_score and _negations(self._entries[entry_id][0]) == negations:
+                    best_id, best_score = entry_id, score
+            for entry_id in expired:
+                self._remove(entry_id)
+
+            if best_id is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][1], min(best_score, 1.0)
+
+    def set(self, question: str, answer: str) -> None:
+        features = question_features(question)
+        if not features or self.maxsize <= 0:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (features, answer, self._clock() + self.ttl)
+            self._df.update(features.keys())
+            self._index_entry(entry_id, features)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+            self._reindex_if_needed()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+        }
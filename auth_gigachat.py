@@ -3,9 +3,14 @@ import requests
 import json
 import time
 import uuid
+import tempfile
+import threading
 import base64 # Добавлен импорт base64
 from dotenv import load_dotenv
 
+from http_pool import get_http_session, http_timeout
+from metrics import span
+
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
@@ -21,27 +26,19 @@ if not GIGACHAT_CLIENT_ID or not GIGACHAT_CLIENT_SECRET:
 # Путь к файлу для кэширования токена
 TOKEN_CACHE_FILE = "gigachat_token_cache.json"
 
-def get_gigachat_access_token():
-    """
-    Получает или обновляет токен доступа GigaChat, используя кэширование.
-    """
-    current_time = time.time()
-
-    # Проверяем, существует ли кэш-файл и содержит ли он действительный токен
-    if os.path.exists(TOKEN_CACHE_FILE):
-        with open(TOKEN_CACHE_FILE, 'r') as f:
-            try:
-                cache_data = json.load(f)
-                access_token = cache_data.get("access_token")
-                expires_at = cache_data.get("expires_at")
+# За сколько секунд до истечения токена обновлять его в фоне
+TOKEN_REFRESH_MARGIN = int(os.getenv("GIGACHAT_TOKEN_REFRESH_MARGIN", 120))
 
-                if access_token and expires_at and current_time < expires_at:
-                    print("Используем кэшированный токен GigaChat.")
-                    return access_token
-            except json.JSONDecodeError:
-                # Файл поврежден, сгенерируем новый токен
-                pass
+def _expires_at_seconds(expires_at) -> float:
+    """GigaChat возвращает expires_at в миллисекундах; приводим к секундам."""
+    expires_at = float(expires_at)
+    return expires_at / 1000 if expires_at > 1e11 else expires_at
 
+def request_new_token() -> dict:
+    """
+    Запрашивает новый токен доступа GigaChat через OAuth.
+    Возвращает словарь с полями access_token и expires_at (как в ответе API).
+    """
     print("Получаем новый токен GigaChat...")
     # URL для получения токена
     token_url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
@@ -64,22 +61,18 @@ def get_gigachat_access_token():
 
     try:
         # verify=False для обхода проблем с SSL-сертификатами, в продакшене рекомендуется True
-        response = requests.post(token_url, headers=headers, data=payload, verify=False)
+        # Запрос идет через общий пул keep-alive соединений, без нового TCP+TLS рукопожатия
+        with span("gigachat", "token"):
+            response = get_http_session().post(token_url, headers=headers, data=payload, verify=False, timeout=http_timeout())
         response.raise_for_status()
 
         token_data = response.json()
         access_token = token_data.get("access_token")
-        # GigaChat API возвращает expires_at в формате timestamp Unix (количество секунд с эпохи)
-        # Если API вдруг начнет возвращать expires_in (секунды до истечения), нужно будет добавить:
-        # expires_at = current_time + token_data.get("expires_in") - 60 # для запаса
+        # GigaChat API возвращает expires_at в формате timestamp Unix в миллисекундах
         expires_at = token_data.get("expires_at")
 
-
         if access_token and expires_at:
-            with open(TOKEN_CACHE_FILE, 'w') as f:
-                json.dump({"access_token": access_token, "expires_at": expires_at}, f)
-            print("Токен GigaChat успешно получен и кэширован.")
-            return access_token
+            return {"access_token": access_token, "expires_at": expires_at}
         else:
             raise ValueError("Не удалось получить access_token или expires_at из ответа GigaChat API.")
 
@@ -91,6 +84,143 @@ def get_gigachat_access_token():
         print(f"Произошла непредвиденная ошибка: {e}")
         raise
 
+class GigaChatTokenManager:
+    """
+    Хранит токен GigaChat в памяти и обновляет его в фоне до истечения.
+    Одновременные запросы на обновление объединяются в один запрос к OAuth,
+    а файл кэша записывается атомарно.
+    """
+
+    def __init__(self, cache_file: str = TOKEN_CACHE_FILE, refresh_margin: float = TOKEN_REFRESH_MARGIN,
+                 fetch=request_new_token, clock=time.time):
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        self.fetch = fetch
+        self._clock = clock
+        self._token = None
+        self._expires_at = 0.0
+        self._cache_loaded = False
+        self._lock = threading.Lock()
+        self._timer = None
+        self._listeners = []
+        self.refreshes = 0
+
+    def add_listener(self, callback) -> None:
+        """Подписывает callback(access_token, expires_at) на получение нового токена."""
+        self._listeners.append(callback)
+
+    @property
+    def expires_at(self) -> float:
+        """Время истечения текущего токена (Unix timestamp в секундах)."""
+        return self._expires_at
+
+    def _is_fresh(self) -> bool:
+        return self._token is not None and self._clock() < self._expires_at - self.refresh_margin
+
+    def get_token(self) -> str:
+        """Возвращает действующий токен; при необходимости получает новый."""
+        if self._is_fresh():
+            return self._token
+        with self._lock:
+            if not self._cache_loaded:
+                self._load_cache()
+            if self._is_fresh():
+                return self._token
+            return self._refresh_locked()
+
+    def refresh(self, stale_token: str = None) -> str:
+        """
+        Принудительно обновляет токен (например, после ошибки 401).
+        Если токен уже обновил другой поток (он отличается от stale_token), повторного запроса не будет.
+        """
+        with self._lock:
+            if stale_token is not None and self._token is not None and self._token != stale_token and self._is_fresh():
+                return self._token
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> str:
+        token_data = self.fetch()
+        self._token = token_data["access_token"]
+        self._expires_at = _expires_at_seconds(token_data["expires_at"])
+        self.refreshes += 1
+        self._write_cache(token_data)
+        self._schedule_refresh()
+        print("Токен GigaChat успешно получен и кэширован.")
+        for callback in self._listeners:
+            try:
+                callback(self._token, self._expires_at)
+            except Exception as e:
+                print(f"Ошибка при передаче нового токена GigaChat: {e}")
+        return self._token
+
+    def _load_cache(self) -> None:
+        self._cache_loaded = True
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache_data = json.load(f)
+            access_token = cache_data.get("access_token")
+            expires_at = cache_data.get("expires_at")
+            if access_token and expires_at:
+                self._token = access_token
+                self._expires_at = _expires_at_seconds(expires_at)
+                if self._is_fresh():
+                    print("Используем кэшированный токен GigaChat.")
+                    self._schedule_refresh()
+        except (FileNotFoundError, json.JSONDecodeError, ValueError, TypeError):
+            # Файла нет или он поврежден, будет получен новый токен
+            pass
+
+    def _write_cache(self, token_data: dict) -> None:
+        # Свой временный файл у каждой записи: рабочие процессы обновляют токен одновременно
+        tmp_file = None
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.cache_file)),
+                                            prefix=f"{os.path.basename(self.cache_file)}.", suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"access_token": token_data["access_token"], "expires_at": token_data["expires_at"]}, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш токена GigaChat: {e}")
+            if tmp_file is not None and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def _schedule_refresh(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(self._expires_at - self.refresh_margin - self._clock(), 1)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self) -> None:
+        try:
+            with self._lock:
+                if not self._is_fresh():
+                    self._refresh_locked()
+        except Exception as e:
+            print(f"Фоновое обновление токена GigaChat не удалось: {e}")
+            # Повторим попытку позже; при запросе токена будет предпринята синхронная попытка
+            with self._lock:
+                self._timer = threading.Timer(30, self._background_refresh)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def stop(self) -> None:
+        """Останавливает фоновое обновление токена."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+# Общий менеджер токена процесса
+token_manager = GigaChatTokenManager()
+
+def get_gigachat_access_token():
+    """
+    Получает или обновляет токен доступа GigaChat, используя кэширование.
+    Токен хранится в памяти и обновляется в фоне до истечения.
+    """
+    return token_manager.get_token()
+
 if __name__ == "__main__":
     try:
         token = get_gigachat_access_token()
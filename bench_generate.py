@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: генерация поста агентом (цикл ReAct) и быстрым конвейером (поиск, один вызов LLM, оформление).
+GigaChat и Tavily заменяются локальными имитациями с фиксированной задержкой, поэтому сравниваются
+число обращений к модели и время, которое они занимают, без сети и без ключей API.
+
+Использование:
+    python bench_generate.py [число постов] [задержка LLM, с] [задержка поиска, с]
+"""
+
+import sys
+import time
+import warnings
+import threading
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import agent_core
+from search_cache import SearchCache
+
+DRAFT = ("**Горы зовут!** Перед походом проверьте прогноз погоды, возьмите непромокаемую куртку и запас воды. "
+         "Расскажите близким о маршруте. Jekardos Coin пригодится в кочевых лагерях: оплата без наличных "
+         "работает даже там, где нет банков. А навигатор в смартфоне заранее загрузите офлайн-картами.")
+
+class FakeGigaChat(BaseChatModel):
+    """
+    Имитация GigaChat. Без привязанных инструментов возвращает черновик поста.
+    С инструментами ведет себя как типичный ход агента: сначала web_search,
+    затем generate_telegram_post с черновиком.
+    """
+
+    latency: float = 0.3
+    tools_bound: bool = False
+    calls: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gigachat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools_bound": True})
+
+    def _agent_step(self, messages) -> AIMessage:
+        last_human = max(i for i, message in enumerate(messages) if isinstance(message, HumanMessage))
+        topic = messages[last_human].content
+        tool_results = [m for m in messages[last_human:] if isinstance(m, ToolMessage)]
+        if not tool_results:
+            return AIMessage(content="", tool_calls=[
+                {"name": "web_search", "args": {"query": topic}, "id": f"search-{len(self.calls)}"}])
+        if tool_results[-1].name == "web_search":
+            return AIMessage(content="", tool_calls=[
+                {"name": "generate_telegram_post", "args": {"topic": topic, "content_ideas": DRAFT},
+                 "id": f"post-{len(self.calls)}"}])
+        return AIMessage(content=tool_results[-1].content)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        self.calls.append(time.perf_counter())
+        message = self._agent_step(messages) if self.tools_bound else AIMessage(content=DRAFT)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+class FakeTavily:
+    """Имитация TavilySearch: ответ-словарь с результатами, как у langchain_tavily."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, payload: dict) -> dict:
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+        return {"query": payload["query"], "results": [
+            {"title": "Советы", "url": "https://example.com", "content": "Проверьте прогноз погоды и возьмите воду."},
+        ]}
+
+def _percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+def run_benchmark(posts: int = 5, llm_latency: float = 0.3, search_latency: float = 0.2) -> dict:
+    """Возвращает для каждого конвейера среднюю и p95 задержку (мс) и число вызовов LLM и поиска на пост."""
+    llm = FakeGigaChat(latency=llm_latency, calls=[])
+    tavily = FakeTavily(search_latency)
+    saved = (agent_core.get_llm, agent_core.get_tavily_search_tool, agent_core.search_cache,
+             agent_core._agent_executor, agent_core._checkpointer)
+    agent_core.get_llm = lambda: llm
+    agent_core.get_tavily_search_tool = lambda: tavily
+    agent_core.search_cache = SearchCache(lambda query: tavily.invoke({"query": query}))
+    agent_core._agent_executor = None
+    agent_core._checkpointer = None
+    results = {}
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for pipeline in agent_core.POST_PIPELINES:
+                latencies = []
+                llm_before, search_before = len(llm.calls), tavily.calls
+                post = ""
+                for i in range(posts):
+                    started = time.perf_counter()
+                    post = agent_core.create_telegram_post(f"поход в горы, выпуск {pipeline} {i}",
+                                                           thread_id=f"bench_{pipeline}_{i}", pipeline=pipeline)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                results[pipeline] = {
+                    "avg_ms": sum(latencies) / posts,
+                    "p95_ms": _percentile(latencies, 0.95),
+                    "llm_calls": (len(llm.calls) - llm_before) / posts,
+                    "search_calls": (tavily.calls - search_before) / posts,
+                    "sample_post": post,
+                }
+    finally:
+        (agent_core.get_llm, agent_core.get_tavily_search_tool, agent_core.search_cache,
+         agent_core._agent_executor, agent_core._checkpointer) = saved
+    return results
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    llm_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    search_latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    result = run_benchmark(count, llm_latency, search_latency)
+    print(f"📊 Постов: {count}, задержка LLM: {llm_latency * 1000:.0f} мс, поиска: {search_latency * 1000:.0f} мс")
+    for pipeline, data in result.items():
+        print(f"  {pipeline:6} среднее {data['avg_ms']:.0f} мс, p95 {data['p95_ms']:.0f} мс, "
+              f"вызовов LLM на пост: {data['llm_calls']:.1f}, поиска: {data['search_calls']:.1f}")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: запрос токена GigaChat через голый requests.post и через общий пул соединений.
+Запускает локальный HTTPS-сервер (самоподписанный сертификат через openssl),
+поэтому каждое новое соединение платит за TCP- и TLS-рукопожатие, как при обращении к OAuth GigaChat.
+
+Использование:
+    python bench_http_pool.py [число запросов]
+"""
+
+import os
+import sys
+import ssl
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from http_pool import create_http_session
+
+class _TokenHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят одним сегментом (иначе задержанный ACK искажает замер)
+    wbufsize = 64 * 1024
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"access_token": "local-token", "expires_at": int((time.time() + 1800) * 1000)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class LocalTokenServer:
+    """Локальная замена OAuth-эндпоинта GigaChat; считает число установленных соединений."""
+
+    def __init__(self, use_tls: bool = True):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _TokenHandler)
+        self.server.connections = 0
+        self._tmp_dir = None
+        scheme = "http"
+        if use_tls and shutil.which("openssl"):
+            self._tmp_dir = tempfile.mkdtemp()
+            cert = os.path.join(self._tmp_dir, "cert.pem")
+            key = os.path.join(self._tmp_dir, "key.pem")
+            subprocess.run(
+                ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                 "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+                check=True, capture_output=True,
+            )
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            scheme = "https"
+        self.url = f"{scheme}://127.0.0.1:{self.server.server_address[1]}/api/v2/oauth"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def connections(self) -> int:
+        return self.server.connections
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._tmp_dir:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+def _measure(post, url: str, requests_count: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests_count):
+        response = post(url, data={"scope": "GIGACHAT_API_PERS"}, verify=False, timeout=10)
+        response.raise_for_status()
+    return (time.perf_counter() - started) / requests_count * 1000
+
+def run_benchmark(requests_count: int = 50) -> dict:
+    """Возвращает среднюю задержку запроса (мс) и число соединений для обоих вариантов."""
+    warnings.filterwarnings("ignore", message="Unverified HTTPS request")
+    with LocalTokenServer() as server:
+        bare_ms = _measure(requests.post, server.url, requests_count)
+        bare_connections = server.connections
+
+        session = create_http_session()
+        pooled_ms = _measure(session.post, server.url, requests_count)
+        pooled_connections = server.connections - bare_connections
+        session.close()
+
+    return {
+        "requests": requests_count,
+        "bare_ms": bare_ms,
+        "pooled_ms": pooled_ms,
+        "saved_ms": bare_ms - pooled_ms,
+        "bare_connections": bare_connections,
+        "pooled_connections": pooled_connections,
+    }
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    result = run_benchmark(count)
+    print(f"📊 Запросов: {result['requests']}")
+    print(f"  requests.post:  {result['bare_ms']:.2f} мс/запрос, соединений: {result['bare_connections']}")
+    print(f"  общий пул:      {result['pooled_ms']:.2f} мс/запрос, соединений: {result['pooled_connections']}")
+    print(f"  экономия:       {result['saved_ms']:.2f} мс на запрос")
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный стенд без сети: синтетический поток обновлений Telegram прогоняется через настоящие
+обработчики telegram_bot.py (приложение собирается build_application) и функции agent_core.
+GigaChat, Tavily, Bot API и Firestore заменяются локальными имитациями с настраиваемой задержкой.
+Отчет: сообщений в секунду, p50/p95/p99 задержки обработчика (в целом и по видам обновлений)
+и пиковая память Python.
+
+Транспорт direct передает обновления в приложение напрямую, а Bot API имитируется в процессе.
+Транспорт webhook поднимает бота в режиме вебхука (telegram_webhook.serve_webhook): обновления
+приходят POST-запросами на вебхук, а задержка считается до последнего ответа бота в чат обновления.
+Ответы бота идут настоящими HTTP-запросами клиента PTB в локальный сервер Bot API (FakeTelegramServer),
+адрес которого передается боту так же, как TELEGRAM_API_BASE_URL. Сервер работает в том же процессе,
+поэтому часть задержки на вызов приходится на сам стенд.
+Режим sharded раскладывает тот же поток по рабочим процессам (telegram_shards.ShardRouter)
+и сравнивает пропускную способность при разном их числе.
+
+Использование:
+    python bench_load.py [число обновлений] [одновременных обновлений] [задержка LLM, с] [direct|webhook]
+    python bench_load.py [число обновлений] [не используется] [задержка LLM, с] sharded [1,2,4]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import warnings
+import tempfile
+import threading
+import tracemalloc
+import multiprocessing
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from telegram import Update
+from telegram.request import BaseRequest
+
+import agent_core
+import telegram_bot
+from bench_generate import FakeGigaChat, FakeTavily, _percentile
+from firestore_writer import FirestoreWriteBehind
+from llm_executor import share_llm_limits
+from post_dedup import PostFingerprintIndex
+from post_history import PostHistory
+from search_cache import SearchCache
+from telegram_webhook import serve_webhook
+from telegram_shards import ShardRouter
+from user_stats import stats_store
+
+# Доли видов обновлений в синтетическом потоке
+DEFAULT_MIX = {"message": 0.6, "question": 0.2, "start": 0.1, "generate": 0.05, "help": 0.05}
+QUESTIONS = ("Как купить Jekardos Coin?", "Что взять в поход?", "Где ближайший лагерь?", "Почему растет курс?")
+MESSAGES = ("Всем привет!", "Отличный пост, спасибо", "Завтра выдвигаемся", "Кто идет в горы?", "Поддерживаю")
+
+class FakeLLM(FakeGigaChat):
+    """Имитация GigaChat для всех вызовов бота: пакетная модерация получает JSON-вердикты, остальное — текст."""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = messages[-1].content if messages and isinstance(messages[-1], HumanMessage) else ""
+        if self.tools_bound or "JSON-массива" not in prompt:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        time.sleep(self.latency)
+        self.calls.append(time.perf_counter())
+        numbered = prompt.split("Сообщения для анализа (номер и текст):", 1)[-1].split("Верни ответ", 1)[0]
+        count = sum(1 for line in numbered.splitlines() if line[:1].isdigit())
+        verdicts = [{"id": i, "is_toxic": False, "toxicity_score": 1, "reason": "Обычное сообщение."}
+                    for i in range(1, count + 1)]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=json.dumps(verdicts, ensure_ascii=False)))])
+
+class FakeTelegram:
+    """
+    Имитация сервера Bot API: отвечает на методы бота, считает вызовы и запоминает,
+    когда бот последний раз писал в каждый чат.
+    """
+
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self.calls = {}
+        self.http_calls = 0
+        self.last_call_at = {}
+        self._message_id = 0
+        self._lock = threading.Lock()
+
+    def respond(self, api_method: str, params: dict) -> bytes:
+        with self._lock:
+            self.calls[api_method] = self.calls.get(api_method, 0) + 1
+            if "chat_id" in params:
+                self.last_call_at[int(params["chat_id"])] = time.perf_counter()
+            self._message_id += 1
+            message_id = self._message_id
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Нейро Jekardos", "username": "jk_bot"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = {"message_id": int(params.get("message_id", message_id)), "date": int(time.time()),
+                      "chat": {"id": int(params.get("chat_id", 1)), "type": "private"}, "text": params.get("text", "")}
+        else:
+            result = True
+        return json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+class FakeBotAPI(BaseRequest):
+    """Транспорт Bot API внутри процесса: запросы бота сразу попадают в имитацию Telegram."""
+
+    def __init__(self, telegram: FakeTelegram):
+        self.telegram = telegram
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None) -> tuple:
+        await asyncio.sleep(self.telegram.latency)
+        params = request_data.parameters if request_data else {}
+        return 200, self.telegram.respond(url.rsplit("/", 1)[-1], params)
+
+class _FakeTelegramHandler(BaseHTTPRequestHandler):
+    # Соединения бота переиспользуются (keep-alive), как с настоящим Bot API
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят одним сегментом (иначе задержанный ACK добавляет десятки мс)
+    wbufsize = 64 * 1024
+
+    def do_POST(self):
+        telegram = self.server.telegram
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or "{}")
+        else:
+            params = {key: values[-1] for key, values in parse_qs(body).items()}
+        with telegram._lock:
+            telegram.http_calls += 1
+        time.sleep(telegram.latency)
+        payload = telegram.respond(self.path.rsplit("/", 1)[-1], params)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class _FakeTelegramHTTPServer(ThreadingHTTPServer):
+    # Очередь соединений по умолчанию (5) переполняется при одновременных запросах бота
+    request_queue_size = 256
+
+class FakeTelegramServer:
+    """Локальный HTTP-сервер с имитацией Bot API: на него указывает TELEGRAM_API_BASE_URL бота."""
+
+    def __init__(self, telegram: FakeTelegram):
+        self.httpd = _FakeTelegramHTTPServer(("127.0.0.1", 0), _FakeTelegramHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.telegram = telegram
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-telegram", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def free_port() -> int:
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class _FakeSnapshot:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+class _FakeIncrement:
+    """Аналог firestore.Increment: при записи прибавляется к текущему значению поля."""
+
+    def __init__(self, delta):
+        self.delta = delta
+
+class FakeFirestore:
+    """Имитация клиента Firestore: документы в памяти, чтение и запись пакетом с задержкой."""
+
+    def __init__(self, latency: float = 0.01):
+        self.latency = latency
+        self.documents = {}
+        self.reads = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def collection(self, path: str):
+        def document(name: str = None):
+            document_path = f"{path}/{name or time.perf_counter_ns()}"
+            return SimpleNamespace(path=document_path, get=lambda: self._get(document_path))
+
+        # Запрос по коллекции: сортировка и лимит не имитируются, stream отдает все документы коллекции
+        query = SimpleNamespace(document=document, add=lambda data: self._apply([(document(), data, False)]),
+                                stream=lambda: self._stream(path))
+        query.order_by = lambda field, direction=None: query
+        query.limit = lambda count: query
+        return query
+
+    def _get(self, path: str):
+        time.sleep(self.latency)
+        with self._lock:
+            self.reads += 1
+            return _FakeSnapshot(self.documents.get(path))
+
+    def _stream(self, path: str) -> list:
+        time.sleep(self.latency)
+        with self._lock:
+            self.reads += 1
+            return [_FakeSnapshot(data) for document_path, data in self.documents.items()
+                    if document_path.rsplit("/", 1)[0] == path]
+
+    def _apply(self, operations: list) -> None:
+        time.sleep(self.latency)
+        with self._lock:
+            for ref, data, merge in operations:
+                document = self.documents.setdefault(ref.path, {}) if merge else {}
+                for field, value in data.items():
+                    if isinstance(value, _FakeIncrement):
+                        value = document.get(field, 0) + value.delta
+                    document[field] = value
+                self.documents[ref.path] = document
+                self.writes += 1
+
+    def batch(self):
+        operations = []
+        return SimpleNamespace(set=lambda ref, data, merge=False: operations.append((ref, data, merge)),
+                               commit=lambda: self._apply(operations))
+
+def make_updates(count: int, mix: dict = None, users: int = 50, seed: int = 1) -> list:
+    """Синтетический поток обновлений: (вид, словарь обновления в формате Bot API)."""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = zip(*mix.items())
+    updates = []
+    for update_id in range(1, count + 1):
+        kind = rng.choices(kinds, weights)[0]
+        user_id = 1000 + rng.randrange(users)
+        text = {
+            "message": rng.choice(MESSAGES),
+            "question": rng.choice(QUESTIONS),
+            "start": "/start",
+            "help": "/help",
+            "generate": "/generate поход в горы",
+        }[kind]
+        # Отдельный чат на обновление: по последнему ответу бота в чат видно, когда обработка закончилась
+        message = {"message_id": update_id, "date": int(time.time()), "text": text,
+                   "chat": {"id": -100000 - update_id, "type": "supergroup", "title": "Jekardos"},
+                   "from": {"id": user_id, "is_bot": False, "first_name": "Участник", "username": f"user{user_id}"}}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        updates.append((kind, {"update_id": update_id, "message": message}))
+    return updates
+
+async def _drive(application, updates: list, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {}
+
+    async def one(kind, data):
+        update = Update.de_json(data, application.bot)
+        async with semaphore:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.setdefault(kind, []).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(kind, data) for kind, data in updates))
+    return time.perf_counter() - started, latencies
+
+async def _post_webhook(port: int, url_path: str, secret: str, updates: list, concurrency: int, posted_at: dict) -> None:
+    """
+    Отправляет обновления на вебхук, как Telegram: concurrency постоянных HTTP/1.1-соединений,
+    по одному запросу за раз в каждом (клиент на asyncio-потоках почти не добавляет своих накладных
+    расходов, в отличие от httpx.AsyncClient).
+    """
+    queue = asyncio.Queue()
+    for item in updates:
+        queue.put_nowait(item)
+
+    async def worker():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while not queue.empty():
+                kind, data = queue.get_nowait()
+                body = json.dumps(data).encode("utf-8")
+                posted_at[data["update_id"]] = (kind, data["message"]["chat"]["id"], time.perf_counter())
+                writer.write((f"POST /{url_path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+                              f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                              f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+                status = int((await reader.readline()).split()[1])
+                length = 0
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                if status != 200:
+                    raise RuntimeError(f"Вебхук ответил {status} на обновление {data['update_id']}")
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(updates)) or 1)))
+
+async def _drive_webhook(application, updates: list, concurrency: int, telegram: FakeTelegram) -> tuple:
+    port, secret = free_port(), "load-test-secret"
+    stop_event = asyncio.Event()
+    server = asyncio.create_task(serve_webhook(
+        application, stop_event, listen="127.0.0.1", port=port, url_path="telegram",
+        webhook_url=f"http://127.0.0.1:{port}/telegram", secret_token=secret, drain_timeout=120))
+    for _ in range(200):
+        if application.running or server.done():
+            break
+        await asyncio.sleep(0.025)
+    if server.done():
+        server.result()
+
+    posted_at = {}
+    started = time.perf_counter()
+    await _post_webhook(port, "telegram", secret, updates, concurrency, posted_at)
+    # Остановка с дренажом: serve_webhook дожидается всех принятых обновлений
+    stop_event.set()
+    await server
+    seconds = time.perf_counter() - started
+
+    latencies = {}
+    for kind, chat_id, posted in posted_at.values():
+        if chat_id in telegram.last_call_at:
+            latencies.setdefault(kind, []).append(telegram.last_call_at[chat_id] - posted)
+    return seconds, latencies
+
+def _install_fakes(llm_latency: float, search_latency: float, telegram_latency: float, firestore_latency: float,
+                   streaming: bool = None) -> tuple:
+    """
+    Подменяет GigaChat, Tavily, Firestore, снимок рейтинга и журнал постов имитациями;
+    возвращает их и функцию отката.
+    """
+    llm = FakeLLM(latency=llm_latency, calls=[])
+    tavily = FakeTavily(search_latency)
+    telegram = FakeTelegram(telegram_latency)
+    fake_db = FakeFirestore(firestore_latency)
+    writer = FirestoreWriteBehind(fake_db)
+    snapshot_dir = tempfile.TemporaryDirectory()
+
+    saved_core = (agent_core.get_llm, agent_core.get_tavily_search_tool, agent_core.search_cache,
+                  agent_core._agent_executor, agent_core._checkpointer)
+    saved_bot = (telegram_bot.db, telegram_bot.firestore, telegram_bot.firestore_writer, telegram_bot.GENERATE_STREAMING)
+    saved_loader = stats_store.load_profile
+    saved_snapshot = telegram_bot.leaderboard.snapshot_file
+    saved_posts = (telegram_bot.post_history, telegram_bot.post_index, telegram_bot._published_posts_loaded)
+    agent_core.get_llm = lambda: llm
+    agent_core.get_tavily_search_tool = lambda: tavily
+    agent_core.search_cache = SearchCache(agent_core._tavily_search)
+    agent_core._agent_executor = None
+    agent_core._checkpointer = None
+    telegram_bot.db = fake_db
+    telegram_bot.firestore = SimpleNamespace(SERVER_TIMESTAMP="SERVER_TIMESTAMP", Increment=_FakeIncrement)
+    telegram_bot.firestore_writer = writer
+    if streaming is not None:
+        telegram_bot.GENERATE_STREAMING = streaming
+    stats_store.configure(load_profile=telegram_bot._load_user_profile)
+    # Синтетические участники не должны попасть в настоящий снимок рейтинга
+    telegram_bot.leaderboard.snapshot_file = os.path.join(snapshot_dir.name, "leaderboard.json")
+    # ...а опубликованные посты — в настоящий журнал и индекс повторов
+    telegram_bot.post_history = PostHistory(os.path.join(snapshot_dir.name, "post_history"), legacy_file=None)
+    telegram_bot.post_history.add_listener(telegram_bot.index_published_post)
+    telegram_bot.post_index = PostFingerprintIndex()
+    telegram_bot._published_posts_loaded = False
+
+    def restore():
+        (agent_core.get_llm, agent_core.get_tavily_search_tool, agent_core.search_cache,
+         agent_core._agent_executor, agent_core._checkpointer) = saved_core
+        (telegram_bot.db, telegram_bot.firestore, telegram_bot.firestore_writer,
+         telegram_bot.GENERATE_STREAMING) = saved_bot
+        stats_store.configure(load_profile=saved_loader)
+        telegram_bot.leaderboard.snapshot_file = saved_snapshot
+        telegram_bot.post_history, telegram_bot.post_index, telegram_bot._published_posts_loaded = saved_posts
+        snapshot_dir.cleanup()
+
+    return llm, telegram, fake_db, writer, restore
+
+def run_load(updates: int = 200, concurrency: int = 32, llm_latency: float = 0.05, search_latency: float = 0.02,
+             telegram_latency: float = 0.01, firestore_latency: float = 0.005, mix: dict = None,
+             streaming: bool = None, transport: str = "direct") -> dict:
+    """Прогоняет поток обновлений через бота на имитациях и возвращает отчет о пропускной способности."""
+    llm, telegram, fake_db, writer, restore = _install_fakes(llm_latency, search_latency, telegram_latency,
+                                                              firestore_latency, streaming)
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    async def scenario():
+        application = telegram_bot.build_application("123456:LOAD-TEST", request=FakeBotAPI(telegram))
+        application.add_error_handler(on_error)
+        await application.initialize()
+        try:
+            return await _drive(application, make_updates(updates, mix), concurrency)
+        finally:
+            await application.shutdown()
+
+    async def webhook_scenario():
+        with FakeTelegramServer(telegram) as server:
+            application = telegram_bot.build_application("123456:LOAD-TEST", api_base_url=server.base_url)
+            application.add_error_handler(on_error)
+            return await _drive_webhook(application, make_updates(updates, mix), concurrency, telegram)
+
+    tracemalloc.start()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            seconds, latencies = asyncio.run(webhook_scenario() if transport == "webhook" else scenario())
+        writer.flush()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        writer.close()
+        restore()
+
+    every = [value for values in latencies.values() for value in values]
+    return {
+        "updates": len(every),
+        "seconds": seconds,
+        "messages_per_sec": len(every) / seconds,
+        "p50_ms": _percentile(every, 0.50) * 1000,
+        "p95_ms": _percentile(every, 0.95) * 1000,
+        "p99_ms": _percentile(every, 0.99) * 1000,
+        "peak_memory_mb": peak_bytes / 2 ** 20,
+        "by_kind": {kind: {"count": len(values), "p50_ms": _percentile(values, 0.50) * 1000,
+                           "p95_ms": _percentile(values, 0.95) * 1000}
+                    for kind, values in sorted(latencies.items())},
+        "errors": len(errors),
+        "llm_calls": len(llm.calls),
+        "telegram_calls": dict(telegram.calls),
+        "telegram_http_calls": telegram.http_calls,
+        "firestore_reads": fake_db.reads,
+        "firestore_writes": fake_db.writes,
+    }
+
+_worker_fakes = None
+
+def _sharded_worker_application(shard: int, shards: int, errors_queue, llm_latency: float, search_latency: float,
+                                telegram_latency: float, firestore_latency: float, streaming: bool):
+    """Приложение рабочего процесса стенда: тот же бот на имитациях внутри процесса."""
+    logging.disable(logging.INFO)
+    warnings.simplefilter("ignore")
+    global _worker_fakes
+    # Имитации живут до конца процесса (в них временный каталог снимка рейтинга)
+    _worker_fakes = _install_fakes(llm_latency, search_latency, telegram_latency, firestore_latency, streaming)
+    # Как в боте: процессы делят общий лимит LLM, а не получают каждый по полному
+    share_llm_limits(shards)
+    application = telegram_bot.build_application("123456:LOAD-TEST", request=FakeBotAPI(_worker_fakes[1]))
+
+    async def on_error(update, context):
+        errors_queue.put(getattr(update, "update_id", None))
+
+    application.add_error_handler(on_error)
+    return application
+
+def run_sharded_load(updates: int = 200, workers: int = 2, llm_latency: float = 0.05, search_latency: float = 0.02,
+                     telegram_latency: float = 0.01, firestore_latency: float = 0.005, mix: dict = None,
+                     streaming: bool = None) -> dict:
+    """
+    Тот же поток обновлений, но через telegram_shards.ShardRouter: workers рабочих процессов
+    с обновлениями, разложенными по пользователям. Задержка — от передачи обновления роутеру
+    до окончания его обработки в рабочем процессе; время запуска процессов не учитывается.
+    """
+    context = multiprocessing.get_context("spawn")
+    done_queue, errors_queue = context.Queue(), context.Queue()
+    router = ShardRouter(workers, _sharded_worker_application, done_queue=done_queue,
+                         build_args=(errors_queue, llm_latency, search_latency, telegram_latency,
+                                     firestore_latency, streaming))
+    stream = [(kind, Update.de_json(data, None)) for kind, data in make_updates(updates, mix)]
+    router.start()
+    try:
+        # Прогрев: по одному /help в каждый процесс, чтобы замер не включал их запуск
+        for shard, (_, data) in enumerate(make_updates(workers, {"help": 1}, seed=2)):
+            data["update_id"] += 10 ** 6
+            data["message"]["from"]["id"] = workers * 1000 + shard
+            router.dispatch(Update.de_json(data, None))
+        for _ in range(workers):
+            done_queue.get(timeout=120)
+
+        kinds, sent_at = {}, {}
+        started = time.monotonic()
+        for kind, update in stream:
+            kinds[update.update_id] = kind
+            sent_at[update.update_id] = time.monotonic()
+            router.dispatch(update)
+        latencies = {}
+        for _ in stream:
+            update_id, finished_at = done_queue.get(timeout=120)
+            latencies.setdefault(kinds[update_id], []).append(finished_at - sent_at[update_id])
+        seconds = time.monotonic() - started
+    finally:
+        router.stop()
+    errors = 0
+    while not errors_queue.empty():
+        errors_queue.get()
+        errors += 1
+
+    every = [value for values in latencies.values() for value in values]
+    return {
+        "updates": len(every),
+        "workers": workers,
+        "seconds": seconds,
+        "messages_per_sec": len(every) / seconds,
+        "p50_ms": _percentile(every, 0.50) * 1000,
+        "p95_ms": _percentile(every, 0.95) * 1000,
+        "p99_ms": _percentile(every, 0.99) * 1000,
+        "by_kind": {kind: {"count": len(values), "p50_ms": _percentile(values, 0.50) * 1000,
+                           "p95_ms": _percentile(values, 0.95) * 1000}
+                    for kind, values in sorted(latencies.items())},
+        "errors": errors,
+        "dispatched": router.stats()["dispatched"],
+        "restarts": sum(router.stats()["restarts"]),
+    }
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    llm_latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    transport = sys.argv[4] if len(sys.argv) > 4 else "direct"
+    if transport == "sharded":
+        baseline = None
+        for workers in (int(value) for value in (sys.argv[5] if len(sys.argv) > 5 else "1,2,4").split(",")):
+            report = run_sharded_load(count, workers, llm_latency)
+            baseline = baseline or report["messages_per_sec"] / workers
+            print(f"📊 Процессов: {workers}, обновлений: {report['updates']} за {report['seconds']:.2f} с, "
+                  f"{report['messages_per_sec']:.1f} сообщ./с (x{report['messages_per_sec'] / baseline:.2f}), "
+                  f"p50 {report['p50_ms']:.0f} мс, p99 {report['p99_ms']:.0f} мс, ошибок: {report['errors']}, "
+                  f"по процессам: {report['dispatched']}")
+        sys.exit(0)
+    report = run_load(count, concurrency, llm_latency, transport=transport)
+    print(f"📊 Обновлений: {report['updates']} за {report['seconds']:.2f} с, одновременно до {concurrency}, "
+          f"задержка LLM {llm_latency * 1000:.0f} мс, транспорт {transport}")
+    print(f"  пропускная способность: {report['messages_per_sec']:.1f} сообщ./с")
+    print(f"  задержка обработчика: p50 {report['p50_ms']:.0f} мс, p95 {report['p95_ms']:.0f} мс, p99 {report['p99_ms']:.0f} мс")
+    print(f"  пиковая память Python: {report['peak_memory_mb']:.1f} МБ, ошибок обработчиков: {report['errors']}")
+    for kind, data in report["by_kind"].items():
+        print(f"  {kind:9} {data['count']:5} шт., p50 {data['p50_ms']:.0f} мс, p95 {data['p95_ms']:.0f} мс")
+    print(f"  вызовов LLM: {report['llm_calls']}, Bot API: {sum(report['telegram_calls'].values())}, "
+          f"Firestore: чтений {report['firestore_reads']}, записей {report['firestore_writes']}")
@@ -5,7 +5,8 @@ from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
 # ИСПРАВЛЕНИЕ: Импортируем create_telegram_post из agent_core
-from agent_core import create_telegram_post
+from agent_core import create_telegram_post_async
+from telegram_webhook import run_application, bot_api_base_url, TELEGRAM_CONCURRENT_UPDATES
 from langchain_core.messages import HumanMessage
 
 # Загружаем переменные окружения
@@ -48,7 +49,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     try:
         # ИСПРАВЛЕНИЕ: Используем run_agent_for_post напрямую
-        agent_response_content = create_telegram_post(user_message)
+        agent_response_content = await create_telegram_post_async(user_message, f"user_{update.effective_user.id}")
         logger.info(f"Ответ агента: {agent_response_content}")
 
         # Отправляем ответ пользователю Telegram
@@ -63,16 +64,19 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 def main() -> None:
     """Запускает бота."""
     # Создаем Application и передаем токен бота
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    builder = Application.builder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+    if bot_api_base_url():
+        builder = builder.base_url(bot_api_base_url())
+    application = builder.build()
 
     # Регистрируем обработчики
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    # Запускаем бота (он будет ждать обновлений)
+    # Запускаем бота (опрос или вебхук, по TELEGRAM_MODE)
     logger.info("Бот запущен. Ожидание сообщений...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    run_application(application)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
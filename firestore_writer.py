@@ -0,0 +1,148 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+from ttl_cache import TTLCache
+from metrics import registry
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Сколько записей накапливать перед отправкой одного WriteBatch (лимит Firestore — 500)
+FIRESTORE_BATCH_SIZE = min(int(os.getenv("FIRESTORE_BATCH_SIZE", 100)), 500)
+# Максимальная задержка записи в секундах
+FIRESTORE_FLUSH_INTERVAL = float(os.getenv("FIRESTORE_FLUSH_INTERVAL", 2))
+# Максимум записей в очереди; при переполнении самые старые отбрасываются
+FIRESTORE_MAX_PENDING = int(os.getenv("FIRESTORE_MAX_PENDING", 10000))
+# Сколько уже зарегистрированных пользователей помнить, чтобы не читать их профиль повторно
+FIRESTORE_KNOWN_USERS_MAX = int(os.getenv("FIRESTORE_KNOWN_USERS_MAX", 100000))
+
+class FirestoreWriteBehind:
+    """
+    Отложенная запись в Firestore: операции копятся в ограниченной очереди
+    и отправляются фоновым потоком через WriteBatch по размеру пакета или по таймеру.
+    Также хранит множество уже известных пользователей, чтобы пропускать чтение профиля.
+    """
+
+    def __init__(self, db, batch_size: int = FIRESTORE_BATCH_SIZE, flush_interval: float = FIRESTORE_FLUSH_INTERVAL,
+                 max_pending: int = FIRESTORE_MAX_PENDING, known_users_max: int = FIRESTORE_KNOWN_USERS_MAX):
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.known_users = TTLCache(known_users_max, float("inf"))
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.flushes = 0
+        self.records_written = 0
+        self.flush_errors = 0
+        self.dropped = 0
+        self.last_flush_seconds = 0.0
+
+    # --- Известные пользователи ---
+    def is_known_user(self, user_id: str) -> bool:
+        return self.known_users.get(user_id) is not None
+
+    def mark_user_known(self, user_id: str) -> None:
+        self.known_users.set(user_id, True)
+
+    # --- Постановка операций в очередь ---
+    def set(self, document_ref, data: dict, merge: bool = False) -> None:
+        """Ставит в очередь запись документа (аналог document_ref.set)."""
+        self._enqueue(("set", document_ref, data, merge))
+
+    def add(self, collection_ref, data: dict) -> None:
+        """Ставит в очередь добавление документа с автоматическим ID (аналог collection_ref.add)."""
+        self._enqueue(("set", collection_ref.document(), data, False))
+
+    def _enqueue(self, operation) -> None:
+        with self._condition:
+            if self._closed:
+                logger.warning("Очередь записи в Firestore закрыта, операция выполняется сразу.")
+                self._commit([operation])
+                return
+            if len(self._pending) >= self.max_pending:
+                self._pending.popleft()
+                self.dropped += 1
+                logger.warning("Очередь записи в Firestore переполнена, самая старая запись отброшена.")
+            self._pending.append(operation)
+            self._ensure_thread()
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="firestore-writer", daemon=True)
+            self._thread.start()
+
+    # --- Фоновая отправка ---
+    def _take_batch(self) -> list:
+        count = min(self.batch_size, len(self._pending))
+        return [self._pending.popleft() for _ in range(count)]
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._condition.wait(self.flush_interval)
+                if self._closed and not self._pending:
+                    return
+                batch = self._take_batch()
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, operations: list) -> None:
+        started = time.perf_counter()
+        error = False
+        try:
+            write_batch = self.db.batch()
+            for _, ref, data, merge in operations:
+                write_batch.set(ref, data, merge=merge)
+            write_batch.commit()
+            self.flushes += 1
+            self.records_written += len(operations)
+            logger.info(f"В Firestore записано {len(operations)} операций одним пакетом.")
+        except Exception as e:
+            error = True
+            self.flush_errors += 1
+            logger.error(f"Ошибка пакетной записи в Firestore ({len(operations)} операций): {e}", exc_info=True)
+        finally:
+            self.last_flush_seconds = time.perf_counter() - started
+            registry.observe("firestore", "batch_commit", self.last_flush_seconds, error=error, handler="writer")
+
+    def flush(self) -> None:
+        """Синхронно отправляет все накопленные операции."""
+        while True:
+            with self._condition:
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._commit(batch)
+
+    def close(self, timeout: float = 10) -> None:
+        """Дописывает очередь и останавливает фоновый поток (вызывается при завершении бота)."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        logger.info(f"Очередь записи в Firestore остановлена: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "records_written": self.records_written,
+            "flush_errors": self.flush_errors,
+            "dropped": self.dropped,
+            "last_flush_seconds": self.last_flush_seconds,
+            "known_users": len(self.known_users),
+        }
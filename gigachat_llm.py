@@ -3,7 +3,8 @@ from dotenv import load_dotenv
 # ИСПРАВЛЕНИЕ: НОВАЯ, КОРРЕКТНАЯ СТРОКА ИМПОРТА GigaChat
 from langchain_gigachat import GigaChat
 
-from auth_gigachat import get_gigachat_access_token
+from auth_gigachat import get_gigachat_access_token, token_manager
+from http_pool import get_shared_gigachat, apply_access_token
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -12,20 +13,30 @@ class GigaChatLLM:
     def __init__(self):
         self.model_name = os.getenv("GIGACHAT_MODEL_NAME", "GigaChat-2")
         self.scope = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
+        self.access_token = None
         self.llm = self._initialize_gigachat()
 
     def _initialize_gigachat(self):
         """
-        Инициализирует объект GigaChat с актуальным токеном.
+        Возвращает общий клиент GigaChat с актуальным токеном.
+        Токен, обновленный менеджером в фоне, подставляется в клиент автоматически.
         """
-        access_token = get_gigachat_access_token()
-        # ИСПРАВЛЕНИЕ: Используем GigaChat с правильными параметрами
-        return GigaChat(
-            access_token=access_token,
-            model=self.model_name,
-            scope=self.scope,
-            verify_ssl_certs=False
-        )
+        self.access_token = get_gigachat_access_token()
+        return get_shared_gigachat()
+
+    def _apply_token(self, access_token: str, expires_at: float = 0) -> None:
+        """
+        Подставляет новый токен в уже созданный клиент GigaChat без его пересоздания.
+        Если версия библиотеки не позволяет этого, клиент создается заново.
+        """
+        self.access_token = access_token
+        if not apply_access_token(self.llm, access_token, expires_at):
+            self.llm = GigaChat(
+                access_token=access_token,
+                model=self.model_name,
+                scope=self.scope,
+                verify_ssl_certs=False
+            )
 
     def get_llm(self):
         """
@@ -35,15 +46,12 @@ class GigaChatLLM:
 
     def refresh_token_and_reinitialize(self):
         """
-        Обновляет токен и повторно инициализирует модель GigaChat.
-        Вызывается, если текущий токен истек.
+        Обновляет токен и передает его текущей модели GigaChat.
+        Вызывается, если текущий токен истек. Одновременные вызовы приводят к одному запросу токена.
         """
-        print("Токен GigaChat мог истечь, переинициализируем модель.")
-        # Удаляем кэшированный токен, чтобы get_gigachat_access_token гарантированно получил новый
-        if os.path.exists("gigachat_token_cache.json"):
-            os.remove("gigachat_token_cache.json")
-            print("Кэшированный токен удален.")
-        self.llm = self._initialize_gigachat()
+        print("Токен GigaChat мог истечь, обновляем токен.")
+        access_token = token_manager.refresh(stale_token=self.access_token)
+        self._apply_token(access_token, token_manager.expires_at)
         return self.llm
 
 # Пример использования:
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import threading
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+
+class Hedger:
+    """
+    Хеджирование запроса двумя способами: основной запускается сразу, резервный — через delay секунд
+    (0 — одновременно) или сразу после неудачи основного. Побеждает первый результат, прошедший
+    проверку accept; проигравший отменяется. Отмена кооперативная: каждый способ получает
+    threading.Event и должен прекращать работу, когда он установлен (вызов в потоке прервать нельзя).
+    Исключения из fatal (например, отказ по лимиту пользователя) не запускают резервный способ,
+    а пробрасываются сразу.
+    """
+
+    def __init__(self, delay: float, accept, names: tuple = ("primary", "backup"), fatal: tuple = ()):
+        self.delay = delay
+        self.accept = accept
+        self.names = names
+        self.fatal = fatal
+        self.requests = 0
+        self.backups_started = 0
+        self.wins = {name: 0 for name in names}
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _is_accepted(self, task) -> bool:
+        if task.cancelled() or task.exception() is not None:
+            return False
+        return bool(self.accept(task.result()))
+
+    def _raise_fatal(self, task) -> None:
+        if not task.cancelled() and isinstance(task.exception(), self.fatal):
+            raise task.exception()
+
+    def _count(self, field: str, name: str = None) -> None:
+        with self._lock:
+            if name is None:
+                setattr(self, field, getattr(self, field) + 1)
+            else:
+                self.wins[name] += 1
+
+    async def run(self, primary, backup):
+        """
+        primary и backup — функции, которые принимают событие отмены и возвращают awaitable.
+        Возвращает первый принятый результат; если ни один не принят — результат резервного способа
+        (как при обычном последовательном откате), а если и он упал — основного.
+        """
+        self._count("requests")
+        cancel_event = threading.Event()
+        primary_name, backup_name = self.names
+        primary_task = asyncio.ensure_future(primary(cancel_event))
+        backup_task = None
+        try:
+            # Даже при delay=0 основной способ делает первый шаг раньше резервного:
+            # отказ по лимиту (fatal) виден до запуска резервного
+            await asyncio.wait({primary_task}, timeout=self.delay)
+            if primary_task.done():
+                self._raise_fatal(primary_task)
+                if self._is_accepted(primary_task):
+                    self._count("wins", primary_name)
+                    return primary_task.result()
+
+            self._count("backups_started")
+            logger.info(f"Запущен резервный способ '{backup_name}' (основной {'не удался' if primary_task.done() else 'еще работает'}).")
+            backup_task = asyncio.ensure_future(backup(cancel_event))
+            names = {primary_task: primary_name, backup_task: backup_name}
+            pending = {task for task in names if not task.done()}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self._raise_fatal(task)
+                    if self._is_accepted(task):
+                        self._count("wins", names[task])
+                        logger.info(f"Победил способ '{names[task]}'.")
+                        return task.result()
+
+            self._count("failures")
+            for task in (backup_task, primary_task):
+                if not task.cancelled() and task.exception() is None:
+                    return task.result()
+            raise backup_task.exception()
+        finally:
+            cancel_event.set()
+            for task in (primary_task, backup_task):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "backups_started": self.backups_started,
+                "wins": dict(self.wins),
+                "failures": self.failures,
+            }
@@ -0,0 +1,101 @@
+import os
+import base64
+import logging
+import threading
+from dotenv import load_dotenv
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Размер пула соединений (keep-alive) для трафика GigaChat
+GIGACHAT_HTTP_POOL_SIZE = int(os.getenv("GIGACHAT_HTTP_POOL_SIZE", 20))
+# Таймауты в секундах: установка соединения и ожидание ответа
+GIGACHAT_HTTP_CONNECT_TIMEOUT = float(os.getenv("GIGACHAT_HTTP_CONNECT_TIMEOUT", 5))
+GIGACHAT_HTTP_TIMEOUT = float(os.getenv("GIGACHAT_HTTP_TIMEOUT", 60))
+GIGACHAT_HTTP_MAX_RETRIES = int(os.getenv("GIGACHAT_HTTP_MAX_RETRIES", 2))
+
+_session = None
+_gigachat = None
+# Отдельные блокировки: создание клиента GigaChat запрашивает токен через общую сессию
+_session_lock = threading.Lock()
+_gigachat_lock = threading.Lock()
+
+def http_timeout() -> tuple:
+    """Таймауты (connect, read) для запросов через общий пул."""
+    return GIGACHAT_HTTP_CONNECT_TIMEOUT, GIGACHAT_HTTP_TIMEOUT
+
+def create_http_session(pool_size: int = GIGACHAT_HTTP_POOL_SIZE):
+    """Создает сессию requests с пулом keep-alive соединений."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=GIGACHAT_HTTP_MAX_RETRIES)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_http_session():
+    """Возвращает общую для процесса сессию requests (OAuth GigaChat и прочие запросы)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_http_session()
+    return _session
+
+def gigachat_client_kwargs() -> dict:
+    """Параметры пула и таймаутов для клиента GigaChat (httpx внутри библиотеки gigachat)."""
+    return {
+        "timeout": GIGACHAT_HTTP_TIMEOUT,
+        "max_connections": GIGACHAT_HTTP_POOL_SIZE,
+        "max_retries": GIGACHAT_HTTP_MAX_RETRIES,
+    }
+
+def apply_access_token(llm, access_token: str, expires_at: float = 0) -> bool:
+    """
+    Подставляет токен в уже созданный клиент GigaChat, не пересоздавая его пул соединений.
+    Возвращает False, если версия библиотеки этого не позволяет.
+    """
+    try:
+        from gigachat.models import AccessToken
+        client = llm._client
+        if not hasattr(client, "_access_token"):
+            return False
+        client._access_token = AccessToken(access_token=access_token, expires_at=int(expires_at * 1000))
+        return True
+    except (ImportError, AttributeError):
+        return False
+
+def get_shared_gigachat():
+    """
+    Возвращает единственный на процесс клиент GigaChat, через пул соединений которого
+    идет весь трафик к API. Токен берется из менеджера токенов и обновляется в нем же;
+    учетные данные передаются клиенту как запасной способ авторизации.
+    """
+    global _gigachat
+    if _gigachat is None:
+        with _gigachat_lock:
+            if _gigachat is None:
+                from langchain_gigachat import GigaChat
+                from auth_gigachat import token_manager, GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET, GIGACHAT_SCOPE
+                from metrics import llm_callbacks
+
+                client_credentials = f"{GIGACHAT_CLIENT_ID}:{GIGACHAT_CLIENT_SECRET}"
+                api_base = os.getenv("GIGACHAT_API_BASE")
+                llm = GigaChat(
+                    credentials=base64.b64encode(client_credentials.encode("utf-8")).decode("utf-8"),
+                    access_token=token_manager.get_token(),
+                    scope=GIGACHAT_SCOPE,
+                    verify_ssl_certs=False,
+                    base_url=api_base if api_base else None,
+                    model=os.getenv("GIGACHAT_MODEL_NAME", "GigaChat-2"),
+                    callbacks=llm_callbacks(),
+                    **gigachat_client_kwargs()
+                )
+                token_manager.add_listener(lambda token, expires_at: apply_access_token(llm, token, expires_at))
+                _gigachat = llm
+                logger.info(f"Общий клиент GigaChat создан (пул соединений: {GIGACHAT_HTTP_POOL_SIZE}).")
+    return _gigachat
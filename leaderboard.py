@@ -0,0 +1,237 @@
+import os
+import glob
+import json
+import bisect
+import logging
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+from sharding import shard_of
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+LEADERBOARD_TOP_SIZE = int(os.getenv("LEADERBOARD_TOP_SIZE", 10))
+LEADERBOARD_SNAPSHOT_FILE = os.getenv("LEADERBOARD_SNAPSHOT_FILE", "leaderboard_snapshot.json")
+# Как часто (в секундах) сохранять снимок рейтинга на диск
+LEADERBOARD_SNAPSHOT_INTERVAL = int(os.getenv("LEADERBOARD_SNAPSHOT_INTERVAL", 300))
+
+def shard_snapshot_file(snapshot_file: str, shard: int) -> str:
+    """Файл снимка рабочего процесса в многопроцессном режиме: leaderboard_snapshot.shard0.json и т.д."""
+    root, ext = os.path.splitext(snapshot_file)
+    return f"{root}.shard{shard}{ext}"
+
+class Leaderboard:
+    """
+    Рейтинг участников по activity_score, который обновляется инкрементально.
+    Хранит отсортированный список (-очки, user_id) и индекс user_id -> (очки, имя),
+    поэтому обновление стоит O(log n), а топ отдается из готового текста.
+
+    В многопроцессном режиме каждый рабочий процесс ведет своих участников (шардирование
+    по user_id) и сохраняет только их, а остальных подтягивает из снимков соседних процессов.
+    Снимок хранит число процессов, при котором он записан: после изменения TELEGRAM_WORKERS
+    участники перераспределяются между процессами при загрузке.
+    """
+
+    def __init__(self, top_size: int = LEADERBOARD_TOP_SIZE, snapshot_file: str = LEADERBOARD_SNAPSHOT_FILE):
+        self.top_size = top_size
+        self.snapshot_file = snapshot_file
+        self.base_file = snapshot_file
+        self.shard = 0
+        self.shards = 1
+        self.peer_files = []
+        self._sorted = []
+        self._index = {}
+        self._owned = set()
+        self._top_text = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        # Сохранения идут по одному: финальный снимок не обгоняет периодический и не затирается им
+        self._save_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def use_shard(self, shard: int, shards: int) -> None:
+        """Переключает рейтинг в режим рабочего процесса: свой файл снимка, остальные — соседние."""
+        self.shard, self.shards = shard, shards
+        self.snapshot_file = shard_snapshot_file(self.base_file, shard)
+        self.peer_files = [shard_snapshot_file(self.base_file, other) for other in range(shards) if other != shard]
+
+    def _owns(self, user_id: str) -> bool:
+        return shard_of(user_id, self.shards) == self.shard
+
+    def _set(self, user_id: str, score: int, name: str) -> bool:
+        old = self._index.get(user_id)
+        if old == (score, name):
+            return False
+        if old is not None:
+            position = bisect.bisect_left(self._sorted, (-old[0], user_id))
+            del self._sorted[position]
+        else:
+            position = None
+        new_position = bisect.bisect_left(self._sorted, (-score, user_id))
+        self._sorted.insert(new_position, (-score, user_id))
+        self._index[user_id] = (score, name)
+        if new_position < self.top_size or (position is not None and position < self.top_size):
+            self._top_text = None
+        return True
+
+    def update(self, user_id: str, stats: dict) -> None:
+        """Обновляет очки пользователя (подписывается на изменения статистики)."""
+        score = int(stats.get("activity_score") or 0)
+        name = stats.get("username") or f"user_{user_id}"
+        with self._lock:
+            self._owned.add(user_id)
+            if self._set(user_id, score, name):
+                self._dirty = True
+
+    def rank(self, user_id: str):
+        """Место пользователя в рейтинге (с 1) или None."""
+        with self._lock:
+            entry = self._index.get(user_id)
+            if entry is None:
+                return None
+            return bisect.bisect_left(self._sorted, (-entry[0], user_id)) + 1
+
+    def profile(self, user_id: str):
+        """Очки и имя пользователя в формате профиля (для статистики без Firestore) или None."""
+        with self._lock:
+            entry = self._index.get(user_id)
+        if entry is None:
+            return None
+        return {"activity_score": entry[0], "username": entry[1]}
+
+    def top(self) -> list:
+        """Список (имя, очки) лучших участников."""
+        with self._lock:
+            return [(self._index[user_id][1], -neg_score) for neg_score, user_id in self._sorted[:self.top_size]]
+
+    def format_top(self) -> str:
+        """Текст рейтинга для Telegram; пересобирается только при изменении топа."""
+        with self._lock:
+            if self._top_text is not None:
+                return self._top_text
+            entries = [(self._index[user_id][1], -neg_score) for neg_score, user_id in self._sorted[:self.top_size]]
+            if not entries:
+                text = "Рейтинг сообщества JK Coin пока пуст: участники еще не проявили активность."
+            else:
+                lines = [f"{place}. {name} - {score} очков" for place, (name, score) in enumerate(entries, 1)]
+                text = "Рейтинг сообщества JK Coin:\n" + "\n".join(lines) + "\n\nРейтинг обновляется автоматически."
+            self._top_text = text
+            return text
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    # --- Снимки на диск ---
+    def save_snapshot(self) -> None:
+        """Атомарно сохраняет рейтинг своих участников в файл (запись во временный файл и замена)."""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {"shards": self.shards, "users": {user_id: list(self._index[user_id]) for user_id in self._owned}}
+                self._dirty = False
+            tmp_file = None
+            try:
+                fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.snapshot_file)),
+                                                prefix=f"{os.path.basename(self.snapshot_file)}.", suffix=".tmp")
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_file, self.snapshot_file)
+                logger.info(f"Снимок рейтинга сохранен ({len(data['users'])} участников).")
+            except OSError as e:
+                self._dirty = True
+                logger.error(f"Не удалось сохранить снимок рейтинга: {e}")
+                if tmp_file is not None and os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+
+    def _read_snapshot(self, path: str):
+        """Снимок {"shards": число процессов, "users": {user_id: [очки, имя]}} или None."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Не удалось загрузить снимок рейтинга {path}: {e}")
+            return None
+        # Снимок старого формата (без числа процессов) — только участники
+        if "users" not in data:
+            return {"shards": None, "users": data}
+        return data
+
+    def _snapshot_files(self) -> list:
+        """Общий снимок и снимки процессов при любом их числе (в том числе прошлом)."""
+        root, ext = os.path.splitext(self.base_file)
+        return [self.base_file] + sorted(glob.glob(f"{glob.escape(root)}.shard*{ext}"))
+
+    def merge_peer_snapshots(self) -> None:
+        """Подтягивает участников соседних рабочих процессов из их снимков (свои не трогает)."""
+        for path in self.peer_files:
+            snapshot = self._read_snapshot(path)
+            # Сосед еще не перезаписал снимок при новом числе процессов — его участники уже загружены
+            if not snapshot or snapshot["shards"] != self.shards:
+                continue
+            with self._lock:
+                for user_id, (score, name) in snapshot["users"].items():
+                    if user_id not in self._owned:
+                        self._set(user_id, score, name)
+
+    def load_snapshot(self) -> None:
+        """
+        Загружает рейтинг из всех снимков, чтобы после перезапуска он был доступен сразу.
+        Своими процесс считает участников по текущему числу процессов, поэтому после его изменения
+        каждый участник достается ровно одному процессу. Если участник есть в нескольких снимках
+        (старое разбиение), берется наибольший счет: очки активности только растут.
+        """
+        users = {}
+        own_shards = None
+        for path in self._snapshot_files():
+            snapshot = self._read_snapshot(path)
+            if snapshot is None:
+                continue
+            if path == self.snapshot_file:
+                own_shards = snapshot["shards"]
+            for user_id, (score, name) in snapshot["users"].items():
+                if user_id not in users or score > users[user_id][0]:
+                    users[user_id] = (score, name)
+        if not users:
+            return
+        with self._lock:
+            for user_id, (score, name) in users.items():
+                if self._owns(user_id):
+                    self._owned.add(user_id)
+                self._set(user_id, score, name)
+            # Снимок, записанный при другом числе процессов, перезаписывается в новом разбиении
+            self._dirty = own_shards != self.shards
+            owned = len(self._owned)
+        logger.info(f"Рейтинг загружен из снимков ({len(users)} участников, своих {owned}).")
+
+    def start_snapshots(self, interval: float = LEADERBOARD_SNAPSHOT_INTERVAL) -> None:
+        """Запускает фоновое периодическое сохранение снимков."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.save_snapshot()
+                self.merge_peer_snapshots()
+
+        self._thread = threading.Thread(target=run, name="leaderboard-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop_snapshots(self) -> None:
+        """Останавливает фоновое сохранение и записывает финальный снимок."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.save_snapshot()
+
+# Общий рейтинг процесса
+leaderboard = Leaderboard()
@@ -0,0 +1,307 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from ttl_cache import TTLCache
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Максимальное число одновременных блокирующих вызовов LLM (GigaChat, Tavily и т.д.)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+# Сколько из них доступно только командам пользователей (фоновая модерация их не занимает)
+LLM_RESERVED_INTERACTIVE = int(os.getenv("LLM_RESERVED_INTERACTIVE", 2))
+# Глубина очереди, начиная с которой фоновые вызовы и автоответы в чате отбрасываются
+LLM_SHED_QUEUE_DEPTH = int(os.getenv("LLM_SHED_QUEUE_DEPTH", 16))
+# Глубина очереди, начиная с которой отклоняются и команды пользователей
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", 200))
+# Ограничение на пользователя: запросов в минуту и допустимый всплеск (0 — без ограничения)
+LLM_USER_RATE = float(os.getenv("LLM_USER_RATE", 6))
+LLM_USER_BURST = int(os.getenv("LLM_USER_BURST", 3))
+
+# Классы приоритета вызовов LLM: чем меньше число, тем раньше вызов получает слот
+PRIORITY_INTERACTIVE = 0  # команды пользователя: /ask, /generate, /analyze
+PRIORITY_CHAT = 1         # автоответы на вопросы в чате
+PRIORITY_BACKGROUND = 2   # фоновая модерация сообщений
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_CHAT: "chat", PRIORITY_BACKGROUND: "background"}
+
+class LLMOverloaded(Exception):
+    """Вызов LLM отклонен: очередь слишком длинная."""
+
+class LLMRateLimited(LLMOverloaded):
+    """Вызов LLM отклонен: пользователь превысил свой лимит запросов."""
+
+    def __init__(self, user_id: str, retry_after: float):
+        super().__init__(f"Пользователь {user_id} превысил лимит запросов к LLM, повтор через {retry_after:.0f} с.")
+        self.user_id = user_id
+        self.retry_after = retry_after
+
+class LLMScheduler:
+    """
+    Общий планировщик вызовов LLM: не больше max_concurrency одновременных вызовов, слоты выдаются
+    по приоритету (внутри класса — по очереди), часть слотов закреплена за командами пользователей.
+    Когда очередь глубже shed_queue_depth, новые фоновые вызовы и автоответы отклоняются, а команда
+    вытесняет из очереди самый новый фоновый вызов. Для каждого пользователя действует токен-бакет.
+    Состояние меняется только из цикла событий бота.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, reserved_interactive: int = LLM_RESERVED_INTERACTIVE,
+                 shed_queue_depth: int = LLM_SHED_QUEUE_DEPTH, max_queue_depth: int = LLM_MAX_QUEUE_DEPTH,
+                 user_rate: float = LLM_USER_RATE, user_burst: int = LLM_USER_BURST, clock=time.monotonic):
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserved_interactive = min(max(0, reserved_interactive), self.max_concurrency - 1)
+        self.shed_queue_depth = shed_queue_depth
+        self.max_queue_depth = max_queue_depth
+        self.user_rate = user_rate / 60
+        self.user_burst = max(1, user_burst)
+        self._clock = clock
+        self._buckets = TTLCache(maxsize=100000, ttl=3600, clock=clock)
+        self._waiters = []
+        self._order = itertools.count()
+        self.in_use = 0
+        self.granted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.shed = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.rate_limited = 0
+        self.wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+
+    def check_rate(self, user_id) -> None:
+        """Списывает запрос из токен-бакета пользователя или бросает LLMRateLimited."""
+        if user_id is None or self.user_rate <= 0:
+            return
+        now = self._clock()
+        tokens, updated = self._buckets.get(user_id) or (self.user_burst, now)
+        tokens = min(self.user_burst, tokens + (now - updated) * self.user_rate)
+        if tokens < 1:
+            self.rate_limited += 1
+            self._buckets.set(user_id, (tokens, now))
+            raise LLMRateLimited(str(user_id), (1 - tokens) / self.user_rate)
+        self._buckets.set(user_id, (tokens - 1, now))
+
+    def _limit(self, priority: int) -> int:
+        return self.max_concurrency if priority == PRIORITY_INTERACTIVE else self.max_concurrency - self.reserved_interactive
+
+    def _pending(self) -> list:
+        return [waiter for waiter in self._waiters if not waiter[3].done()]
+
+    def _shed_newest_background(self) -> bool:
+        pending = [waiter for waiter in self._pending() if waiter[0] != PRIORITY_INTERACTIVE]
+        if not pending:
+            return False
+        victim = max(pending, key=lambda waiter: (waiter[0], waiter[1]))
+        self.shed[PRIORITY_NAMES[victim[0]]] += 1
+        victim[3].set_exception(LLMOverloaded("Вызов LLM вытеснен из очереди командой пользователя."))
+        return True
+
+    def _grant(self) -> None:
+        while self._waiters:
+            priority, _, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_use >= self._limit(priority):
+                # Очередь упорядочена по приоритету: если первому слот не положен, остальным тоже
+                return
+            heapq.heappop(self._waiters)
+            self.in_use += 1
+            future.set_result(None)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Ждет свободный слот с учетом приоритета или бросает LLMOverloaded, если очередь переполнена."""
+        depth = len(self._pending())
+        if priority != PRIORITY_INTERACTIVE and depth >= self.shed_queue_depth:
+            self.shed[PRIORITY_NAMES[priority]] += 1
+            raise LLMOverloaded(f"Очередь LLM переполнена ({depth}), фоновый вызов отклонен.")
+        if priority == PRIORITY_INTERACTIVE:
+            if depth >= self.max_queue_depth:
+                self.shed[PRIORITY_NAMES[priority]] += 1
+                raise LLMOverloaded(f"Очередь LLM переполнена ({depth}).")
+            if depth >= self.shed_queue_depth:
+                self._shed_newest_background()
+
+        future = asyncio.get_running_loop().create_future()
+        started = self._clock()
+        heapq.heappush(self._waiters, (priority, next(self._order), started, future))
+        self._grant()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+        self.granted[PRIORITY_NAMES[priority]] += 1
+        self.wait_seconds[PRIORITY_NAMES[priority]] += self._clock() - started
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._grant()
+
+    async def run(self, priority: int, user_id, func, *args, charge: bool = True, **kwargs):
+        """
+        Выполняет синхронную функцию в пуле потоков LLM, когда планировщик выдаст слот.
+        charge=False — вызов продолжает уже учтенный запрос пользователя (резервный способ, повтор)
+        и не списывается из его лимита второй раз.
+        """
+        if charge:
+            self.check_rate(user_id)
+        await self.acquire(priority)
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+            return await loop.run_in_executor(get_llm_executor(), call)
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_use": self.in_use,
+            "queue_depth": len(self._pending()),
+            "granted": dict(self.granted),
+            "shed": dict(self.shed),
+            "rate_limited": self.rate_limited,
+            "avg_wait_seconds": {name: self.wait_seconds[name] / count if count else 0.0
+                                 for name, count in self.granted.items()},
+        }
+
+_executor = None
+_scheduler = None
+_executor_lock = threading.Lock()
+# Между сколькими рабочими процессами делятся лимиты (TELEGRAM_WORKERS > 1, см. share_llm_limits)
+_workers = 1
+
+def share_llm_limits(workers: int) -> None:
+    """
+    Делит лимиты LLM между рабочими процессами: каждый получает LLM_MAX_CONCURRENCY // workers
+    слотов (не меньше одного) и такую же долю глубины очереди, поэтому вместе процессы не превышают
+    общий лимит GigaChat. Лимит на пользователя не делится: все его обновления обрабатывает один процесс.
+    Вызывается в рабочем процессе до первого вызова LLM.
+    """
+    global _workers, _executor, _scheduler
+    with _executor_lock:
+        _workers = max(1, workers)
+        _scheduler = None
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+    if LLM_MAX_CONCURRENCY < _workers:
+        logger.warning(f"LLM_MAX_CONCURRENCY={LLM_MAX_CONCURRENCY} меньше числа процессов ({_workers}): "
+                       f"каждый процесс получает один слот, всего {_workers}.")
+
+def _worker_concurrency() -> int:
+    return max(1, LLM_MAX_CONCURRENCY // _workers)
+
+def get_llm_executor() -> ThreadPoolExecutor:
+    """Возвращает общий ограниченный пул потоков для вызовов LLM (создается при первом обращении)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_worker_concurrency(), thread_name_prefix="llm")
+                logger.info(f"Пул потоков LLM создан (max_workers={_worker_concurrency()}).")
+    return _executor
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Возвращает общий планировщик вызовов LLM (слотов столько же, сколько потоков в пуле)."""
+    global _scheduler
+    if _scheduler is None:
+        with _executor_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler(_worker_concurrency(), shed_queue_depth=LLM_SHED_QUEUE_DEPTH // _workers,
+                                          max_queue_depth=LLM_MAX_QUEUE_DEPTH // _workers)
+    return _scheduler
+
+async def run_scheduled(priority: int, user_id, func, *args, charge: bool = True, **kwargs):
+    """
+    Выполняет синхронную функцию в пуле потоков LLM через общий планировщик: с приоритетом
+    и лимитом пользователя (user_id=None — без лимита; charge=False — запрос уже учтен).
+    Контекст (например, метка обработчика для метрик) переносится в поток, как в asyncio.to_thread.
+    """
+    return await get_llm_scheduler().run(priority, user_id, func, *args, charge=charge, **kwargs)
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию в пуле потоков LLM, не блокируя цикл событий.
+    Если все слоты заняты, вызов ждет своей очереди с приоритетом команды пользователя.
+    """
+    return await run_scheduled(PRIORITY_INTERACTIVE, None, func, *args, **kwargs)
+
+_STREAM_END = object()
+
+async def iterate_scheduled(priority: int, user_id, func, *args, charge: bool = True, **kwargs):
+    """
+    Выполняет синхронный генератор в пуле потоков LLM и отдает его элементы
+    в цикл событий по мере появления (например, токены потоковой генерации).
+    Слот планировщика занят, пока генератор работает.
+    Исключение генератора пробрасывается в месте итерации.
+    """
+    scheduler = get_llm_scheduler()
+    if charge:
+        scheduler.check_rate(user_id)
+    await scheduler.acquire(priority)
+    try:
+        async for item in _iterate_in_pool(func, *args, **kwargs):
+            yield item
+    finally:
+        scheduler.release()
+
+async def iterate_blocking(func, *args, **kwargs):
+    """Как iterate_scheduled с приоритетом команды пользователя и без лимита на пользователя."""
+    async for item in iterate_scheduled(PRIORITY_INTERACTIVE, None, func, *args, **kwargs):
+        yield item
+
+async def _iterate_in_pool(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def put(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # Цикл событий уже закрыт: получать элементы некому
+            stopped.set()
+
+    def produce():
+        try:
+            for item in func(*args, **kwargs):
+                if stopped.is_set():
+                    return
+                put(item)
+        except Exception as e:
+            put(_STREAM_END, e)
+        else:
+            put(_STREAM_END)
+
+    producer = loop.run_in_executor(get_llm_executor(), contextvars.copy_context().run, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _STREAM_END:
+                if error is not None:
+                    raise error
+                break
+            yield item
+        await producer
+    finally:
+        # Если потребитель прервал итерацию, генератор останавливается на следующем элементе
+        stopped.set()
+
+def shutdown_llm_executor(wait: bool = True) -> None:
+    """Останавливает пул потоков LLM (вызывается при завершении бота)."""
+    global _executor, _scheduler
+    with _executor_lock:
+        _scheduler = None
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+            logger.info("Пул потоков LLM остановлен.")
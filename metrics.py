@@ -0,0 +1,247 @@
+import os
+import time
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Порт локального эндпоинта /metrics в формате Prometheus (0 — не запускать)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Границы корзин гистограммы задержек, секунды: от кэша до долгого цикла агента
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Обработчик Telegram, внутри которого выполняется текущий код (метка handler у всех этапов)
+current_handler = contextvars.ContextVar("metrics_handler", default="none")
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(stage: str, name: str, handler: str, **extra) -> str:
+    pairs = {"stage": stage, "name": name, "handler": handler, **extra}
+    return _format_labels(pairs)
+
+def _format_labels(pairs: dict) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in pairs.items())
+
+def _gauge_samples(component: str, stats: dict):
+    """Числовые значения словаря stats() как пары (метки, значение); вложенные словари получают метку key."""
+    for stat, value in stats.items():
+        if isinstance(value, dict):
+            for key, nested in value.items():
+                if isinstance(nested, (int, float)):
+                    yield {"component": component, "stat": stat, "key": key}, nested
+        elif isinstance(value, (int, float)):
+            yield {"component": component, "stat": stat}, value
+
+class MetricsRegistry:
+    """
+    Гистограммы задержек и счетчики ошибок по этапам обработки. Этап описывается тремя метками:
+    stage (handler, agent_step, llm, tool, tavily, gigachat, firestore, telegram), name (конкретный
+    инструмент, узел графа, метод API) и handler (обработчик Telegram, в рамках которого шел этап).
+    Кроме того, компоненты регистрируют свои счетчики stats() (кэши, модерация, планировщик LLM, ...):
+    они читаются при каждом запросе /metrics и выводятся как датчик jk_component_stat.
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def register_gauges(self, component: str, collect) -> None:
+        """Регистрирует функцию collect() -> dict, значения которой выводятся с меткой component."""
+        with self._lock:
+            self._gauges[component] = collect
+
+    def collect_gauges(self) -> list:
+        """Текущие значения зарегистрированных счетчиков: [(метки, значение)]."""
+        with self._lock:
+            gauges = sorted(self._gauges.items())
+        samples = []
+        for component, collect in gauges:
+            try:
+                samples.extend(_gauge_samples(component, collect() or {}))
+            except Exception as e:
+                logger.warning(f"Не удалось получить счетчики {component} для /metrics: {e}")
+        return samples
+
+    def observe(self, stage: str, name: str, seconds: float, error: bool = False, handler: str = None) -> None:
+        key = (stage, name, handler or current_handler.get())
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0, "errors": 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += seconds
+            series["count"] += 1
+            if error:
+                series["errors"] += 1
+
+    def snapshot(self) -> dict:
+        """Копия накопленных значений: {(stage, name, handler): {"count", "sum", "errors"}}."""
+        with self._lock:
+            return {key: {"count": s["count"], "sum": s["sum"], "errors": s["errors"]}
+                    for key, s in self._series.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus."""
+        with self._lock:
+            series = sorted((key, dict(s, buckets=list(s["buckets"]))) for key, s in self._series.items())
+        lines = [
+            "# HELP jk_stage_duration_seconds Длительность этапов обработки запроса.",
+            "# TYPE jk_stage_duration_seconds histogram",
+        ]
+        for key, s in series:
+            for bound, count in zip(self.buckets, s["buckets"]):
+                lines.append(f"jk_stage_duration_seconds_bucket{{{_labels(*key, le=bound)}}} {count}")
+            lines.append(f"jk_stage_duration_seconds_bucket{{{_labels(*key, le='+Inf')}}} {s['count']}")
+            lines.append(f"jk_stage_duration_seconds_sum{{{_labels(*key)}}} {s['sum']:.6f}")
+            lines.append(f"jk_stage_duration_seconds_count{{{_labels(*key)}}} {s['count']}")
+        lines += [
+            "# HELP jk_stage_errors_total Этапы, завершившиеся ошибкой.",
+            "# TYPE jk_stage_errors_total counter",
+        ]
+        for key, s in series:
+            lines.append(f"jk_stage_errors_total{{{_labels(*key)}}} {s['errors']}")
+        gauges = self.collect_gauges()
+        if gauges:
+            lines += [
+                "# HELP jk_component_stat Счетчики и датчики компонентов (stats() кэшей, модерации, планировщика и т. д.).",
+                "# TYPE jk_component_stat gauge",
+            ]
+            for labels, value in gauges:
+                lines.append(f"jk_component_stat{{{_format_labels(labels)}}} {int(value) if isinstance(value, int) else round(value, 6)}")
+        return "\n".join(lines) + "\n"
+
+# Общий реестр процесса
+registry = MetricsRegistry()
+
+@contextmanager
+def span(stage: str, name: str):
+    """Замеряет длительность блока кода и записывает ее в реестр (исключение считается ошибкой)."""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        registry.observe(stage, name, time.perf_counter() - started, error=error)
+
+def trace_handler(name: str, callback):
+    """Оборачивает обработчик Telegram: замеряет его целиком и помечает все вложенные этапы его именем."""
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        token = current_handler.set(name)
+        try:
+            with span("handler", name):
+                return await callback(*args, **kwargs)
+        finally:
+            current_handler.reset(token)
+    return wrapper
+
+_callback_handler = None
+_callback_lock = threading.Lock()
+
+def llm_callbacks() -> list:
+    """
+    Обработчик обратных вызовов LangChain, который замеряет каждый вызов модели и инструмента.
+    Создается при первом обращении, чтобы импорт модуля не тянул langchain_core.
+    """
+    global _callback_handler
+    if _callback_handler is None:
+        with _callback_lock:
+            if _callback_handler is None:
+                from langchain_core.callbacks import BaseCallbackHandler
+
+                class MetricsCallbackHandler(BaseCallbackHandler):
+                    def __init__(self):
+                        self._runs = {}
+
+                    def _start(self, run_id, stage: str, name: str) -> None:
+                        self._runs[run_id] = (stage, name, current_handler.get(), time.perf_counter())
+
+                    def _end(self, run_id, error: bool = False) -> None:
+                        run = self._runs.pop(run_id, None)
+                        if run is not None:
+                            stage, name, handler, started = run
+                            registry.observe(stage, name, time.perf_counter() - started, error=error, handler=handler)
+
+                    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+                        name = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name") or "llm"
+                        self._start(run_id, "llm", name)
+
+                    def on_llm_end(self, response, *, run_id, **kwargs):
+                        self._end(run_id)
+
+                    def on_llm_error(self, error, *, run_id, **kwargs):
+                        self._end(run_id, error=True)
+
+                    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+                        self._start(run_id, "tool", (serialized or {}).get("name") or kwargs.get("name") or "tool")
+
+                    def on_tool_end(self, output, *, run_id, **kwargs):
+                        self._end(run_id)
+
+                    def on_tool_error(self, error, *, run_id, **kwargs):
+                        self._end(run_id, error=True)
+
+                _callback_handler = MetricsCallbackHandler()
+    return [_callback_handler]
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"/metrics: {format % args}")
+
+_server = None
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Запускает эндпоинт /metrics в фоновом потоке. Возвращает сервер или None, если порт 0 или занят."""
+    global _server
+    if not port or _server is not None:
+        return _server
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    except OSError as e:
+        logger.error(f"Не удалось запустить /metrics на {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    _server = server
+    logger.info(f"Метрики доступны на http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+def stop_metrics_server() -> None:
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
@@ -0,0 +1,275 @@
+import os
+import re
+import json
+import asyncio
+import logging
+import unicodedata
+from dotenv import load_dotenv
+
+from llm_executor import run_scheduled, LLMOverloaded, PRIORITY_BACKGROUND
+from ttl_cache import TTLCache
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Сколько миллисекунд собирать сообщения перед отправкой пакета в LLM
+MODERATION_BATCH_WINDOW_MS = int(os.getenv("MODERATION_BATCH_WINDOW_MS", 300))
+# Максимальный размер пакета: при его достижении пакет отправляется сразу
+MODERATION_MAX_BATCH_SIZE = int(os.getenv("MODERATION_MAX_BATCH_SIZE", 20))
+# Локальный классификатор перед LLM: "heuristic" или "off"
+MODERATION_PREFILTER = os.getenv("MODERATION_PREFILTER", "heuristic")
+# Кэш вердиктов для повторяющихся сообщений (спам-волны, копипаста)
+MODERATION_CACHE_SIZE = int(os.getenv("MODERATION_CACHE_SIZE", 5000))
+MODERATION_CACHE_TTL = int(os.getenv("MODERATION_CACHE_TTL", 3600))
+
+FALLBACK_VERDICT = {"is_toxic": False, "toxicity_score": 1, "reason": "Ошибка анализа формата ответа."}
+# Вердикт, когда LLM перегружена и фоновая модерация отложена: сообщение пропускается
+OVERLOAD_VERDICT = {"is_toxic": False, "toxicity_score": 1, "reason": "Модерация пропущена: LLM перегружена."}
+# Вердикты-заглушки при ошибках и перегрузке: их нельзя кэшировать
+ERROR_REASON_PREFIXES = ("Ошибка анализа формата ответа", "Не удалось получить ответ от модели", "Исключение при анализе",
+                         "Модерация пропущена")
+
+def normalize_verdict(data) -> dict:
+    """Приводит вердикт модели к контракту is_toxic/toxicity_score/reason."""
+    if not isinstance(data, dict):
+        return dict(FALLBACK_VERDICT)
+    try:
+        score = int(data.get("toxicity_score", 1))
+    except (TypeError, ValueError):
+        score = 1
+    return {
+        "is_toxic": bool(data.get("is_toxic", False)),
+        "toxicity_score": min(max(score, 1), 10),
+        "reason": str(data.get("reason", "")),
+    }
+
+def parse_batch_verdicts(content: str, count: int) -> list:
+    """
+    Разбирает ответ LLM с JSON-массивом вердиктов и возвращает список длины count.
+    Вердикты сопоставляются по полю "id" (номер сообщения с 1), а при его отсутствии — по порядку.
+    Для сообщений без вердикта возвращается FALLBACK_VERDICT.
+    """
+    verdicts = [dict(FALLBACK_VERDICT) for _ in range(count)]
+    match = re.search(r"\[.*\]", content or "", re.DOTALL)
+    if not match:
+        logger.error(f"В ответе LLM не найден JSON-массив вердиктов: {content}")
+        return verdicts
+    try:
+        items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        logger.error(f"Не удалось распарсить JSON-массив вердиктов: {content}")
+        return verdicts
+
+    for position, item in enumerate(items):
+        index = position
+        if isinstance(item, dict) and "id" in item:
+            try:
+                index = int(item["id"]) - 1
+            except (TypeError, ValueError):
+                continue
+        if 0 <= index < count:
+            verdicts[index] = normalize_verdict(item)
+    return verdicts
+
+class ModerationBatcher:
+    """
+    Собирает сообщения для модерации за короткое окно (или до максимального размера пакета)
+    и отправляет их в LLM одним запросом. Каждый ожидающий обработчик получает свой вердикт.
+    """
+
+    def __init__(self, analyze_batch, window_ms: int = MODERATION_BATCH_WINDOW_MS,
+                 max_batch_size: int = MODERATION_MAX_BATCH_SIZE):
+        self.analyze_batch = analyze_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.batches_sent = 0
+        self.messages_processed = 0
+        self.batches_shed = 0
+
+    async def submit(self, message_text: str) -> dict:
+        """Ставит сообщение в очередь и ждет вердикт для него."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((message_text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_window())
+        return await future
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        self._flush_now()
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._process(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, batch):
+        texts = [text for text, _ in batch]
+        self.batches_sent += 1
+        self.messages_processed += len(texts)
+        logger.info(f"Отправляю пакет модерации из {len(texts)} сообщений.")
+        try:
+            # Модерация — фоновый вызов: при перегрузке уступает команды пользователей
+            verdicts = await run_scheduled(PRIORITY_BACKGROUND, None, self.analyze_batch, texts)
+        except LLMOverloaded as e:
+            self.batches_shed += 1
+            logger.warning(f"Пакет модерации из {len(texts)} сообщений пропущен: {e}")
+            verdicts = [dict(OVERLOAD_VERDICT) for _ in texts]
+        except Exception as e:
+            logger.error(f"Ошибка пакетной модерации: {e}", exc_info=True)
+            verdicts = [{"is_toxic": False, "toxicity_score": 1, "reason": f"Исключение при анализе: {str(e)}"}
+                        for _ in texts]
+        for (_, future), verdict in zip(batch, verdicts):
+            if not future.done():
+                future.set_result(verdict)
+        for _, future in batch[len(verdicts):]:
+            if not future.done():
+                future.set_result(dict(FALLBACK_VERDICT))
+
+# --- Локальный предварительный фильтр ---
+URL_RE = re.compile(r"(https?://\S+|www\.\S+|t\.me/\S+|@\w+)", re.IGNORECASE)
+WORD_RE = re.compile(r"[a-zа-яё0-9]+", re.IGNORECASE)
+LAUGHTER_RE = re.compile(r"^(а?х[аеи])+х?$|^(ха)+$|^a?(ha)+h?$|^l+o+l+$|^о+к+$|^ok+$|^\++$")
+
+SAFE_WORDS = {
+    "привет", "приветик", "приветствую", "здравствуйте", "здравствуй", "здорово", "хай", "салют", "ку",
+    "добрый", "доброе", "доброй", "утро", "утра", "день", "вечер", "ночи", "всем", "все", "всех", "ребята", "народ",
+    "спасибо", "спс", "благодарю", "пожалуйста", "пжл", "ок", "окей", "ага", "угу", "да", "нет", "неа", "ну",
+    "понял", "поняла", "понятно", "ясно", "согласен", "согласна", "точно", "верно", "конечно", "норм", "нормально",
+    "хорошо", "отлично", "супер", "класс", "классно", "круто", "огонь", "топ", "красота", "ура", "вау", "ого",
+    "пока", "до", "завтра", "встречи", "удачи", "спокойной", "и", "тебе", "вам", "тоже", "очень", "так", "а", "как",
+    "дела", "делишки", "жизнь", "сам", "сама", "сами", "ничего", "нормас", "рад", "рада", "видеть", "с", "на", "связи",
+    "hi", "hello", "hey", "thanks", "thx", "ok", "okay", "yes", "no", "lol", "wow", "cool", "nice", "gm", "gn",
+}
+SAFE_MAX_WORDS = 8
+
+class HeuristicPrefilter:
+    """
+    Локальный классификатор без сети: приветствия, короткие реакции, ссылки и эмодзи.
+    Возвращает уверенный "безопасный" вердикт или None, если сообщение нужно отдать LLM.
+    """
+    name = "heuristic"
+
+    def classify(self, message_text: str):
+        text = URL_RE.sub(" ", message_text or "").lower().replace("ё", "е")
+        words = WORD_RE.findall(text)
+        if not words:
+            return {"is_toxic": False, "toxicity_score": 1, "reason": "Ссылка, эмодзи или знаки без текста."}
+        if len(words) > SAFE_MAX_WORDS:
+            return None
+        if all(word in SAFE_WORDS or LAUGHTER_RE.match(word) for word in words):
+            return {"is_toxic": False, "toxicity_score": 1, "reason": "Приветствие или короткая реакция."}
+        return None
+
+PREFILTERS = {
+    "heuristic": HeuristicPrefilter,
+}
+
+def create_prefilter(name: str = MODERATION_PREFILTER):
+    """Создает локальный классификатор по имени (None, если фильтр отключен)."""
+    if not name or name == "off":
+        return None
+    if name not in PREFILTERS:
+        logger.warning(f"Неизвестный предварительный фильтр модерации '{name}', фильтр отключен.")
+        return None
+    return PREFILTERS[name]()
+
+# --- Кэш вердиктов ---
+EMOJI_MODIFIERS_RE = re.compile("[\u200d\ufe0e\ufe0f\U0001F3FB-\U0001F3FF]")
+WHITESPACE_RE = re.compile(r"\s+")
+
+def _is_emoji(char: str) -> bool:
+    return unicodedata.category(char) == "So"
+
+def normalize_message_key(message_text: str) -> str:
+    """
+    Нормализует сообщение для ключа кэша: регистр, пробелы и эмодзи
+    (без модификаторов цвета кожи и вариантов начертания, повторы схлопываются).
+    """
+    text = unicodedata.normalize("NFKC", message_text or "").casefold().replace("ё", "е")
+    text = EMOJI_MODIFIERS_RE.sub("", text)
+    chars = []
+    for char in text:
+        if chars and _is_emoji(char) and chars[-1] == char:
+            continue
+        chars.append(char)
+    return WHITESPACE_RE.sub(" ", "".join(chars)).strip()
+
+def is_cacheable_verdict(verdict: dict) -> bool:
+    """Вердикты-заглушки, возвращенные из-за ошибок, не кэшируются."""
+    reason = str(verdict.get("reason", ""))
+    return not reason.startswith(ERROR_REASON_PREFIXES)
+
+class ModerationPipeline:
+    """
+    Цепочка модерации: локальный классификатор, кэш вердиктов, затем пакетный анализ в LLM.
+    До LLM доходят только новые сообщения, по которым локальный классификатор не уверен.
+    Одинаковые сообщения, ожидающие ответа LLM, разделяют один запрос.
+    """
+
+    def __init__(self, batcher: ModerationBatcher, prefilter=None, cache: TTLCache = None):
+        self.batcher = batcher
+        self.prefilter = prefilter
+        self.cache = cache if cache is not None else TTLCache(MODERATION_CACHE_SIZE, MODERATION_CACHE_TTL)
+        self._inflight = {}
+        self.total = 0
+        self.prefilter_hits = 0
+        self.cache_hits = 0
+        self.llm_requests = 0
+
+    async def moderate(self, message_text: str) -> dict:
+        self.total += 1
+        if self.prefilter is not None:
+            verdict = self.prefilter.classify(message_text)
+            if verdict is not None:
+                self.prefilter_hits += 1
+                return verdict
+
+        key = normalize_message_key(message_text)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            self.cache_hits += 1
+            return dict(verdict)
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.llm_requests += 1
+            task = asyncio.ensure_future(self._analyze(key, message_text))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+        else:
+            self.cache_hits += 1
+        return dict(await asyncio.shield(task))
+
+    async def _analyze(self, key: str, message_text: str) -> dict:
+        verdict = await self.batcher.submit(message_text)
+        if is_cacheable_verdict(verdict):
+            self.cache.set(key, dict(verdict))
+        return verdict
+
+    def stats(self) -> dict:
+        """Счетчики модерации: сколько сообщений обработано без LLM и сколько ушло в LLM."""
+        cache_stats = self.cache.stats()
+        return {
+            "total": self.total,
+            "prefilter_hits": self.prefilter_hits,
+            "cache_hits": self.cache_hits,
+            "cache_size": cache_stats["size"],
+            "llm_requests": self.llm_requests,
+            "llm_batches": self.batcher.batches_sent,
+            "shed_batches": self.batcher.batches_shed,
+            "skip_rate": (self.prefilter_hits + self.cache_hits) / self.total if self.total else 0.0,
+        }
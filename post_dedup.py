@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from collections import Counter, namedtuple
+from dotenv import load_dotenv
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Проверять ли черновик /generate на сходство с уже опубликованными постами
+POST_DUPLICATE_CHECK = os.getenv("POST_DUPLICATE_CHECK", "true").lower() in ("1", "true", "yes")
+# Наибольшее расстояние Хэмминга между 64-битными SimHash текстов, при котором пост считается повтором
+POST_DUPLICATE_MAX_DISTANCE = int(os.getenv("POST_DUPLICATE_MAX_DISTANCE", 7))
+# Доля слов заголовка, совпадающих с заголовком опубликованного поста, при которой пост считается повтором
+POST_DUPLICATE_TITLE_OVERLAP = float(os.getenv("POST_DUPLICATE_TITLE_OVERLAP", 0.8))
+# Сколько раз перегенерировать пост, похожий на опубликованный
+POST_DUPLICATE_RETRIES = int(os.getenv("POST_DUPLICATE_RETRIES", 2))
+
+SIMHASH_BITS = 64
+# Заголовки короче (в значимых словах) не сравниваются: «Поход в горы» слишком общее,
+# а строка длиннее — уже не заголовок, а абзац
+MIN_TITLE_WORDS = 3
+MAX_TITLE_WORDS = 12
+# Русские слова сравниваются по первым буквам: «кочевая», «кочевники» и «кочевой» совпадают
+STEM_LENGTH = 5
+
+WORD_RE = re.compile(r"\w+")
+BOLD_TITLE_RE = re.compile(r"^[#\s]*\*\*(.+?)\*\*")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+HASHTAG_LINE_RE = re.compile(r"^(#\w+\s*)+$")
+SIGNATURE = "нейро jekardos"
+CALL_TO_ACTION = "t.me/jekardoscoinforever"
+
+DuplicateMatch = namedtuple("DuplicateMatch", ["text", "reason", "distance", "title_overlap"])
+
+def _stems(text: str) -> list:
+    return [word[:STEM_LENGTH] for word in WORD_RE.findall(text.casefold().replace("ё", "е")) if len(word) > 2]
+
+def content_lines(text: str) -> list:
+    """Строки поста без подписи, призыва к действию и хештегов — они одинаковы у всех постов."""
+    lines = []
+    for line in (text or "").splitlines():
+        key = line.strip().strip("*_ ").casefold()
+        if not key or key == SIGNATURE or CALL_TO_ACTION in key or HASHTAG_LINE_RE.match(line.strip()):
+            continue
+        lines.append(line.strip())
+    return lines
+
+def title_stems(text: str) -> frozenset:
+    """Значимые слова заголовка (первой содержательной строки поста)."""
+    lines = content_lines(text)
+    if not lines:
+        return frozenset()
+    # Заголовок — выделенное жирным начало строки, иначе первое предложение
+    match = BOLD_TITLE_RE.match(lines[0])
+    title = match.group(1) if match else SENTENCE_END_RE.split(lines[0].lstrip("# "), 1)[0]
+    stems = frozenset(_stems(title))
+    return stems if len(stems) <= MAX_TITLE_WORDS else frozenset()
+
+# Каждый бит хеша признака раскладывается в свой двухбайтовый счетчик: сумма таких чисел
+# считает единицы во всех 64 позициях сразу (без переноса, пока признаков меньше 65536)
+_LANE_BYTES = 2
+_SPREAD = [b"".join((byte >> (7 - bit) & 1).to_bytes(_LANE_BYTES, "big") for bit in range(8)) for byte in range(256)]
+
+@lru_cache(maxsize=65536)
+def _spread_hash(feature: str) -> int:
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=SIMHASH_BITS // 8).digest()
+    return int.from_bytes(b"".join(_SPREAD[byte] for byte in digest), "big")
+
+def simhash(text: str) -> int:
+    """
+    64-битный SimHash содержательной части поста по словам и парам слов: у близких текстов
+    отличается немного битов, у разных — около половины.
+    """
+    stems = _stems(" ".join(content_lines(text)))
+    features = Counter(stems)
+    features.update(f"{first} {second}" for first, second in zip(stems, stems[1:]))
+    if not features:
+        return 0
+    threshold = sum(features.values()) / 2
+    counts = sum(_spread_hash(feature) * weight for feature, weight in features.items())
+    lanes = counts.to_bytes(SIMHASH_BITS * _LANE_BYTES, "big")
+    # Бит отпечатка равен 1, если он установлен у большинства признаков
+    value = 0
+    for start in range(0, len(lanes), _LANE_BYTES):
+        value = (value << 1) | (int.from_bytes(lanes[start:start + _LANE_BYTES], "big") > threshold)
+    return value
+
+class PostFingerprintIndex:
+    """
+    Индекс отпечатков опубликованных постов для проверки черновика перед показом.
+    Повтором считается пост, SimHash которого отличается не больше чем на max_distance битов
+    (кандидаты ищутся по 8 полосам по 8 битов: при расстоянии до 7 хотя бы одна полоса совпадает),
+    или пост с почти тем же заголовком (кандидаты — по словам заголовка).
+    """
+
+    BANDS = 8
+
+    def __init__(self, max_distance: int = POST_DUPLICATE_MAX_DISTANCE,
+                 title_overlap: float = POST_DUPLICATE_TITLE_OVERLAP):
+        self.max_distance = max_distance
+        self.title_overlap = title_overlap
+        self._posts = []
+        self._keys = set()
+        self._bands = [{} for _ in range(self.BANDS)]
+        self._titles = {}
+        self.checks = 0
+        self.duplicates = 0
+        self.check_seconds = 0.0
+        self.max_check_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _band_keys(self, fingerprint: int) -> list:
+        width = SIMHASH_BITS // self.BANDS
+        return [(fingerprint >> (band * width)) & ((1 << width) - 1) for band in range(self.BANDS)]
+
+    def add(self, text: str) -> bool:
+        """Добавляет опубликованный пост; повторное добавление того же текста ничего не меняет."""
+        lines = content_lines(text)
+        if not lines:
+            return False
+        key = hashlib.sha1("\n".join(lines).encode("utf-8")).digest()
+        fingerprint, title = simhash(text), title_stems(text)
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            position = len(self._posts)
+            self._posts.append((fingerprint, title, text))
+            for band, band_key in enumerate(self._band_keys(fingerprint)):
+                self._bands[band].setdefault(band_key, []).append(position)
+            if len(title) >= MIN_TITLE_WORDS:
+                for stem in title:
+                    self._titles.setdefault(stem, []).append(position)
+        return True
+
+    def find_duplicate(self, text: str):
+        """Самый похожий опубликованный пост (DuplicateMatch) или None, если черновик новый."""
+        started = time.perf_counter()
+        fingerprint, title = simhash(text), title_stems(text)
+        best = None
+        with self._lock:
+            candidates = set()
+            for band, band_key in enumerate(self._band_keys(fingerprint)):
+                candidates.update(self._bands[band].get(band_key, ()))
+            for position in candidates:
+                distance = bin(fingerprint ^ self._posts[position][0]).count("1")
+                if distance <= self.max_distance and (best is None or distance < best.distance):
+                    best = DuplicateMatch(self._posts[position][2], "text", distance, None)
+
+            if best is None and len(title) >= MIN_TITLE_WORDS:
+                shared = Counter(position for stem in title for position in self._titles.get(stem, ()))
+                # Доля считается для каждого кандидата: короткий совпавший заголовок важнее
+                # длинного, у которого общих слов больше, но доля меньше
+                for position, count in shared.items():
+                    overlap = count / min(len(title), len(self._posts[position][1]))
+                    if overlap >= self.title_overlap and (best is None or overlap > best.title_overlap):
+                        best = DuplicateMatch(self._posts[position][2], "title",
+                                              bin(fingerprint ^ self._posts[position][0]).count("1"), overlap)
+
+            elapsed = time.perf_counter() - started
+            self.checks += 1
+            self.duplicates += best is not None
+            self.check_seconds += elapsed
+            self.max_check_seconds = max(self.max_check_seconds, elapsed)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._posts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "posts": len(self._posts),
+                "checks": self.checks,
+                "duplicates": self.duplicates,
+                "avg_check_us": self.check_seconds / self.checks * 1e6 if self.checks else 0.0,
+                "max_check_us": self.max_check_seconds * 1e6,
+            }
+
+# Общий индекс процесса (наполняется из журнала постов и коллекции published_posts)
+post_index = PostFingerprintIndex()
@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна, остается блокировка потоков
+    fcntl = None
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Каталог журнала опубликованных постов
+POST_HISTORY_DIR = os.getenv("POST_HISTORY_DIR", "post_history")
+# Сколько постов в одном сегменте журнала, прежде чем начинается следующий
+POST_HISTORY_SEGMENT_ENTRIES = int(os.getenv("POST_HISTORY_SEGMENT_ENTRIES", 500))
+# Сколько дней хранить посты (удаляются целыми сегментами); 0 — хранить все
+POST_HISTORY_RETENTION_DAYS = float(os.getenv("POST_HISTORY_RETENTION_DAYS", 90))
+# Сколько последних постов держать в памяти для быстрых запросов
+POST_HISTORY_TAIL = int(os.getenv("POST_HISTORY_TAIL", 100))
+# Сбрасывать ли каждую запись на диск (fsync): надежнее при сбое питания, но медленнее
+POST_HISTORY_FSYNC = os.getenv("POST_HISTORY_FSYNC", "false").lower() in ("1", "true", "yes")
+# Старый файл истории (JSON-список); переносится в журнал при первом запуске
+POST_HISTORY_LEGACY_FILE = os.getenv("POST_HISTORY_LEGACY_FILE", "published_posts.json")
+
+SEGMENT_RE = re.compile(r"^posts-(\d{6})\.jsonl$")
+
+def _segment_name(number: int) -> str:
+    return f"posts-{number:06d}.jsonl"
+
+class PostHistory:
+    """
+    Журнал опубликованных постов только с дозаписью: каждый пост — одна строка JSON в текущем
+    сегменте (posts-000001.jsonl, ...). Запись идет одним вызовом write в файл, открытый с O_APPEND,
+    под блокировкой потоков и файловой блокировкой (fcntl), поэтому одновременные публикации
+    из разных потоков и процессов не теряют записей. Новый сегмент создается атомарно (O_EXCL),
+    старые удаляются целиком, когда выходят за окно хранения. Последние посты держатся в памяти;
+    записи других процессов подтягиваются по смещению в файле при следующем запросе.
+    """
+
+    def __init__(self, directory: str = POST_HISTORY_DIR, segment_entries: int = POST_HISTORY_SEGMENT_ENTRIES,
+                 retention_days: float = POST_HISTORY_RETENTION_DAYS, tail_size: int = POST_HISTORY_TAIL,
+                 fsync: bool = POST_HISTORY_FSYNC, legacy_file: str = POST_HISTORY_LEGACY_FILE, clock=time.time):
+        self.directory = directory
+        self.segment_entries = segment_entries
+        self.retention_days = retention_days
+        self.tail_size = tail_size
+        self.fsync = fsync
+        self.legacy_file = legacy_file
+        self.clock = clock
+        self.appended = 0
+        self.rotations = 0
+        self.removed_segments = 0
+        self._tail = deque(maxlen=tail_size)
+        self._segment_lines = {}
+        self._segment_newest = {}
+        self._cursor = (0, 0)
+        self._loaded = False
+        self._listeners = []
+        self._lock = threading.RLock()
+
+    def add_listener(self, callback) -> None:
+        """Подписывает callback(entry) на каждую новую запись журнала (свою или другого процесса)."""
+        self._listeners.append(callback)
+
+    # --- Файлы ---
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, _segment_name(number))
+
+    def _segments(self) -> list:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(match.group(1)) for match in map(SEGMENT_RE.match, names) if match)
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, number: int, data: bytes) -> None:
+        fd = os.open(self._path(number), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # --- Индекс последних записей ---
+    def _catch_up(self) -> None:
+        """Дочитывает журнал с запомненного смещения: свои и чужие записи попадают в индекс."""
+        cursor_number, cursor_offset = self._cursor
+        for number in self._segments():
+            if number < cursor_number:
+                continue
+            offset = cursor_offset if number == cursor_number else 0
+            try:
+                with open(self._path(number), "rb") as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            # Незавершенная строка (запись другого процесса еще идет) дочитывается в следующий раз
+            end = data.rfind(b"\n") + 1
+            self._segment_lines.setdefault(number, 0)
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Пропущена поврежденная запись в {_segment_name(number)}.")
+                    continue
+                self._tail.append((number, entry))
+                self._segment_lines[number] = self._segment_lines.get(number, 0) + 1
+                self._segment_newest[number] = max(self._segment_newest.get(number, 0), entry.get("ts", 0))
+                for callback in self._listeners:
+                    callback(entry)
+            cursor_number, cursor_offset = number, offset + end
+        self._cursor = (cursor_number, cursor_offset)
+
+    def _is_current(self) -> bool:
+        number, offset = self._cursor
+        try:
+            return os.stat(self._path(number)).st_size == offset and not os.path.exists(self._path(number + 1))
+        except FileNotFoundError:
+            return False
+
+    def _import_legacy(self) -> None:
+        try:
+            with open(self.legacy_file, "r", encoding="utf-8") as f:
+                posts = json.load(f)
+            ts = os.path.getmtime(self.legacy_file)
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return
+        lines = "".join(json.dumps({"ts": ts, "text": text}, ensure_ascii=False) + "\n"
+                        for text in posts if isinstance(text, str))
+        if lines:
+            self._write(1, lines.encode("utf-8"))
+            logger.info(f"История постов перенесена из {self.legacy_file} ({len(posts)} шт.).")
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._file_lock():
+            if not self._segments() and self.legacy_file:
+                self._import_legacy()
+        self._catch_up()
+        self._loaded = True
+        logger.info(f"Журнал постов загружен: {sum(self._segment_lines.values())} записей, "
+                    f"сегментов: {len(self._segment_lines)}.")
+
+    # --- Сегменты ---
+    def _rotate(self, number: int) -> int:
+        """Начинает новый сегмент: файл создается с O_EXCL, так что его не создадут дважды."""
+        new_number = number + 1
+        try:
+            os.close(os.open(self._path(new_number), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            self.rotations += 1
+            logger.info(f"Журнал постов: начат сегмент {_segment_name(new_number)}.")
+        except FileExistsError:
+            pass
+        self._apply_retention(keep=new_number)
+        return new_number
+
+    def _apply_retention(self, keep: int) -> None:
+        """Удаляет сегменты, все посты которых старше окна хранения (текущий сегмент не трогается)."""
+        if not self.retention_days:
+            return
+        cutoff = self.clock() - self.retention_days * 86400
+        expired = [number for number, newest in self._segment_newest.items() if number < keep and newest < cutoff]
+        for number in expired:
+            try:
+                os.remove(self._path(number))
+            except FileNotFoundError:
+                pass
+            self._segment_lines.pop(number, None)
+            self._segment_newest.pop(number, None)
+            self.removed_segments += 1
+        if expired:
+            self._tail = deque(((number, entry) for number, entry in self._tail if number not in expired),
+                               maxlen=self.tail_size)
+            logger.info(f"Журнал постов: удалено сегментов за окном хранения: {len(expired)}.")
+
+    # --- Запись и чтение ---
+    def append(self, text: str, **meta) -> dict:
+        """Дописывает пост в журнал и возвращает запись."""
+        entry = {"ts": round(self.clock(), 3), "text": text, **meta}
+        data = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._ensure_loaded()
+            with self._file_lock():
+                self._catch_up()
+                number = max(self._cursor[0], 1)
+                if self._segment_lines.get(number, 0) >= self.segment_entries:
+                    number = self._rotate(number)
+                self._write(number, data)
+                self._catch_up()
+            self.appended += 1
+        return entry
+
+    def refresh(self) -> None:
+        """Подтягивает записи других процессов (подписчики получают их до возврата)."""
+        with self._lock:
+            self._ensure_loaded()
+            if not self._is_current():
+                self._catch_up()
+
+    def recent(self, n: int = 10) -> list:
+        """Последние n записей (не больше размера индекса), от старых к новым."""
+        with self._lock:
+            self.refresh()
+            entries = [entry for _, entry in self._tail]
+        return entries[-n:] if n else []
+
+    def entries(self):
+        """Все записи журнала в пределах окна хранения, от старых к новым (читаются с диска)."""
+        with self._lock:
+            self._ensure_loaded()
+        for number in self._segments():
+            try:
+                with open(self._path(number), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            for line in data[:data.rfind(b"\n") + 1].splitlines():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_loaded()
+            self._catch_up()
+            return {
+                "entries": sum(self._segment_lines.values()),
+                "segments": len(self._segment_lines),
+                "appended": self.appended,
+                "rotations": self.rotations,
+                "removed_segments": self.removed_segments,
+                "tail": len(self._tail),
+            }
+
+# Общий журнал процесса (файлы открываются при первом обращении)
+post_history = PostHistory()
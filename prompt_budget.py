@@ -0,0 +1,199 @@
+import os
+import re
+import math
+import logging
+import threading
+from dotenv import load_dotenv
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Бюджет токенов на один вызов модели: системный промпт, история и результаты инструментов
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 2500))
+# Сколько токенов отдавать под результаты веб-поиска и под один ответ инструмента
+PROMPT_SEARCH_TOKENS = int(os.getenv("PROMPT_SEARCH_TOKENS", 600))
+PROMPT_TOOL_OUTPUT_TOKENS = int(os.getenv("PROMPT_TOOL_OUTPUT_TOKENS", 800))
+# Доля общих фраз, начиная с которой фрагмент поиска считается повтором уже взятого
+PROMPT_SNIPPET_OVERLAP = float(os.getenv("PROMPT_SNIPPET_OVERLAP", 0.6))
+# Оценка длины токена в символах (для русского текста у GigaChat около 3-4)
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", 3.5))
+
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Меньше этого остатка бюджета фрагмент не обрезается, а отбрасывается
+MIN_PARTIAL_TOKENS = 30
+
+WORD_RE = re.compile(r"\w+")
+SENTENCE_RE = re.compile(r"[^.!?\n]+[.!?]*")
+WHITESPACE_RE = re.compile(r"\s+")
+
+def estimate_tokens(text: str) -> int:
+    """Приближенное число токенов в тексте (без обращения к токенизатору модели)."""
+    return math.ceil(len(text or "") / PROMPT_CHARS_PER_TOKEN)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Обрезает текст до бюджета по границе предложения или слова."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, int(max_tokens * PROMPT_CHARS_PER_TOKEN) - 1)
+    cut = text[:limit]
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "), cut.rfind("\n"))
+    if sentence_end > limit // 2:
+        return cut[:sentence_end + 1].rstrip()
+    last_space = cut.rfind(" ")
+    if last_space > limit // 2:
+        cut = cut[:last_space]
+    return cut.rstrip() + "…"
+
+def _shingles(text: str) -> set:
+    words = WORD_RE.findall(text.casefold().replace("ё", "е"))
+    if len(words) < 3:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+def dedupe_snippets(snippets: list, overlap: float = PROMPT_SNIPPET_OVERLAP) -> list:
+    """
+    Убирает повторы из фрагментов поиска: предложения, которые уже встречались,
+    и фрагменты, большая часть фраз которых уже есть в ранее взятых.
+    """
+    seen_sentences = set()
+    seen_shingles = set()
+    result = []
+    for snippet in snippets:
+        sentences = []
+        for sentence in SENTENCE_RE.findall(snippet or ""):
+            key = WHITESPACE_RE.sub(" ", sentence.casefold()).strip()
+            if key and key not in seen_sentences:
+                seen_sentences.add(key)
+                sentences.append(sentence.strip())
+        text = " ".join(sentences)
+        shingles = _shingles(text)
+        if not shingles:
+            continue
+        if len(shingles & seen_shingles) / len(shingles) >= overlap:
+            continue
+        seen_shingles |= shingles
+        result.append(text)
+    return result
+
+def fit_snippets(snippets: list, max_tokens: int) -> list:
+    """Берет фрагменты по порядку, пока они помещаются в бюджет; последний может быть обрезан."""
+    fitted = []
+    remaining = max_tokens
+    for snippet in snippets:
+        tokens = estimate_tokens(snippet) + 1
+        if tokens <= remaining:
+            fitted.append(snippet)
+            remaining -= tokens
+            continue
+        if remaining >= MIN_PARTIAL_TOKENS:
+            fitted.append(truncate_to_tokens(snippet, remaining - 1))
+        break
+    return fitted
+
+def search_snippets(results) -> list:
+    """Достает тексты из ответа поиска (список результатов или словарь с ключом results, как у TavilySearch)."""
+    if isinstance(results, dict):
+        results = results.get("results") or []
+    if isinstance(results, str):
+        return [results] if results.strip() else []
+    return [res.get("content", "") for res in results if isinstance(res, dict) and res.get("content")]
+
+def _message_tokens(message) -> int:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += estimate_tokens(str(tool_call.get("args", ""))) + MESSAGE_OVERHEAD_TOKENS
+    return tokens
+
+def count_message_tokens(messages: list) -> int:
+    """Приближенный размер списка сообщений в токенах."""
+    return sum(_message_tokens(message) for message in messages)
+
+class PromptBudgeter:
+    """
+    Укладывает промпт каждого вызова модели в бюджет токенов: сжимает результаты поиска,
+    обрезает длинные ответы инструментов и старую историю. Ведет статистику размеров до и после.
+    """
+
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET, search_tokens: int = PROMPT_SEARCH_TOKENS,
+                 tool_output_tokens: int = PROMPT_TOOL_OUTPUT_TOKENS):
+        self.budget = budget
+        self.search_tokens = search_tokens
+        self.tool_output_tokens = tool_output_tokens
+        self.calls = 0
+        self.trimmed_calls = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.max_tokens_before = 0
+        self._lock = threading.Lock()
+
+    def _record(self, kind: str, before: int, after: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.tokens_before += before
+            self.tokens_after += after
+            self.max_tokens_before = max(self.max_tokens_before, before)
+            if after < before:
+                self.trimmed_calls += 1
+        if after < before:
+            logger.info(f"Промпт ({kind}) сокращен: {before} -> {after} токенов.")
+        else:
+            logger.debug(f"Промпт ({kind}): {before} токенов, в пределах бюджета.")
+
+    def fit_search_results(self, results, max_tokens: int = None) -> str:
+        """Контекст из результатов поиска: без повторов и в пределах бюджета на поиск."""
+        snippets = search_snippets(results)
+        before = sum(estimate_tokens(snippet) + 1 for snippet in snippets)
+        fitted = fit_snippets(dedupe_snippets(snippets), max_tokens or self.search_tokens)
+        context = "\n".join(fitted)
+        self._record("поиск", before, estimate_tokens(context))
+        return context
+
+    def fit_messages(self, messages: list, system_prompt: str = "") -> list:
+        """
+        Сообщения для вызова модели в пределах бюджета с учетом системного промпта:
+        длинные ответы инструментов обрезаются, затем отбрасывается самая старая история.
+        Последний запрос пользователя сохраняется всегда.
+        """
+        from langchain_core.messages import HumanMessage, ToolMessage
+        from langchain_core.messages.utils import trim_messages
+
+        before = count_message_tokens(messages) + estimate_tokens(system_prompt)
+        fitted = []
+        for message in messages:
+            if isinstance(message, ToolMessage) and isinstance(message.content, str) \
+                    and estimate_tokens(message.content) > self.tool_output_tokens:
+                message = message.model_copy(update={"content": truncate_to_tokens(message.content, self.tool_output_tokens)})
+            fitted.append(message)
+
+        history_budget = max(0, self.budget - estimate_tokens(system_prompt))
+        if count_message_tokens(fitted) > history_budget:
+            trimmed = trim_messages(fitted, max_tokens=history_budget, token_counter=count_message_tokens,
+                                    strategy="last", start_on="human")
+            if not trimmed and fitted:
+                # Даже последний запрос не помещается: оставляем его с ответами инструментов целиком
+                start = max((i for i, message in enumerate(fitted) if isinstance(message, HumanMessage)),
+                            default=len(fitted) - 1)
+                trimmed = fitted[start:]
+            fitted = trimmed
+
+        self._record("агент", before, count_message_tokens(fitted) + estimate_tokens(system_prompt))
+        return fitted
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self.calls
+            return {
+                "calls": calls,
+                "trimmed_calls": self.trimmed_calls,
+                "avg_tokens_before": self.tokens_before / calls if calls else 0.0,
+                "avg_tokens_after": self.tokens_after / calls if calls else 0.0,
+                "max_tokens_before": self.max_tokens_before,
+                "saved_ratio": 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0,
+            }
+
+# Общий бюджетировщик процесса
+budgeter = PromptBudgeter()
@@ -0,0 +1,101 @@
+import os
+import re
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+
+from ttl_cache import TTLCache
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 500))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 900))
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    """Нормализует поисковый запрос: регистр, пробелы и знаки препинания по краям."""
+    return WHITESPACE_RE.sub(" ", (query or "").casefold().replace("ё", "е")).strip(" .,!?;:\"'«»")
+
+class _InflightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SearchCache:
+    """
+    Кэш результатов веб-поиска с TTL и ограничением размера.
+    Одновременные одинаковые запросы разделяют один вызов поискового API.
+    """
+
+    def __init__(self, fetch, maxsize: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.fetch = fetch
+        self.cache = TTLCache(maxsize, ttl)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.shared_calls = 0
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.upstream_seconds = 0.0
+
+    def search(self, query: str):
+        key = normalize_query(query)
+        results = self.cache.get(key)
+        if results is not None:
+            logger.info(f"Результаты поиска для '{query}' взяты из кэша.")
+            return results
+
+        with self._lock:
+            call = self._inflight.get(key)
+            if call is None:
+                # Результат мог появиться, пока мы ждали блокировку
+                results = self.cache.peek(key)
+                if results is not None:
+                    return results
+            leader = call is None
+            if leader:
+                call = _InflightCall()
+                self._inflight[key] = call
+            else:
+                self.shared_calls += 1
+
+        if not leader:
+            logger.info(f"Запрос '{query}' уже выполняется, ожидаю его результат.")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        started = time.perf_counter()
+        try:
+            call.result = self.fetch(query)
+            self.cache.set(key, call.result)
+            return call.result
+        except Exception as e:
+            call.error = e
+            self.upstream_errors += 1
+            raise
+        finally:
+            self.upstream_calls += 1
+            self.upstream_seconds += time.perf_counter() - started
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> dict:
+        cache_stats = self.cache.stats()
+        return {
+            "size": cache_stats["size"],
+            "hits": cache_stats["hits"],
+            "misses": cache_stats["misses"],
+            "hit_ratio": cache_stats["hit_ratio"],
+            "shared_calls": self.shared_calls,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+            "upstream_avg_latency": self.upstream_seconds / self.upstream_calls if self.upstream_calls else 0.0,
+        }
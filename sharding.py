@@ -0,0 +1,7 @@
+def shard_of(key, shards: int) -> int:
+    """
+    Номер рабочего процесса для ключа (user_id или id чата); не зависит от PYTHONHASHSEED
+    и одинаков после перезапуска. Общий для раздачи обновлений (telegram_shards)
+    и владения участниками рейтинга (leaderboard), поэтому модуль не зависит от Telegram.
+    """
+    return int(key) % shards
@@ -1,17 +1,17 @@
 import os
 import logging
 import json
+import math
+import time
+import asyncio
+import threading
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
     ContextTypes, CallbackQueryHandler
 )
-
-# --- Firebase Imports ---
-# Убедитесь, что у вас установлен firebase-admin: pip install firebase-admin
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from telegram.request import HTTPXRequest
 
 # --- Базовая настройка ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -21,7 +21,23 @@ load_dotenv()
 # --- Импорт из agent_core ---
 try:
     # Импортируем все необходимые функции из agent_core
-    from agent_core import create_telegram_post, get_user_stats, get_community_rating, answer_question, analyze_message
+    from agent_core import (
+        create_telegram_post_async, get_user_stats, get_community_rating,
+        answer_question_async, analyze_message_async, moderate_message_async,
+        stream_post_async, generate_telegram_post, close_checkpointer, POST_PIPELINES, POST_PIPELINE,
+        regenerate_post_async, is_valid_post, get_moderation_stats, get_search_cache_stats, get_answer_cache_stats,
+        get_agent_memory_stats, get_prompt_budget_stats, get_hedge_stats, get_llm_scheduler_stats
+    )
+    from telegram_stream import ThrottledMessageEditor
+    from telegram_webhook import run_application, bot_api_base_url, TELEGRAM_API_BASE_URL, TELEGRAM_CONCURRENT_UPDATES
+    from telegram_shards import ShardRouter, build_router_application, TELEGRAM_WORKERS
+    from llm_executor import shutdown_llm_executor, share_llm_limits, LLMOverloaded, LLMRateLimited, PRIORITY_CHAT
+    from firestore_writer import FirestoreWriteBehind
+    from user_stats import stats_store
+    from leaderboard import leaderboard
+    from post_history import post_history
+    from post_dedup import post_index, content_lines, POST_DUPLICATE_CHECK, POST_DUPLICATE_RETRIES
+    from metrics import span, registry, trace_handler, start_metrics_server, stop_metrics_server, METRICS_PORT
 except ImportError:
     logger.critical("Не удалось импортировать функции из agent_core.py. Убедитесь, что файл существует и корректен.")
     raise
@@ -29,14 +45,23 @@ except ImportError:
 # --- Конфигурация (читается из .env) ---
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHANNEL_ID = os.getenv("TELEGRAM_CHANNEL_ID")
-POST_HISTORY_FILE = "published_posts.json"
+# Размер пула соединений к Bot API (у PTB по умолчанию одно соединение, и ответы идут по очереди)
+TELEGRAM_CONNECTION_POOL = int(os.getenv("TELEGRAM_CONNECTION_POOL", TELEGRAM_CONCURRENT_UPDATES))
+# Потоковая генерация /generate: черновик (или шаги агента) появляется в сообщении по мере генерации
+GENERATE_STREAMING = os.getenv("GENERATE_STREAMING", "true").lower() in ("1", "true", "yes")
+# Сколько последних постов коллекции published_posts загрузить в индекс повторов при первой проверке
+POST_DUPLICATE_FIRESTORE_LIMIT = int(os.getenv("POST_DUPLICATE_FIRESTORE_LIMIT", 500))
 
 # --- Firebase Initialization ---
 db = None # Инициализируем db как None по умолчанию
+firestore = None # Модуль firestore импортируется только при наличии конфигурации
 app_id = os.getenv("__app_id", "default-app-id") # app_id должен быть доступен всегда
 try:
     firebase_config_str = os.getenv("__firebase_config")
     if firebase_config_str:
+        # Убедитесь, что у вас установлен firebase-admin: pip install firebase-admin
+        import firebase_admin
+        from firebase_admin import credentials, firestore
         firebase_config = json.loads(firebase_config_str)
         if not firebase_admin._apps:
             cred = credentials.Certificate(firebase_config)
@@ -52,64 +77,184 @@ except Exception as e:
     logger.error(f"Ошибка инициализации Firebase: {e}", exc_info=True)
     db = None
 
+# Отложенная пакетная запись пользователей и сообщений в Firestore
+firestore_writer = FirestoreWriteBehind(db) if db else None
+# Блокировки регистрации: одновременные первые сообщения пользователя читают профиль один раз
+_registration_locks = {}
+
+def _load_user_profile(user_id: str):
+    """Читает документ профиля пользователя (используется при промахе кэша статистики)."""
+    with span("firestore", "profile_get"):
+        user_doc = db.collection(f"artifacts/{app_id}/users/{user_id}/profile").document("data").get()
+    return user_doc.to_dict() if user_doc.exists else None
+
+if db:
+    stats_store.configure(load_profile=_load_user_profile)
+else:
+    # Без Firestore очки после перезапуска восстанавливаются из снимка рейтинга
+    stats_store.configure(load_profile=leaderboard.profile)
+
+# Рейтинг сообщества обновляется при каждом изменении статистики
+stats_store.add_listener(leaderboard.update)
+
+def index_published_post(entry: dict) -> None:
+    """Добавляет запись журнала постов (в том числе записанную другим процессом) в индекс повторов."""
+    post_index.add(entry.get("text", ""))
+
+post_history.add_listener(index_published_post)
+_published_posts_loaded = False
+# Одновременные первые проверки ждут одну загрузку постов из Firestore
+_published_posts_lock = threading.Lock()
+
+# Счетчики компонентов выводятся на /metrics (датчик jk_component_stat) при каждом запросе
+registry.register_gauges("moderation", get_moderation_stats)
+registry.register_gauges("search_cache", get_search_cache_stats)
+registry.register_gauges("answer_cache", get_answer_cache_stats)
+registry.register_gauges("agent_memory", get_agent_memory_stats)
+registry.register_gauges("prompt_budget", get_prompt_budget_stats)
+registry.register_gauges("post_hedge", get_hedge_stats)
+registry.register_gauges("llm_scheduler", get_llm_scheduler_stats)
+registry.register_gauges("firestore_writer", lambda: firestore_writer.stats() if firestore_writer else {})
+registry.register_gauges("post_dedup", lambda: post_index.stats())
+
 # --- Вспомогательные функции ---
-def save_post_to_history(post_text: str):
-    """Сохраняет текст опубликованного поста в файл истории."""
-    history = []
-    try:
-        with open(POST_HISTORY_FILE, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        pass
+def save_post_to_history(post_text: str, user_id: str = None):
+    """Дописывает опубликованный пост в журнал истории (post_history)."""
+    with span("post_history", "append"):
+        post_history.append(post_text, published_by_user_id=user_id)
+
+def _load_published_posts() -> None:
+    """
+    Добавляет в индекс повторов последние посты из Firestore (published_posts) — один раз
+    за процесс; после ошибки загрузка повторяется при следующей проверке.
+    """
+    global _published_posts_loaded
+    if _published_posts_loaded or not db:
+        return
+    with _published_posts_lock:
+        if _published_posts_loaded:
+            return
+        try:
+            with span("firestore", "published_posts_load"):
+                docs = db.collection(f"artifacts/{app_id}/public/data/published_posts") \
+                    .order_by("timestamp", direction="DESCENDING").limit(POST_DUPLICATE_FIRESTORE_LIMIT).stream()
+                added = sum(post_index.add((doc.to_dict() or {}).get("text", "")) for doc in docs)
+        except Exception as e:
+            # Флаг не ставится: следующая проверка попробует загрузить посты снова
+            logger.warning(f"Не удалось загрузить опубликованные посты из Firestore для поиска повторов: {e}")
+            return
+        _published_posts_loaded = True
+    logger.info(f"Индекс повторов: из Firestore добавлено постов: {added}.")
 
-    history.append(post_text)
-    if len(history) > 10: # Ограничиваем историю 10 последними постами
-        history = history[-10:]
+def refresh_post_index() -> None:
+    """Подтягивает в индекс повторов посты журнала (в том числе других процессов) и Firestore."""
+    with span("post_history", "refresh"):
+        post_history.refresh()
+    _load_published_posts()
 
-    with open(POST_HISTORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=4)
+async def find_duplicate_post(post_text: str):
+    """Опубликованный пост, который черновик повторяет (DuplicateMatch), или None."""
+    if not POST_DUPLICATE_CHECK:
+        return None
+    await asyncio.to_thread(refresh_post_index)
+    with span("post_dedup", "check"):
+        return post_index.find_duplicate(post_text)
+
+async def avoid_duplicate_post(query: str, post_text: str, on_retry=None, user_id: str = None) -> tuple:
+    """
+    Если черновик повторяет опубликованный пост, пишет новый, передавая модели тот пост как
+    отрицательный пример (не больше POST_DUPLICATE_RETRIES раз). Возвращает (пост, совпадение или None).
+    on_retry — корутина, которая вызывается перед каждой новой генерацией (например, чтобы показать статус).
+    Повторы выполняются от имени user_id, но не списываются из его лимита.
+    """
+    match = await find_duplicate_post(post_text)
+    for attempt in range(1, POST_DUPLICATE_RETRIES + 1):
+        if match is None:
+            break
+        logger.info(f"Черновик повторяет опубликованный пост ({match.reason}, расстояние {match.distance}), "
+                    f"генерируем заново ({attempt}/{POST_DUPLICATE_RETRIES}).")
+        if on_retry is not None:
+            await on_retry()
+        candidate = await regenerate_post_async(query, "\n".join(content_lines(match.text)), user_id)
+        if not is_valid_post(candidate):
+            break
+        post_text = candidate
+        match = await find_duplicate_post(post_text)
+    return post_text, match
+
+DUPLICATE_WARNING = "⚠️ Этот пост похож на уже опубликованный в канале. Проверьте его перед публикацией."
+
+async def _register_user(update: Update, user_ref, user_id: str, username: str) -> None:
+    """Читает профиль нового для процесса пользователя и создает его, если документа еще нет."""
+    user_doc = await asyncio.to_thread(user_ref.get)
+    if not user_doc.exists:
+        # Запись со слиянием и без счетчиков: она не затирает инкременты, уже стоящие в очереди.
+        # Отсутствующие счетчики Firestore Increment начинает с нуля
+        user_data = {
+            "telegram_id": user_id,
+            "username": username,
+            "first_name": update.effective_user.first_name or "",
+            "last_name": update.effective_user.last_name or "",
+            "registration_date": firestore.SERVER_TIMESTAMP,
+        }
+        firestore_writer.set(user_ref, user_data, merge=True)
+        logger.info(f"Новый пользователь зарегистрирован: {username} ({user_id})")
+    stats_store.warm(user_id, user_doc.to_dict() if user_doc.exists else {"username": username})
+    firestore_writer.mark_user_known(user_id)
 
 async def register_user_and_save_message(update: Update, message_text: str):
     """
     Регистрирует пользователя в Firestore (если его нет) и сохраняет сообщение.
     """
+    user_id = str(update.effective_user.id)
+    username = update.effective_user.username or f"user_{user_id}"
+
     if not db:
         logger.warning("Firestore не инициализирован, пропуск сохранения пользователя и сообщения.")
+        # Первое сообщение после перезапуска продолжает счет из снимка, а не начинает с нуля
+        stats_store.get(user_id)
+        stats_store.record_message(user_id, username)
         return
 
-    user_id = str(update.effective_user.id)
-    username = update.effective_user.username or f"user_{user_id}"
-    
     user_ref = db.collection(f"artifacts/{app_id}/users/{user_id}/profile").document("data")
-    
+
     try:
-        user_doc = user_ref.get()
-        if not user_doc.exists:
-            user_data = {
-                "telegram_id": user_id,
-                "username": username,
-                "first_name": update.effective_user.first_name or "",
-                "last_name": update.effective_user.last_name or "",
-                "registration_date": firestore.SERVER_TIMESTAMP,
-                "activity_score": 0,
-                "jk_earned": 0
-            }
-            user_ref.set(user_data)
-            logger.info(f"Новый пользователь зарегистрирован: {username} ({user_id})")
-        
-        # Сохранение сообщения
+        # Профиль читается только для пользователей, которых этот процесс еще не видел
+        if not firestore_writer.is_known_user(user_id):
+            lock = _registration_locks.setdefault(user_id, asyncio.Lock())
+            try:
+                async with lock:
+                    if not firestore_writer.is_known_user(user_id):
+                        await _register_user(update, user_ref, user_id, username)
+            finally:
+                if not lock.locked():
+                    _registration_locks.pop(user_id, None)
+
+        # Сохранение сообщения (запись уходит в Firestore пакетом в фоне)
         messages_collection_ref = db.collection(f"artifacts/{app_id}/users/{user_id}/messages")
         message_data = {
             "text": message_text,
             "timestamp": firestore.SERVER_TIMESTAMP
         }
-        messages_collection_ref.add(message_data)
-        logger.info(f"Сообщение пользователя {user_id} сохранено в Firestore.")
+        firestore_writer.add(messages_collection_ref, message_data)
+        logger.debug(f"Сообщение пользователя {user_id} поставлено в очередь записи в Firestore.")
+
+        # Агрегаты статистики обновляются атомарными инкрементами в документе профиля
+        increments = stats_store.record_message(user_id, username)
+        profile_update = {field: firestore.Increment(delta) for field, delta in increments.items() if delta}
+        profile_update["last_activity"] = firestore.SERVER_TIMESTAMP
+        firestore_writer.set(user_ref, profile_update, merge=True)
 
     except Exception as e:
         logger.error(f"Ошибка при регистрации пользователя или сохранении сообщения в Firestore: {e}", exc_info=True)
 
 
+def overload_message(error: LLMOverloaded) -> str:
+    """Ответ пользователю, когда вызов LLM отклонен планировщиком."""
+    if isinstance(error, LLMRateLimited):
+        return f"⏳ Слишком много запросов. Попробуйте через {math.ceil(error.retry_after)} с."
+    return "⏳ Бот сейчас перегружен. Попробуйте через минуту."
+
 # --- Обработчики команд бота ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет приветственное сообщение и регистрирует пользователя."""
@@ -126,7 +271,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 🤖 **JK Community Hub Bot** - Интеллектуальный помощник сообщества
 
 **Основные команды:**
-/generate [тема] - Создание поста для канала
+/generate [тема] - Создание поста для канала (--fast или --agent перед темой выбирает способ)
 /stats - Ваша личная статистика
 /rating - Рейтинг активных участников
 /ask [вопрос] - Задать вопрос боту
@@ -141,7 +286,8 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user_id = str(update.effective_user.id)
     await register_user_and_save_message(update, "/stats")
     try:
-        stats = get_user_stats(user_id)
+        # При промахе кэша статистики читается профиль в Firestore — не в цикле событий
+        stats = await asyncio.to_thread(get_user_stats, user_id)
         await update.message.reply_text(f"📊 **Ваша статистика:**\n\n{stats}", parse_mode='Markdown')
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {e}")
@@ -166,8 +312,10 @@ async def ask_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         return
     await update.message.reply_text(f"🤔 Обрабатываю ваш вопрос: '{question}'...")
     try:
-        answer = answer_question(question)
+        answer = await answer_question_async(question, str(update.effective_user.id))
         await update.message.reply_text(f"💡 **Ответ:**\n\n{answer}", parse_mode='Markdown')
+    except LLMOverloaded as e:
+        await update.message.reply_text(overload_message(e))
     except Exception as e:
         logger.error(f"Ошибка при ответе на вопрос: {e}")
         await update.message.reply_text("❌ Не удалось обработать вопрос. Попробуйте позже.")
@@ -181,33 +329,113 @@ async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     await update.message.reply_text(f"🔍 Анализирую текст: '{text_to_analyze[:50]}...'")
     try:
-        analysis = analyze_message(text_to_analyze)
+        analysis = await analyze_message_async(text_to_analyze, str(update.effective_user.id))
         # Форматируем JSON для красивого вывода
         pretty_analysis = json.dumps(analysis, ensure_ascii=False, indent=2)
         await update.message.reply_text(f"📊 **Результат анализа:**\n```json\n{pretty_analysis}\n```", parse_mode='MarkdownV2')
+    except LLMOverloaded as e:
+        await update.message.reply_text(overload_message(e))
     except Exception as e:
         logger.error(f"Ошибка при анализе текста: {e}")
         await update.message.reply_text("❌ Не удалось проанализировать текст. Попробуйте позже.")
 
+def _publish_keyboard() -> InlineKeyboardMarkup:
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ Опубликовать", callback_data="publish"),
+            InlineKeyboardButton("❌ Отмена", callback_data="cancel"),
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def agent_thread_id(update: Update) -> str:
+    """Отдельный поток памяти агента для каждого пользователя в каждом чате."""
+    return f"chat_{update.effective_chat.id}_user_{update.effective_user.id}"
+
+async def generate_post_streaming(query: str, placeholder, thread_id: str = "default_thread", user_id: str = None,
+                                  pipeline: str = None) -> str:
+    """
+    Генерирует пост потоком в сообщение-заглушку (правки с ограничением частоты)
+    и прикрепляет клавиатуру публикации в конце. Возвращает итоговый текст поста.
+    Быстрый конвейер показывает черновик по токенам; если поток не удался, пост генерируется
+    обычным способом. Агент показывает, что он делает (поиск, оформление), и токены своего ответа.
+    """
+    editor = ThrottledMessageEditor(placeholder)
+    pipeline = pipeline or POST_PIPELINE
+    if pipeline == "agent":
+        status, draft = placeholder.text, ""
+
+        async def on_progress(kind: str, value: str) -> None:
+            nonlocal status, draft
+            if kind == "status":
+                status, draft = value, ""
+            else:
+                draft += value
+            await editor.update(draft or status)
+
+        post_text = await create_telegram_post_async(query, thread_id, pipeline, user_id, on_progress)
+    else:
+        draft = ""
+        try:
+            async for delta in stream_post_async(query, user_id):
+                draft += delta
+                await editor.update(draft)
+        except LLMOverloaded:
+            raise
+        except Exception as e:
+            logger.warning(f"Потоковая генерация поста не удалась, генерируем обычным способом: {e}")
+            draft = ""
+        if draft.strip():
+            post_text = generate_telegram_post(query, draft)
+        else:
+            # Запрос уже списан из лимита пользователя потоком
+            post_text = await create_telegram_post_async(query, thread_id, pipeline, user_id, charge=False)
+    post_text, match = await avoid_duplicate_post(
+        query, post_text, lambda: editor.update("♻️ Черновик повторяет уже опубликованный пост, пишу другой..."), user_id)
+    await editor.finish(post_text, reply_markup=_publish_keyboard())
+    if match is not None:
+        await placeholder.reply_text(DUPLICATE_WARNING)
+    logger.info(f"Пост сгенерирован потоком: {editor.edits} правок, пропущено {editor.skipped}.")
+    return post_text
+
+def parse_pipeline(args: list) -> tuple:
+    """Выделяет из аргументов /generate флаг конвейера (--fast или --agent). Возвращает (конвейер или None, аргументы)."""
+    if args and args[0].startswith("--") and args[0][2:] in POST_PIPELINES:
+        return args[0][2:], args[1:]
+    return None, args
+
 async def generate_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Начинает процесс генерации поста."""
-    query = " ".join(context.args)
+    pipeline, args = parse_pipeline(context.args or [])
+    query = " ".join(args)
     await register_user_and_save_message(update, f"/generate {query}")
     if not query:
         await update.message.reply_text("Пожалуйста, укажите тему. Например: /generate пост о подготовке к походу в горы.")
         return
+    # Оба конвейера показывают ход генерации в одном сообщении: быстрый — черновик по токенам,
+    # агент — свои шаги и токены ответа (его страховка POST_HEDGE сохраняется)
+    pipeline = pipeline or POST_PIPELINE
+    if GENERATE_STREAMING:
+        placeholder = await update.message.reply_text(f"Генерирую пост на тему: '{query}'...")
+        try:
+            context.user_data['post_text'] = await generate_post_streaming(
+                query, placeholder, agent_thread_id(update), str(update.effective_user.id), pipeline)
+        except LLMOverloaded as e:
+            await placeholder.edit_text(overload_message(e))
+        except Exception as e:
+            logger.error(f"Ошибка во время генерации поста: {e}", exc_info=True)
+            await update.message.reply_text("Произошла ошибка при генерации поста. Попробуйте еще раз.")
+        return
     await update.message.reply_text(f"Генерирую пост на тему: '{query}'. Это может занять до минуты...")
     try:
-        post_text = create_telegram_post(query)
+        post_text = await create_telegram_post_async(query, agent_thread_id(update), pipeline, str(update.effective_user.id))
+        post_text, match = await avoid_duplicate_post(query, post_text, user_id=str(update.effective_user.id))
         context.user_data['post_text'] = post_text
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Опубликовать", callback_data="publish"),
-                InlineKeyboardButton("❌ Отмена", callback_data="cancel"),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(text=post_text, reply_markup=reply_markup)
+        await update.message.reply_text(text=post_text, reply_markup=_publish_keyboard())
+        if match is not None:
+            await update.message.reply_text(DUPLICATE_WARNING)
+    except LLMOverloaded as e:
+        await update.message.reply_text(overload_message(e))
     except Exception as e:
         logger.error(f"Ошибка во время генерации поста: {e}", exc_info=True)
         await update.message.reply_text("Произошла ошибка при генерации поста. Попробуйте еще раз.")
@@ -228,7 +456,7 @@ async def confirm_publish(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
         try:
             await context.bot.send_message(chat_id=channel_id, text=post_text)
-            save_post_to_history(post_text)
+            await asyncio.to_thread(save_post_to_history, post_text, str(update.effective_user.id))
             await query.edit_message_text("✅ Пост успешно опубликован в канале!", reply_markup=None)
             if db:
                 posts_collection_ref = db.collection(f"artifacts/{app_id}/public/data/published_posts")
@@ -238,7 +466,8 @@ async def confirm_publish(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     "published_by_user_id": str(update.effective_user.id),
                     "published_by_username": update.effective_user.username or f"user_{str(update.effective_user.id)}"
                 }
-                posts_collection_ref.add(post_data)
+                with span("firestore", "published_post_add"):
+                    posts_collection_ref.add(post_data)
         except Exception as e:
             await query.edit_message_text(f"❌ Не удалось опубликовать. Ошибка: {e}", reply_markup=None)
     else: # 'cancel'
@@ -257,8 +486,8 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     
     try:
-        # Анализируем сообщение на токсичность
-        analysis_result = analyze_message(message_text)
+        # Анализируем сообщение на токсичность (пакетно вместе с другими сообщениями чата)
+        analysis_result = await moderate_message_async(message_text)
         
         is_toxic = analysis_result.get("is_toxic", False)
         toxicity_score = analysis_result.get("toxicity_score", 0)
@@ -271,7 +500,8 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         
         # Если это похоже на вопрос, пытаемся ответить
         if "?" in message_text or any(word in message_text.lower() for word in ["как", "что", "где", "когда", "почему", "помоги", "подскажи"]):
-            answer = answer_question(message_text)
+            # Автоответ в чате уступает командам и отбрасывается при перегрузке (ниже — простое подтверждение)
+            answer = await answer_question_async(message_text, str(update.effective_user.id), PRIORITY_CHAT)
             await update.message.reply_text(f"💡 **Ответ:**\n\n{answer}", parse_mode='Markdown')
             return
         
@@ -282,26 +512,100 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.error(f"Ошибка при обработке сообщения: {e}")
         await update.message.reply_text("✅ Сообщение получено. Спасибо за активность в сообществе!")
 
+class TracedRequest(HTTPXRequest):
+    """HTTP-клиент Bot API, который замеряет каждый вызов метода (sendMessage, editMessageText и т.д.)."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> tuple:
+        started = time.perf_counter()
+        error = True
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            error = code >= 400
+            return code, payload
+        finally:
+            registry.observe("telegram", url.rsplit("/", 1)[-1], time.perf_counter() - started, error=error)
+
+async def _on_shutdown(application: Application) -> None:
+    """Освобождает ресурсы при остановке бота."""
+    stop_metrics_server()
+    shutdown_llm_executor(wait=False)
+    await asyncio.to_thread(leaderboard.stop_snapshots)
+    await asyncio.to_thread(close_checkpointer)
+    if firestore_writer:
+        await asyncio.to_thread(firestore_writer.close)
+
+def build_application(token: str, request=None, api_base_url: str = None) -> Application:
+    """
+    Собирает приложение бота со всеми обработчиками. request — транспорт Bot API
+    (по умолчанию TracedRequest; нагрузочный стенд подставляет локальную имитацию),
+    api_base_url — адрес Bot API вместо api.telegram.org (TELEGRAM_API_BASE_URL).
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+        .request(request or TracedRequest(connection_pool_size=TELEGRAM_CONNECTION_POOL))
+        .post_shutdown(_on_shutdown)
+    )
+    base_url = bot_api_base_url(api_base_url or TELEGRAM_API_BASE_URL)
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+
+    # Каждый обработчик замеряется целиком, а вложенные этапы получают метку его имени
+    application.add_handler(CommandHandler("start", trace_handler("start", start)))
+    application.add_handler(CommandHandler("help", trace_handler("help", help_command)))
+    application.add_handler(CommandHandler("generate", trace_handler("generate", generate_start)))
+    application.add_handler(CommandHandler("stats", trace_handler("stats", stats_command)))
+    application.add_handler(CommandHandler("rating", trace_handler("rating", rating_command)))
+    application.add_handler(CommandHandler("ask", trace_handler("ask", ask_command)))
+    application.add_handler(CommandHandler("analyze", trace_handler("analyze", analyze_command)))
+    application.add_handler(CallbackQueryHandler(trace_handler("publish", confirm_publish)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, trace_handler("message", unknown)))
+    return application
+
+def build_worker_application(shard: int, shards: int) -> Application:
+    """
+    Приложение рабочего процесса (TELEGRAM_WORKERS > 1): своя доля лимитов LLM, свой снимок рейтинга
+    и свой порт метрик (METRICS_PORT + 1 + номер процесса), остальное — как у однопроцессного бота.
+    """
+    share_llm_limits(shards)
+    application = build_application(TELEGRAM_BOT_TOKEN)
+    leaderboard.use_shard(shard, shards)
+    leaderboard.load_snapshot()
+    leaderboard.start_snapshots()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT + 1 + shard)
+    return application
+
 def main() -> None:
     """Запускает бота."""
     if not TELEGRAM_BOT_TOKEN:
         logger.critical("TELEGRAM_BOT_TOKEN не найден в .env файле.")
         return
-    
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("generate", generate_start))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(CommandHandler("rating", rating_command))
-    application.add_handler(CommandHandler("ask", ask_command))
-    application.add_handler(CommandHandler("analyze", analyze_command))
-    application.add_handler(CallbackQueryHandler(confirm_publish))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown))
+
+    if TELEGRAM_WORKERS > 1:
+        # Главный процесс только получает обновления и раздает их рабочим процессам по пользователю
+        router = ShardRouter(TELEGRAM_WORKERS, build_worker_application)
+        application = build_router_application(TELEGRAM_BOT_TOKEN, router, request=TracedRequest())
+        router.start()
+        start_metrics_server()
+        logger.info(f"Бот запущен, рабочих процессов: {TELEGRAM_WORKERS}. Ожидание сообщений...")
+        try:
+            run_application(application)
+        finally:
+            stop_metrics_server()
+            router.stop()
+        return
+
+    application = build_application(TELEGRAM_BOT_TOKEN)
+
+    leaderboard.load_snapshot()
+    leaderboard.start_snapshots()
+    start_metrics_server()
 
     logger.info("Бот запущен. Ожидание сообщений...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    run_application(application)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
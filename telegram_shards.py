@@ -0,0 +1,225 @@
+import os
+import time
+import queue
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+from functools import partial
+from dotenv import load_dotenv
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from sharding import shard_of
+from telegram_webhook import TELEGRAM_DRAIN_TIMEOUT, bot_api_base_url, TELEGRAM_API_BASE_URL
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Число рабочих процессов; 1 — все обновления обрабатываются в одном процессе, как раньше
+TELEGRAM_WORKERS = int(os.getenv("TELEGRAM_WORKERS", 1))
+# Как часто (в секундах) проверять, живы ли рабочие процессы
+TELEGRAM_WORKER_CHECK_INTERVAL = float(os.getenv("TELEGRAM_WORKER_CHECK_INTERVAL", 1))
+
+def update_shard_key(update: Update) -> int:
+    """
+    Ключ шардирования обновления: пользователь (его context.user_data, например черновик post_text,
+    и порядок его сообщений), для обновлений без пользователя — чат.
+    """
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.update_id
+
+# --- Рабочий процесс ---
+async def _process_in_order(application: Application, update: Update, previous, done_queue) -> None:
+    """Обрабатывает обновление после предыдущего обновления того же пользователя."""
+    if previous is not None:
+        await asyncio.wait({previous})
+    try:
+        await application.update_processor.process_update(update, application.process_update(update))
+    except Exception as e:
+        logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+    finally:
+        if done_queue is not None:
+            done_queue.put((update.update_id, time.monotonic()))
+
+def _forget(tails: dict, key: int, task) -> None:
+    if tails.get(key) is task:
+        del tails[key]
+
+def _receive(updates):
+    try:
+        return updates.recv()
+    except (EOFError, OSError):
+        return None
+
+async def _serve_shard(shard: int, shards: int, updates, done_queue, build, build_args: tuple) -> None:
+    application = build(shard, shards, *build_args)
+    loop = asyncio.get_running_loop()
+    # Последняя задача каждого пользователя: следующее его обновление ждет ее завершения,
+    # а обновления разных пользователей идут параллельно (в пределах concurrent_updates)
+    tails = {}
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"Рабочий процесс {shard + 1}/{shards} (pid {os.getpid()}) готов.")
+        while True:
+            data = await loop.run_in_executor(None, _receive, updates)
+            if data is None:
+                break
+            update = Update.de_json(data, application.bot)
+            key = update_shard_key(update)
+            task = asyncio.create_task(_process_in_order(application, update, tails.get(key), done_queue))
+            tails[key] = task
+            task.add_done_callback(partial(_forget, tails, key))
+
+        if tails:
+            logger.info(f"Рабочий процесс {shard + 1}: дорабатываем принятые обновления ({len(tails)} пользователей).")
+            _, pending = await asyncio.wait(set(tails.values()), timeout=TELEGRAM_DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+        if application.running:
+            await application.stop()
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def _worker_main(shard: int, shards: int, updates, done_queue, build, build_args: tuple) -> None:
+    # Ctrl+C получает вся группа процессов: рабочий останавливается по команде главного процесса
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_shard(shard, shards, updates, done_queue, build, build_args))
+
+# --- Главный процесс ---
+class ShardRouter:
+    """
+    Раздает обновления Telegram рабочим процессам по ключу update_shard_key: все обновления
+    пользователя попадают в один процесс и обрабатываются в порядке поступления. Каждый процесс
+    собирает свое приложение функцией build(shard, shards, *build_args) (она должна импортироваться
+    по имени: процессы запускаются методом spawn). Упавший процесс перезапускается, а его очередь
+    сохраняется; остальные процессы продолжают работу. Обновления, которые упавший процесс уже
+    получил, и его context.user_data теряются.
+
+    Обновления идут в процесс по однонаправленной трубе (Pipe), у которой один читатель, а не через
+    multiprocessing.Queue: процесс, упавший во время ожидания Queue.get, навсегда оставляет занятой
+    межпроцессную блокировку чтения, и перезапущенный процесс не получил бы ни одного обновления.
+    Запись в трубу идет из отдельного потока на каждый процесс, так что dispatch не блокируется,
+    даже если процесс не успевает читать.
+    """
+
+    def __init__(self, shards: int, build, build_args: tuple = (), done_queue=None,
+                 check_interval: float = TELEGRAM_WORKER_CHECK_INTERVAL):
+        self.shards = shards
+        self.build = build
+        self.build_args = build_args
+        self.done_queue = done_queue
+        self.check_interval = check_interval
+        self._context = multiprocessing.get_context("spawn")
+        self.pipes = [self._context.Pipe(duplex=False) for _ in range(shards)]
+        self.outboxes = [queue.SimpleQueue() for _ in range(shards)]
+        self._feeders = []
+        self.processes = [None] * shards
+        self.dispatched = [0] * shards
+        self.restarts = [0] * shards
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def _spawn(self, shard: int) -> None:
+        process = self._context.Process(
+            target=_worker_main, name=f"telegram-shard-{shard}", daemon=True,
+            args=(shard, self.shards, self.pipes[shard][0], self.done_queue, self.build, self.build_args),
+        )
+        process.start()
+        self.processes[shard] = process
+
+    def _feed(self, shard: int) -> None:
+        """Передает обновления из очереди процесса в его трубу; None (остановка) передается последним."""
+        writer = self.pipes[shard][1]
+        while True:
+            data = self.outboxes[shard].get()
+            writer.send(data)
+            if data is None:
+                return
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            for shard, process in enumerate(self.processes):
+                if process.is_alive() or self._stop.is_set():
+                    continue
+                self.restarts[shard] += 1
+                logger.error(f"Рабочий процесс {shard + 1} завершился с кодом {process.exitcode}, перезапуск "
+                             f"({self.restarts[shard]}-й).")
+                self._spawn(shard)
+
+    def start(self) -> None:
+        """Запускает рабочие процессы и наблюдение за ними."""
+        for shard in range(self.shards):
+            self._spawn(shard)
+        self._feeders = [threading.Thread(target=self._feed, args=(shard,), name=f"shard-feeder-{shard}", daemon=True)
+                         for shard in range(self.shards)]
+        for feeder in self._feeders:
+            feeder.start()
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="shard-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Запущено рабочих процессов: {self.shards}.")
+
+    def dispatch(self, update: Update) -> int:
+        """Отправляет обновление в процесс его пользователя и возвращает номер процесса."""
+        shard = shard_of(update_shard_key(update), self.shards)
+        self.outboxes[shard].put(update.to_dict())
+        self.dispatched[shard] += 1
+        return shard
+
+    def stop(self, drain_timeout: float = TELEGRAM_DRAIN_TIMEOUT) -> None:
+        """Останавливает процессы: каждый дорабатывает уже полученные обновления, не дольше drain_timeout."""
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+        for outbox in self.outboxes:
+            outbox.put(None)
+        deadline = time.monotonic() + drain_timeout + 10
+        for shard, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Рабочий процесс {shard + 1} не остановился вовремя и будет завершен.")
+                process.terminate()
+                process.join()
+        logger.info("Рабочие процессы остановлены.")
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.shards,
+            "alive": sum(1 for process in self.processes if process is not None and process.is_alive()),
+            "dispatched": list(self.dispatched),
+            "restarts": list(self.restarts),
+        }
+
+def build_router_application(token: str, router: ShardRouter, request=None, api_base_url: str = None) -> Application:
+    """
+    Приложение главного процесса: получает обновления (опросом или вебхуком) и только передает
+    их рабочим процессам. Обновления обрабатываются строго по одному, поэтому порядок сохраняется.
+    """
+    builder = Application.builder().token(token).concurrent_updates(False)
+    if request is not None:
+        builder = builder.request(request)
+    base_url = bot_api_base_url(api_base_url or TELEGRAM_API_BASE_URL)
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+
+    async def route(update: Update, context) -> None:
+        router.dispatch(update)
+
+    application.add_handler(TypeHandler(Update, route))
+    return application
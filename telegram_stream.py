@@ -0,0 +1,91 @@
+import os
+import time
+import asyncio
+import logging
+from dotenv import load_dotenv
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Минимальный интервал между редактированиями одного сообщения, в секундах
+# (Telegram ограничивает частоту правок; чаще раза в секунду в одном чате — риск RetryAfter)
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", 1.5))
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAM_CURSOR = " ▌"
+
+def _seconds(value) -> float:
+    # RetryAfter.retry_after бывает числом или timedelta в зависимости от версии библиотеки
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+def _fit(text: str) -> str:
+    if len(text) <= TELEGRAM_MESSAGE_LIMIT:
+        return text
+    return text[:TELEGRAM_MESSAGE_LIMIT - 1] + "…"
+
+class ThrottledMessageEditor:
+    """
+    Показывает текст, который генерируется потоком, в одном сообщении Telegram.
+    Промежуточные правки пропускаются, если с прошлой прошло меньше min_interval,
+    а после RetryAfter — до окончания запрошенной паузы. Итоговая правка не теряется:
+    finish() дожидается интервала и повторяет запрос после RetryAfter.
+    """
+
+    def __init__(self, message, min_interval: float = TELEGRAM_EDIT_INTERVAL, clock=time.monotonic):
+        self.message = message
+        self.min_interval = min_interval
+        self.clock = clock
+        self.edits = 0
+        self.skipped = 0
+        self.rate_limited = 0
+        self._last_text = getattr(message, "text", None)
+        self._next_edit_at = float("-inf")
+
+    async def update(self, text: str) -> bool:
+        """Показывает промежуточный текст, если это разрешено лимитом частоты. Возвращает True при правке."""
+        if self.clock() < self._next_edit_at:
+            self.skipped += 1
+            return False
+        try:
+            return await self._edit(text + STREAM_CURSOR)
+        except RetryAfter as e:
+            self._rate_limited(e)
+            return False
+        except TelegramError as e:
+            logger.warning(f"Не удалось обновить сообщение с черновиком: {e}")
+            return False
+
+    async def finish(self, text: str, reply_markup=None) -> None:
+        """Итоговая правка: полный текст и клавиатура."""
+        while True:
+            delay = self._next_edit_at - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self._edit(text, reply_markup, force=reply_markup is not None)
+                return
+            except RetryAfter as e:
+                self._rate_limited(e)
+
+    def _rate_limited(self, error: RetryAfter) -> None:
+        self.rate_limited += 1
+        retry_after = _seconds(error.retry_after)
+        self._next_edit_at = self.clock() + max(retry_after, self.min_interval)
+        logger.warning(f"Telegram ограничил частоту правок, пауза {retry_after:.1f} с.")
+
+    async def _edit(self, text: str, reply_markup=None, force: bool = False) -> bool:
+        text = _fit(text)
+        if text == self._last_text and not force:
+            return False
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._last_text = text
+        self._next_edit_at = self.clock() + self.min_interval
+        self.edits += 1
+        return True
@@ -0,0 +1,103 @@
+import os
+import signal
+import asyncio
+import logging
+from dotenv import load_dotenv
+from telegram import Update
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Режим получения обновлений: polling (опрос getUpdates) или webhook (встроенный HTTP-сервер)
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")
+# Публичный адрес вебхука за обратным прокси, который сообщается Telegram (например, https://bot.example.com/telegram)
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+# Где слушает встроенный сервер (прокси передает запросы сюда) и путь вебхука
+TELEGRAM_WEBHOOK_LISTEN = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "127.0.0.1")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", 8443))
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "telegram")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token: запросы без него отклоняются
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# Сколько соединений Telegram одновременно открывает к вебхуку
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", 40))
+# Сколько секунд при остановке ждать завершения уже принятых обновлений
+TELEGRAM_DRAIN_TIMEOUT = float(os.getenv("TELEGRAM_DRAIN_TIMEOUT", 30))
+# Адрес Bot API (локальный сервер Bot API или имитация Telegram); пусто — api.telegram.org
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")
+# Сколько обновлений Telegram обрабатывается одновременно (1 = строго последовательно); общий для bot.py и telegram_bot.py
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", 32))
+
+TELEGRAM_MODES = ("polling", "webhook")
+
+def bot_api_base_url(api_base_url: str = TELEGRAM_API_BASE_URL):
+    """Префикс адресов методов Bot API для ApplicationBuilder.base_url (None — адрес по умолчанию)."""
+    return f"{api_base_url.rstrip('/')}/bot" if api_base_url else None
+
+async def _drain(application, drain_timeout: float) -> None:
+    """Останавливает обработку: уже принятые обновления дорабатываются, но не дольше drain_timeout."""
+    in_flight = application.update_processor.current_concurrent_updates + application.update_queue.qsize()
+    logger.info(f"Остановка: дорабатываем принятые обновления ({in_flight}), не дольше {drain_timeout:.0f} с.")
+    try:
+        await asyncio.wait_for(application.stop(), drain_timeout)
+        logger.info("Все принятые обновления обработаны.")
+    except asyncio.TimeoutError:
+        logger.warning(f"Обновления не завершились за {drain_timeout:.0f} с и прерваны.")
+
+async def serve_webhook(application, stop_event: asyncio.Event = None, listen: str = TELEGRAM_WEBHOOK_LISTEN,
+                        port: int = TELEGRAM_WEBHOOK_PORT, url_path: str = TELEGRAM_WEBHOOK_PATH,
+                        webhook_url: str = TELEGRAM_WEBHOOK_URL, secret_token: str = TELEGRAM_WEBHOOK_SECRET,
+                        max_connections: int = TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+                        drain_timeout: float = TELEGRAM_DRAIN_TIMEOUT) -> None:
+    """
+    Запускает бота в режиме вебхука до stop_event или SIGINT/SIGTERM. При остановке сервер сразу
+    перестает принимать обновления (Telegram повторит их позже), а уже принятые дорабатываются.
+    Число одновременно обрабатываемых обновлений задается concurrent_updates приложения.
+    """
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    installed_signals = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+            installed_signals.append(sig)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Не главный поток или платформа без сигналов: остановка только через stop_event
+            pass
+
+    try:
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.updater.start_webhook(
+            listen=listen, port=port, url_path=url_path, webhook_url=webhook_url, secret_token=secret_token,
+            max_connections=max_connections, allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+        logger.info(f"Вебхук слушает {listen}:{port}/{url_path}, обновлений одновременно: "
+                    f"{application.update_processor.max_concurrent_updates}.")
+        await stop_event.wait()
+
+        await application.updater.stop()
+        await _drain(application, drain_timeout)
+    finally:
+        for sig in installed_signals:
+            loop.remove_signal_handler(sig)
+        if application.updater.running:
+            await application.updater.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def run_application(application, mode: str = TELEGRAM_MODE) -> None:
+    """Запускает бота в выбранном режиме (блокирующий вызов)."""
+    if mode == "webhook":
+        if not TELEGRAM_WEBHOOK_URL:
+            logger.critical("TELEGRAM_MODE=webhook, но TELEGRAM_WEBHOOK_URL не задан.")
+            return
+        asyncio.run(serve_webhook(application))
+        return
+    if mode not in TELEGRAM_MODES:
+        logger.warning(f"Неизвестный TELEGRAM_MODE '{mode}', используется polling.")
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Тесты памяти агента: обрезка истории, отдельные потоки пользователей и вытеснение простаивающих потоков
+"""
+
+import os
+import sys
+import sqlite3
+import itertools
+import tempfile
+import warnings
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from agent_memory import (
+    trim_history, make_history_hook, create_bounded_checkpointer,
+    create_sqlite_checkpointer, create_checkpointer
+)
+
+class FakeChatModel(GenericFakeChatModel):
+    """Модель, которая отвечает длинным текстом и не вызывает инструменты"""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+def _build_agent(checkpointer, max_messages=6, max_tokens=100000):
+    from langgraph.prebuilt import create_react_agent
+
+    replies = (AIMessage(content=f"ответ {i} " + "слово " * 50) for i in itertools.count())
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return create_react_agent(FakeChatModel(messages=replies), [], checkpointer=checkpointer,
+                                  prompt="Ты помощник.", pre_model_hook=make_history_hook(max_messages, max_tokens))
+
+def _ask(agent, thread_id, text):
+    config = {"configurable": {"thread_id": thread_id}}
+    return agent.invoke({"messages": [HumanMessage(content=text)]}, config, durability="async")["messages"]
+
+def test_trim_history_limits_messages_and_tokens():
+    """История обрезается по числу сообщений и токенам и начинается с сообщения пользователя"""
+    history = []
+    for i in range(10):
+        history += [
+            HumanMessage(content=f"вопрос {i}"),
+            AIMessage(content="", tool_calls=[{"name": "web_search", "args": {"query": "q"}, "id": f"call{i}"}]),
+            ToolMessage(content="результат " * 20, tool_call_id=f"call{i}"),
+            AIMessage(content=f"ответ {i}"),
+        ]
+
+    by_count = trim_history(history, max_messages=6, max_tokens=100000)
+    assert len(by_count) <= 6
+    assert isinstance(by_count[0], HumanMessage)
+    assert by_count[-1].content == "ответ 9"
+
+    by_tokens = trim_history(history, max_messages=100, max_tokens=150)
+    assert isinstance(by_tokens[0], HumanMessage)
+    assert by_tokens[0].content == "вопрос 9"
+
+def test_thread_history_and_checkpoints_stay_bounded():
+    """Сколько бы ни длился диалог, история и объем контрольных точек потока не растут"""
+    checkpointer = create_bounded_checkpointer(checkpoints_per_thread=2)
+    agent = _build_agent(checkpointer, max_messages=6)
+
+    sizes = []
+    for i in range(30):
+        messages = _ask(agent, "chat_1_user_1", f"вопрос {i}")
+        sizes.append(checkpointer.stats()["bytes"])
+
+    assert len(messages) <= 7
+    assert messages[-1].content.startswith("ответ 29")
+    stats = checkpointer.stats()
+    print(f"\n📊 После 30 сообщений: {stats}")
+    assert stats["threads"] == 1
+    assert stats["checkpoints"] == 2
+    assert sizes[-1] < sizes[9] * 1.2
+
+def test_threads_are_isolated_per_user():
+    """У каждого пользователя своя история"""
+    agent = _build_agent(create_bounded_checkpointer())
+    _ask(agent, "chat_1_user_1", "секрет первого")
+    messages = _ask(agent, "chat_1_user_2", "привет")
+    assert all("секрет" not in message.content for message in messages)
+
+def test_idle_and_excess_threads_evicted():
+    """Потоки вытесняются по простою (TTL) и по числу (LRU)"""
+    now = [0.0]
+    checkpointer = create_bounded_checkpointer(max_threads=3, thread_ttl=100, clock=lambda: now[0])
+    agent = _build_agent(checkpointer)
+
+    for user in range(5):
+        _ask(agent, f"user_{user}", "привет")
+    assert checkpointer.stats()["threads"] == 3
+    assert checkpointer.get_tuple({"configurable": {"thread_id": "user_0"}}) is None
+    assert checkpointer.get_tuple({"configurable": {"thread_id": "user_4"}}) is not None
+
+    now[0] = 50
+    _ask(agent, "user_3", "еще вопрос")
+    now[0] = 120
+    _ask(agent, "user_5", "привет")
+    stats = checkpointer.stats()
+    assert stats["threads"] == 2
+    assert stats["evicted_threads"] == 4
+    assert checkpointer.get_tuple({"configurable": {"thread_id": "user_3"}}) is not None
+
+def test_sqlite_state_survives_restart():
+    """Состояние агента в SQLite (WAL) доступно после перезапуска"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "checkpoints.sqlite")
+        checkpointer = create_sqlite_checkpointer(path)
+        agent = _build_agent(checkpointer)
+        _ask(agent, "chat_1_user_1", "меня зовут Жека")
+        _ask(agent, "chat_1_user_1", "второй вопрос")
+        checkpointer.close()
+
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        restarted = create_sqlite_checkpointer(path)
+        messages = _ask(_build_agent(restarted), "chat_1_user_1", "третий вопрос")
+        assert messages[0].content == "меня зовут Жека"
+        assert [m.content for m in messages if isinstance(m, HumanMessage)][-1] == "третий вопрос"
+        assert restarted.stats()["threads"] == 1
+        restarted.close()
+
+def test_sqlite_compaction_removes_old_checkpoints_and_idle_threads():
+    """Уплотнение оставляет последние контрольные точки и удаляет простаивающие потоки"""
+    now = [1000.0]
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpointer = create_sqlite_checkpointer(os.path.join(tmp, "checkpoints.sqlite"), thread_ttl=100,
+                                                  checkpoints_per_thread=2, clock=lambda: now[0])
+        agent = _build_agent(checkpointer)
+        for i in range(5):
+            _ask(agent, "active", f"вопрос {i}")
+        _ask(agent, "idle", "привет")
+        before = checkpointer.stats()["checkpoints"]
+
+        now[0] = 1050
+        _ask(agent, "active", "еще вопрос")
+        now[0] = 1120
+        result = checkpointer.compact()
+        stats = checkpointer.stats()
+        print(f"\n📊 Контрольных точек до уплотнения: {before}, после: {stats['checkpoints']}")
+
+        assert result["evicted_threads"] == 1
+        assert stats["threads"] == 1
+        assert stats["checkpoints"] == 2
+        assert checkpointer.get_tuple({"configurable": {"thread_id": "idle"}}) is None
+        messages = _ask(agent, "active", "после уплотнения")
+        assert messages[0].content.startswith("вопрос")
+        checkpointer.close()
+
+def test_unknown_checkpointer_falls_back_to_memory():
+    """Неизвестное имя хранилища заменяется хранилищем в памяти"""
+    checkpointer = create_checkpointer("redis")
+    assert checkpointer.stats()["threads"] == 0
+    assert not hasattr(checkpointer, "compact")
+
+if __name__ == "__main__":
+    print("🧪 Тестирование памяти агента...")
+    test_trim_history_limits_messages_and_tokens()
+    print("✅ История обрезается по лимитам")
+    test_thread_history_and_checkpoints_stay_bounded()
+    print("✅ Память потока ограничена")
+    test_threads_are_isolated_per_user()
+    print("✅ Потоки пользователей изолированы")
+    test_idle_and_excess_threads_evicted()
+    print("✅ Простаивающие потоки вытесняются")
+    test_sqlite_state_survives_restart()
+    print("✅ Состояние в SQLite переживает перезапуск")
+    test_sqlite_compaction_removes_old_checkpoints_and_idle_threads()
+    print("✅ Уплотнение базы работает")
+    test_unknown_checkpointer_falls_back_to_memory()
+    print("✅ Неизвестное хранилище заменяется памятью")
+    print("🎉 Все тесты памяти агента пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Тесты авторизации GigaChat: менеджер токена и общий пул соединений
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+
+from auth_gigachat import GigaChatTokenManager
+from bench_http_pool import LocalTokenServer, run_benchmark
+from http_pool import create_http_session
+
+def _fake_fetch(calls, lifetime=1800, delay=0.0):
+    def fetch():
+        calls.append(time.time())
+        time.sleep(delay)
+        return {"access_token": f"token-{len(calls)}", "expires_at": int((time.time() + lifetime) * 1000)}
+    return fetch
+
+def test_token_kept_in_memory_and_cached_atomically():
+    """Токен читается из памяти, а файл кэша записывается через временный файл"""
+    calls = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_file = os.path.join(tmp, "token.json")
+        manager = GigaChatTokenManager(cache_file=cache_file, fetch=_fake_fetch(calls))
+        assert manager.get_token() == "token-1"
+        assert manager.get_token() == "token-1"
+        assert len(calls) == 1
+        with open(cache_file) as f:
+            assert json.load(f)["access_token"] == "token-1"
+        assert os.listdir(tmp) == ["token.json"]
+
+        restored = GigaChatTokenManager(cache_file=cache_file, fetch=_fake_fetch(calls))
+        assert restored.get_token() == "token-1"
+        assert len(calls) == 1
+        manager.stop()
+        restored.stop()
+
+def test_concurrent_cache_writes_never_corrupt_file():
+    """Одновременные записи кэша (как из нескольких рабочих процессов) оставляют целый файл без мусора"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_file = os.path.join(tmp, "token.json")
+        writers = [GigaChatTokenManager(cache_file=cache_file, fetch=_fake_fetch([])) for _ in range(8)]
+        long_token = "x" * 50_000
+
+        def write(n):
+            for i in range(20):
+                writers[n]._write_cache({"access_token": f"{long_token}-{n}-{i}", "expires_at": 1})
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(cache_file) as f:
+            assert json.load(f)["access_token"].startswith(long_token)
+        assert os.listdir(tmp) == ["token.json"]
+
+def test_expired_cache_in_milliseconds_is_refreshed():
+    """expires_at в миллисекундах из API корректно считается истекшим"""
+    calls = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_file = os.path.join(tmp, "token.json")
+        with open(cache_file, "w") as f:
+            json.dump({"access_token": "old", "expires_at": int((time.time() - 60) * 1000)}, f)
+        manager = GigaChatTokenManager(cache_file=cache_file, fetch=_fake_fetch(calls))
+        assert manager.get_token() == "token-1"
+        manager.stop()
+
+def test_concurrent_refreshes_collapse_into_one_request():
+    """Одновременные запросы токена и принудительные обновления дают один запрос к OAuth"""
+    calls = []
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = GigaChatTokenManager(cache_file=os.path.join(tmp, "token.json"), fetch=_fake_fetch(calls, delay=0.1))
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.get_token())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1 and set(tokens) == {"token-1"}
+
+        stale = manager.get_token()
+        threads = [threading.Thread(target=lambda: manager.refresh(stale_token=stale)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 2 and manager.get_token() == "token-2"
+        manager.stop()
+
+def test_token_refreshed_in_background_before_expiry():
+    """Токен обновляется в фоне до истечения и передается подписчикам"""
+    calls = []
+    received = []
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = GigaChatTokenManager(cache_file=os.path.join(tmp, "token.json"), refresh_margin=1799,
+                                       fetch=_fake_fetch(calls, lifetime=1800))
+        manager.add_listener(lambda token, expires_at: received.append(token))
+        manager.get_token()
+        deadline = time.time() + 3
+        while len(calls) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        manager.stop()
+        assert len(calls) >= 2
+        assert received[:2] == ["token-1", "token-2"]
+
+def test_pooled_session_reuses_connection():
+    """Запросы через общий пул идут по одному keep-alive соединению"""
+    with LocalTokenServer(use_tls=False) as server:
+        session = create_http_session()
+        for _ in range(10):
+            assert session.post(server.url, data={"scope": "x"}, timeout=5).json()["access_token"] == "local-token"
+        session.close()
+        assert server.connections == 1
+
+def test_pooled_session_saves_handshake_latency():
+    """Бенчмарк: общий пул быстрее отдельного соединения на каждый запрос"""
+    result = run_benchmark(20)
+    print(f"\n📊 requests.post {result['bare_ms']:.2f} мс, пул {result['pooled_ms']:.2f} мс на запрос")
+    assert result["pooled_connections"] == 1
+    assert result["bare_connections"] == 20
+    assert result["pooled_ms"] < result["bare_ms"]
+
+if __name__ == "__main__":
+    test_token_kept_in_memory_and_cached_atomically()
+    test_concurrent_cache_writes_never_corrupt_file()
+    test_expired_cache_in_milliseconds_is_refreshed()
+    test_concurrent_refreshes_collapse_into_one_request()
+    test_token_refreshed_in_background_before_expiry()
+    test_pooled_session_reuses_connection()
+    test_pooled_session_saves_handshake_latency()
+    print("🎉 Тесты авторизации пройдены")
+    sys.exit(0)
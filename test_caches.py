@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Тесты кэшей: ответы на похожие вопросы и результаты веб-поиска
+"""
+
+import sys
+import time
+import threading
+
+from answer_cache import AnswerCache
+from search_cache import SearchCache
+
+def test_near_duplicate_questions_share_answer():
+    """Вопрос в другой формулировке получает сохраненный ответ"""
+    cache = AnswerCache(threshold=0.8)
+    cache.set("Что такое JK Coin?", "JK Coin — токен сообщества.")
+    cache.set("Как работает TON?", "TON — блокчейн.")
+
+    answer, similarity = cache.get("расскажи, что такое jk coin")
+    assert answer == "JK Coin — токен сообщества." and similarity >= 0.8
+    assert cache.get("Как работает TON")[0] == "TON — блокчейн."
+    assert cache.get("Что такое TON?") is None
+    assert cache.get("Где купить JK Coin?") is None
+
+def test_negated_question_does_not_share_answer():
+    """Вопрос с отрицанием не получает ответ на вопрос без него, и наоборот"""
+    cache = AnswerCache(threshold=0.8)
+    cache.set("Как работает TON?", "TON — блокчейн.")
+
+    assert cache.get("Почему не работает TON?") is None
+    assert cache.get("Как не работает TON?") is None
+    cache.set("Почему не работает TON?", "Проверьте сеть.")
+    assert cache.get("почему TON не работает")[0] == "Проверьте сеть."
+    assert cache.get("Как работает TON")[0] == "TON — блокчейн."
+
+def test_answer_cache_is_fast():
+    """Поиск похожего вопроса занимает миллисекунды даже на полном кэше"""
+    cache = AnswerCache(threshold=0.8, maxsize=1000)
+    for i in range(1000):
+        cache.set(f"Вопрос номер {i} про токен{i} и блокчейн{i}", f"ответ {i}")
+
+    started = time.perf_counter()
+    for _ in range(100):
+        cache.get("Вопрос номер 500 про токен500 и блокчейн500")
+    elapsed_ms = (time.perf_counter() - started) * 1000 / 100
+    print(f"\n📊 Поиск в кэше ответов: {elapsed_ms:.2f} мс")
+    assert elapsed_ms < 20
+
+def test_answer_cache_expiry_and_size_bound():
+    """Записи истекают по TTL, а размер кэша ограничен"""
+    now = [0.0]
+    cache = AnswerCache(threshold=0.8, maxsize=2, ttl=60, clock=lambda: now[0])
+    cache.set("Что такое JK Coin?", "1")
+    cache.set("Как работает TON?", "2")
+    cache.set("Когда листинг JK?", "3")
+    assert len(cache) == 2
+    assert cache.get("Что такое JK Coin?") is None
+    now[0] = 61
+    assert cache.get("Как работает TON?") is None
+    assert len(cache) == 1
+
+def test_search_cache_hits_normalized_query():
+    """Повторный запрос в другой записи берется из кэша без вызова API"""
+    calls = []
+
+    def fetch(query):
+        calls.append(query)
+        return [{"content": f"результат для {query}"}]
+
+    cache = SearchCache(fetch, maxsize=10, ttl=60)
+    first = cache.search("Курс TON сегодня")
+    second = cache.search("  курс   ton сегодня? ")
+    assert first == second and len(calls) == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["upstream_calls"] == 1
+
+def test_search_cache_single_flight():
+    """Одновременные одинаковые запросы разделяют один вызов API"""
+    calls = []
+
+    def slow_fetch(query):
+        calls.append(query)
+        time.sleep(0.2)
+        return [{"content": "новости"}]
+
+    cache = SearchCache(slow_fetch, maxsize=10, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.search("новости биткоин"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1 and len(results) == 8
+    stats = cache.stats()
+    assert stats["upstream_calls"] == 1 and stats["upstream_avg_latency"] >= 0.2
+
+def test_search_cache_does_not_store_errors():
+    """Ошибка API передается всем ожидающим и не кэшируется"""
+    calls = []
+
+    def failing_fetch(query):
+        calls.append(query)
+        raise RuntimeError("Tavily недоступен")
+
+    cache = SearchCache(failing_fetch, maxsize=10, ttl=60)
+    for _ in range(2):
+        try:
+            cache.search("запрос")
+            assert False, "ожидалось исключение"
+        except RuntimeError:
+            pass
+    assert len(calls) == 2 and cache.stats()["upstream_errors"] == 2
+
+if __name__ == "__main__":
+    test_near_duplicate_questions_share_answer()
+    test_negated_question_does_not_share_answer()
+    test_answer_cache_is_fast()
+    test_answer_cache_expiry_and_size_bound()
+    test_search_cache_hits_normalized_query()
+    test_search_cache_single_flight()
+    test_search_cache_does_not_store_errors()
+    print("🎉 Тесты кэшей пройдены")
+    sys.exit(0)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Тесты хеджирования генерации: резервный способ срезает хвост задержек, проигравший останавливается
+"""
+
+import sys
+import time
+import asyncio
+import threading
+
+from langchain_core.messages import AIMessage
+
+import agent_core
+import llm_executor
+from hedging import Hedger
+from llm_executor import LLMScheduler, LLMRateLimited
+
+POST = "**Горы зовут!** Проверьте прогноз, возьмите воду и куртку. Jekardos Coin примут и в лагере."
+
+def _percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+def _is_post(text) -> bool:
+    return bool(text) and not text.startswith("Извините")
+
+async def _primary(i: int, cancel_event) -> str:
+    """Основной способ с тяжелым хвостом: каждый десятый запрос в 25 раз медленнее"""
+    await asyncio.sleep(0.5 if i % 10 == 9 else 0.02)
+    return POST
+
+async def _backup(cancel_event) -> str:
+    await asyncio.sleep(0.05)
+    return POST
+
+def test_hedging_cuts_tail_latency():
+    """С резервным способом p95/p99 близки к задержке хеджа, а не к медленному хвосту"""
+    async def measure(hedged: bool) -> list:
+        hedger = Hedger(0.06, _is_post)
+        latencies = []
+        for i in range(40):
+            started = time.perf_counter()
+            if hedged:
+                await hedger.run(lambda cancel_event: _primary(i, cancel_event), _backup)
+            else:
+                result = await _primary(i, None)
+                if not _is_post(result):
+                    await _backup(None)
+            latencies.append(time.perf_counter() - started)
+        return latencies, hedger.stats()
+
+    sequential, _ = asyncio.run(measure(False))
+    hedged, stats = asyncio.run(measure(True))
+    print(f"\n📊 p95/p99 без хеджа: {_percentile(sequential, 0.95) * 1000:.0f}/{_percentile(sequential, 0.99) * 1000:.0f} мс, "
+          f"с хеджем: {_percentile(hedged, 0.95) * 1000:.0f}/{_percentile(hedged, 0.99) * 1000:.0f} мс")
+    assert _percentile(sequential, 0.99) >= 0.5
+    assert _percentile(hedged, 0.99) < 0.3
+    # Резервный способ запускается только для медленных запросов
+    assert stats["backups_started"] == 4
+    assert stats["wins"] == {"primary": 36, "backup": 4}
+
+def test_backup_used_when_primary_fails_fast():
+    """Негодный ответ основного способа запускает резервный сразу, не дожидаясь задержки"""
+    async def bad_primary(cancel_event):
+        return "Извините, агент не смог сгенерировать пост."
+
+    hedger = Hedger(10, _is_post)
+    started = time.perf_counter()
+    assert asyncio.run(hedger.run(bad_primary, _backup)) == POST
+    assert time.perf_counter() - started < 1
+
+    async def bad_backup(cancel_event):
+        raise ConnectionError("GigaChat недоступен")
+
+    # Ни один способ не дал поста: возвращается ответ основного, исключение резервного не всплывает
+    assert asyncio.run(hedger.run(bad_primary, bad_backup)).startswith("Извините")
+    assert hedger.stats()["failures"] == 1
+
+def test_loser_agent_stops_after_direct_wins():
+    """Когда прямая генерация победила, агент получает отмену и прекращает шаги"""
+    agent_steps = []
+    agent_stopped = threading.Event()
+
+    class SlowAgent:
+        def stream(self, payload, config=None, **kwargs):
+            try:
+                for i in range(20):
+                    time.sleep(0.05)
+                    agent_steps.append(i)
+                    yield "updates", {"agent": {"messages": [AIMessage(content="", tool_calls=[
+                        {"name": "web_search", "args": {"query": "q"}, "id": f"call{i}"}])]}}
+            finally:
+                agent_stopped.set()
+
+    def direct(topic, cancel_event=None):
+        time.sleep(0.1)
+        return POST
+
+    saved = (agent_core.POST_HEDGE, agent_core.post_hedger, agent_core._agent_executor,
+             agent_core.generate_post_directly)
+    agent_core.POST_HEDGE = True
+    agent_core.post_hedger = Hedger(0, agent_core.is_valid_post, names=("agent", "direct"))
+    agent_core._agent_executor = SlowAgent()
+    agent_core.generate_post_directly = direct
+    try:
+        post = asyncio.run(agent_core.create_telegram_post_async("поход", "user_1", "agent"))
+        assert agent_stopped.wait(2)
+        stats = agent_core.get_hedge_stats()
+    finally:
+        (agent_core.POST_HEDGE, agent_core.post_hedger, agent_core._agent_executor,
+         agent_core.generate_post_directly) = saved
+
+    assert post == POST
+    assert stats["wins"] == {"agent": 0, "direct": 1}
+    assert len(agent_steps) < 10
+
+def test_user_limit_charged_once_per_post():
+    """Хеджированный пост списывается из лимита пользователя один раз, а при исчерпанном лимите резерв не запускается"""
+    direct_calls = []
+
+    def slow_agent(topic, thread_id="default_thread", cancel_event=None):
+        cancel_event.wait(2)
+        return "Извините, генерация отменена."
+
+    def direct(topic, cancel_event=None):
+        direct_calls.append(topic)
+        return POST
+
+    saved = (agent_core.POST_HEDGE, agent_core.post_hedger, agent_core.run_agent_for_post,
+             agent_core.generate_post_directly, agent_core.generate_post_fast, llm_executor._scheduler)
+    agent_core.POST_HEDGE = True
+    agent_core.post_hedger = Hedger(0, agent_core.is_valid_post, names=("agent", "direct"), fatal=(LLMRateLimited,))
+    agent_core.run_agent_for_post = slow_agent
+    agent_core.generate_post_directly = direct
+    agent_core.generate_post_fast = lambda topic, search=None, avoid="": POST
+    llm_executor._scheduler = scheduler = LLMScheduler(max_concurrency=4, reserved_interactive=0,
+                                                       user_rate=0.001, user_burst=2)
+
+    async def scenario():
+        first = await agent_core.create_telegram_post_async("поход", "t", "agent", "user_1")
+        # Повтор черновика-дубликата не списывается из лимита
+        await agent_core.regenerate_post_async("поход", "старый пост", "user_1")
+        second = await agent_core.create_telegram_post_async("поход", "t", "agent", "user_1")
+        try:
+            await agent_core.create_telegram_post_async("поход", "t", "agent", "user_1")
+            assert False, "Ожидался LLMRateLimited"
+        except LLMRateLimited:
+            pass
+        return first, second
+
+    try:
+        first, second = asyncio.run(scenario())
+    finally:
+        (agent_core.POST_HEDGE, agent_core.post_hedger, agent_core.run_agent_for_post,
+         agent_core.generate_post_directly, agent_core.generate_post_fast, llm_executor._scheduler) = saved
+
+    assert first == second == POST
+    assert len(direct_calls) == 2
+    assert scheduler.stats()["rate_limited"] == 1
+
+if __name__ == "__main__":
+    print("🧪 Тестирование хеджирования генерации...")
+    test_hedging_cuts_tail_latency()
+    print("✅ Хвост задержек срезан")
+    test_backup_used_when_primary_fails_fast()
+    print("✅ Резервный способ при неудаче основного")
+    test_loser_agent_stops_after_direct_wins()
+    print("✅ Проигравший агент остановлен")
+    test_user_limit_charged_once_per_post()
+    print("✅ Лимит пользователя списывается один раз за пост")
+    print("🎉 Все тесты хеджирования пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Нагрузочные тесты: параллельная обработка запросов без блокировки цикла событий
+"""
+
+import sys
+import time
+import asyncio
+
+import llm_executor
+from llm_executor import run_blocking
+
+FAKE_LLM_LATENCY = 0.2
+PARALLEL_USERS = 8
+
+def fake_llm_call(text: str) -> dict:
+    """Имитирует синхронный вызов GigaChat с фиксированной задержкой"""
+    time.sleep(FAKE_LLM_LATENCY)
+    return {"is_toxic": False, "toxicity_score": 1, "reason": text}
+
+async def blocking_handler(text: str) -> dict:
+    """Обработчик в старом стиле: синхронный вызов прямо из async-кода"""
+    return fake_llm_call(text)
+
+async def offloaded_handler(text: str) -> dict:
+    """Обработчик в новом стиле: вызов выполняется в пуле потоков LLM"""
+    return await run_blocking(fake_llm_call, text)
+
+async def _measure(handler) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(f"сообщение {i}") for i in range(PARALLEL_USERS)))
+    return time.perf_counter() - started
+
+def test_parallel_users_get_single_llm_latency():
+    """N пользователей параллельно получают ответ примерно за одну задержку LLM"""
+    blocking_time = asyncio.run(_measure(blocking_handler))
+    offloaded_time = asyncio.run(_measure(offloaded_handler))
+
+    print(f"\n📊 {PARALLEL_USERS} пользователей: блокирующий путь {blocking_time:.2f} с, "
+          f"пул потоков {offloaded_time:.2f} с (ускорение x{blocking_time / offloaded_time:.1f})")
+
+    assert blocking_time >= PARALLEL_USERS * FAKE_LLM_LATENCY * 0.9
+    assert offloaded_time < FAKE_LLM_LATENCY * 2
+    assert blocking_time / offloaded_time > PARALLEL_USERS / 2
+
+def test_event_loop_stays_responsive():
+    """Пока идет вызов LLM, цикл событий продолжает обрабатывать другие задачи"""
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        await offloaded_handler("медленный запрос")
+        ticker_task.cancel()
+        return ticks
+
+    ticks = asyncio.run(scenario())
+    assert ticks >= 10
+
+def test_concurrency_is_bounded():
+    """Число одновременных вызовов не превышает LLM_MAX_CONCURRENCY"""
+    llm_executor.shutdown_llm_executor()
+    original_limit = llm_executor.LLM_MAX_CONCURRENCY
+    llm_executor.LLM_MAX_CONCURRENCY = 2
+    try:
+        blocking_time = asyncio.run(_measure(offloaded_handler))
+    finally:
+        llm_executor.shutdown_llm_executor()
+        llm_executor.LLM_MAX_CONCURRENCY = original_limit
+
+    assert blocking_time >= (PARALLEL_USERS / 2) * FAKE_LLM_LATENCY * 0.9
+
+def test_offline_load_harness():
+    """Поток обновлений проходит через настоящие обработчики бота на имитациях без сети и ошибок"""
+    from bench_load import run_load
+
+    report = run_load(updates=60, concurrency=16, llm_latency=0.01, search_latency=0.005,
+                      telegram_latency=0.002, firestore_latency=0.001, streaming=False)
+    print(f"\n📊 {report['messages_per_sec']:.0f} сообщ./с, p50/p95/p99 {report['p50_ms']:.0f}/"
+          f"{report['p95_ms']:.0f}/{report['p99_ms']:.0f} мс, пик памяти {report['peak_memory_mb']:.1f} МБ")
+    assert report["updates"] == 60
+    assert report["errors"] == 0
+    # Каждое обновление получило хотя бы один ответ, а /generate — еще и готовый пост
+    assert report["telegram_calls"]["sendMessage"] >= 60 + report["by_kind"].get("generate", {}).get("count", 0)
+    assert report["p50_ms"] <= report["p95_ms"] <= report["p99_ms"]
+    assert report["firestore_writes"] > 0
+    assert report["peak_memory_mb"] > 0
+
+if __name__ == "__main__":
+    test_parallel_users_get_single_llm_latency()
+    test_event_loop_stays_responsive()
+    test_concurrency_is_bounded()
+    test_offline_load_harness()
+    print("🎉 Нагрузочные тесты пройдены")
+    sys.exit(0)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Тесты метрик: гистограммы задержек по этапам, разметка по обработчикам и эндпоинт /metrics
+"""
+
+import sys
+import socket
+import asyncio
+import warnings
+import urllib.error
+import urllib.request
+
+import agent_core
+from bench_generate import FakeGigaChat, FakeTavily
+from metrics import MetricsRegistry, registry, trace_handler, llm_callbacks, start_metrics_server, stop_metrics_server
+from search_cache import SearchCache
+
+def test_histogram_rendered_in_prometheus_format():
+    """Корзины накопительные, есть +Inf, сумма, число наблюдений и счетчик ошибок"""
+    metrics = MetricsRegistry(buckets=(0.1, 1))
+    metrics.observe("llm", "GigaChat", 0.05, handler="ask")
+    metrics.observe("llm", "GigaChat", 0.5, handler="ask")
+    metrics.observe("llm", "GigaChat", 3, error=True, handler="ask")
+    metrics.observe("tool", 'web "search"', 0.01)
+
+    text = metrics.render()
+    labels = 'stage="llm",name="GigaChat",handler="ask"'
+    assert "# TYPE jk_stage_duration_seconds histogram" in text
+    assert f'jk_stage_duration_seconds_bucket{{{labels},le="0.1"}} 1' in text
+    assert f'jk_stage_duration_seconds_bucket{{{labels},le="1"}} 2' in text
+    assert f'jk_stage_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f"jk_stage_duration_seconds_sum{{{labels}}} 3.550000" in text
+    assert f"jk_stage_duration_seconds_count{{{labels}}} 3" in text
+    assert f"jk_stage_errors_total{{{labels}}} 1" in text
+    # Кавычки в значениях меток экранируются, этап вне обработчика помечается как none
+    assert 'name="web \\"search\\"",handler="none"' in text
+
+def test_generate_traced_per_stage():
+    """Генерация поста агентом дает замеры обработчика, шагов агента, вызовов LLM, инструментов и поиска"""
+    llm = FakeGigaChat(latency=0.01, calls=[], callbacks=llm_callbacks())
+    tavily = FakeTavily(0.01)
+    saved = (agent_core.get_llm, agent_core.get_tavily_search_tool, agent_core.search_cache,
+             agent_core._agent_executor, agent_core._checkpointer)
+    agent_core.get_llm = lambda: llm
+    agent_core.get_tavily_search_tool = lambda: tavily
+    agent_core.search_cache = SearchCache(agent_core._tavily_search)
+    agent_core._agent_executor = None
+    agent_core._checkpointer = None
+
+    async def generate(topic):
+        return await agent_core.create_telegram_post_async(topic, "metrics_thread", "agent")
+
+    registry.reset()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            post = asyncio.run(trace_handler("generate", generate)("поход в горы"))
+    finally:
+        (agent_core.get_llm, agent_core.get_tavily_search_tool, agent_core.search_cache,
+         agent_core._agent_executor, agent_core._checkpointer) = saved
+
+    snapshot = registry.snapshot()
+    stages = {(stage, name) for stage, name, handler in snapshot if handler == "generate"}
+    print(f"\n📊 Этапы /generate: {sorted(stages)}")
+    assert post.endswith("*Нейро Jekardos*")
+    assert ("handler", "generate") in stages
+    assert {("agent_step", "agent"), ("agent_step", "tools")} <= stages
+    assert {("tool", "web_search"), ("tool", "generate_telegram_post"), ("tavily", "search")} <= stages
+    assert sum(data["count"] for (stage, _, _), data in snapshot.items() if stage == "llm") == 2
+
+def test_telegram_calls_traced():
+    """Каждый вызов Bot API замеряется по имени метода, ответ с ошибкой учитывается"""
+    from telegram.request import HTTPXRequest
+    from telegram_bot import TracedRequest
+
+    codes = iter([200, 429])
+
+    async def fake_do_request(self, url, method, *args, **kwargs):
+        return next(codes), b"{}"
+
+    original = HTTPXRequest.do_request
+    HTTPXRequest.do_request = fake_do_request
+    registry.reset()
+    try:
+        request = TracedRequest()
+        for _ in range(2):
+            asyncio.run(request.do_request("https://api.telegram.org/botTOKEN/sendMessage", "POST"))
+    finally:
+        HTTPXRequest.do_request = original
+
+    data = registry.snapshot()[("telegram", "sendMessage", "none")]
+    assert data["count"] == 2
+    assert data["errors"] == 1
+
+def test_metrics_endpoint_served():
+    """Эндпоинт /metrics отдает накопленные метрики, остальные пути — 404"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    registry.reset()
+    registry.observe("firestore", "batch_commit", 0.02, handler="writer")
+    assert start_metrics_server(port, "127.0.0.1") is not None
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode("utf-8")
+            assert response.headers["Content-Type"].startswith("text/plain")
+        assert 'jk_stage_duration_seconds_count{stage="firestore",name="batch_commit",handler="writer"} 1' in body
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5)
+            assert False, "Ожидался ответ 404"
+        except urllib.error.HTTPError as e:
+            assert e.code == 404
+    finally:
+        stop_metrics_server()
+
+def test_component_stats_exposed():
+    """Счетчики stats() компонентов выводятся датчиком jk_component_stat, сбой одного не ломает /metrics"""
+    metrics = MetricsRegistry()
+    metrics.register_gauges("cache", lambda: {"hits": 3, "hit_ratio": 0.75, "name": "lru", "shed": {"chat": 2}})
+    metrics.register_gauges("broken", lambda: 1 / 0)
+    text = metrics.render()
+    assert "# TYPE jk_component_stat gauge" in text
+    assert 'jk_component_stat{component="cache",stat="hits"} 3' in text
+    assert 'jk_component_stat{component="cache",stat="hit_ratio"} 0.75' in text
+    assert 'jk_component_stat{component="cache",stat="shed",key="chat"} 2' in text
+    assert 'stat="name"' not in text and 'component="broken"' not in text
+
+    # Бот регистрирует счетчики модерации, кэшей, памяти агента, планировщика и записи в Firestore
+    import telegram_bot
+    from bench_load import _install_fakes
+    _, _, _, writer, restore = _install_fakes(0.0, 0.0, 0.0, 0.0)
+    try:
+        writer.flush()
+        text = registry.render()
+    finally:
+        writer.close()
+        restore()
+    for component, stat in [("moderation", "skip_rate"), ("search_cache", "upstream_avg_latency"),
+                            ("answer_cache", "hit_ratio"), ("agent_memory", "bytes"), ("prompt_budget", "calls"),
+                            ("post_hedge", "backups_started"), ("llm_scheduler", "in_use"),
+                            ("firestore_writer", "flushes"), ("post_dedup", "avg_check_us")]:
+        assert f'jk_component_stat{{component="{component}",stat="{stat}"}}' in text, (component, stat)
+
+if __name__ == "__main__":
+    print("🧪 Тестирование метрик...")
+    test_histogram_rendered_in_prometheus_format()
+    print("✅ Формат Prometheus")
+    test_generate_traced_per_stage()
+    print("✅ Этапы /generate замерены")
+    test_telegram_calls_traced()
+    print("✅ Вызовы Bot API замерены")
+    test_metrics_endpoint_served()
+    print("✅ Эндпоинт /metrics работает")
+    test_component_stats_exposed()
+    print("✅ Счетчики компонентов на /metrics")
+    print("🎉 Все тесты метрик пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Тесты модерации: пакетная отправка сообщений в LLM
+"""
+
+import sys
+import asyncio
+
+from moderation import (
+    ModerationBatcher, ModerationPipeline, HeuristicPrefilter, parse_batch_verdicts, FALLBACK_VERDICT
+)
+from ttl_cache import TTLCache
+
+def _fake_analyze_batch(calls):
+    def analyze_batch(messages):
+        calls.append(list(messages))
+        return [{"is_toxic": "дурак" in text, "toxicity_score": 8 if "дурак" in text else 1, "reason": text}
+                for text in messages]
+    return analyze_batch
+
+def test_messages_within_window_share_one_llm_call():
+    """Сообщения, пришедшие в пределах окна, уходят в LLM одним пакетом"""
+    calls = []
+    batcher = ModerationBatcher(_fake_analyze_batch(calls), window_ms=50, max_batch_size=100)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit(text) for text in ["привет", "ты дурак", "как дела?"]))
+
+    verdicts = asyncio.run(scenario())
+    assert calls == [["привет", "ты дурак", "как дела?"]]
+    assert [v["reason"] for v in verdicts] == ["привет", "ты дурак", "как дела?"]
+    assert verdicts[1]["is_toxic"] and verdicts[1]["toxicity_score"] == 8
+    assert not verdicts[0]["is_toxic"]
+
+def test_max_batch_size_flushes_immediately():
+    """При достижении максимального размера пакет отправляется, не дожидаясь окна"""
+    calls = []
+    batcher = ModerationBatcher(_fake_analyze_batch(calls), window_ms=10_000, max_batch_size=2)
+
+    async def scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit(f"сообщение {i}") for i in range(4))), timeout=2
+        )
+
+    verdicts = asyncio.run(scenario())
+    assert len(calls) == 2 and all(len(batch) == 2 for batch in calls)
+    assert len(verdicts) == 4
+
+def test_batch_error_keeps_verdict_contract():
+    """Ошибка LLM возвращает каждому обработчику безопасный вердикт того же формата"""
+    def failing_batch(messages):
+        raise RuntimeError("GigaChat недоступен")
+
+    batcher = ModerationBatcher(failing_batch, window_ms=10)
+
+    async def scenario():
+        return await asyncio.gather(batcher.submit("а"), batcher.submit("б"))
+
+    for verdict in asyncio.run(scenario()):
+        assert verdict["is_toxic"] is False
+        assert verdict["toxicity_score"] == 1
+        assert "GigaChat недоступен" in verdict["reason"]
+
+def test_parse_batch_verdicts():
+    """Ответ LLM разбирается по id, пропуски заполняются безопасным вердиктом"""
+    content = """```json
+[{"id": 2, "is_toxic": true, "toxicity_score": "9", "reason": "Оскорбление."},
+ {"id": 1, "is_toxic": false, "toxicity_score": 1, "reason": "Приветствие."}]
+```"""
+    verdicts = parse_batch_verdicts(content, 3)
+    assert verdicts[0] == {"is_toxic": False, "toxicity_score": 1, "reason": "Приветствие."}
+    assert verdicts[1] == {"is_toxic": True, "toxicity_score": 9, "reason": "Оскорбление."}
+    assert verdicts[2] == FALLBACK_VERDICT
+    assert parse_batch_verdicts("не JSON", 2) == [FALLBACK_VERDICT, FALLBACK_VERDICT]
+
+def test_heuristic_prefilter():
+    """Приветствия, реакции, ссылки и эмодзи признаются безопасными без LLM"""
+    prefilter = HeuristicPrefilter()
+    for text in ["Привет всем!", "ахахах", "👍🔥", "https://t.me/JekardosCoinForever", "спасибо, понял", "Ок)"]:
+        verdict = prefilter.classify(text)
+        assert verdict is not None, text
+        assert verdict["is_toxic"] is False and verdict["toxicity_score"] == 1
+    for text in ["ты дурак", "Купите мой курс по ссылке", "Как работает TON блокчейн?"]:
+        assert prefilter.classify(text) is None, text
+
+def test_pipeline_skips_llm_for_safe_messages():
+    """Счетчики показывают долю сообщений, обработанных без обращения к LLM"""
+    calls = []
+    pipeline = ModerationPipeline(ModerationBatcher(_fake_analyze_batch(calls), window_ms=10), HeuristicPrefilter())
+
+    async def scenario():
+        return await asyncio.gather(*(pipeline.moderate(text) for text in ["привет", "😂😂", "ты дурак", "доброе утро"]))
+
+    verdicts = asyncio.run(scenario())
+    assert calls == [["ты дурак"]]
+    assert verdicts[2]["is_toxic"] is True
+    stats = pipeline.stats()
+    assert stats["total"] == 4 and stats["prefilter_hits"] == 3 and stats["llm_requests"] == 1
+    assert stats["skip_rate"] == 0.75
+
+def test_verdict_cache_for_repeated_messages():
+    """Повторы одного текста (с другим регистром, пробелами и эмодзи) не вызывают LLM повторно"""
+    calls = []
+    pipeline = ModerationPipeline(ModerationBatcher(_fake_analyze_batch(calls), window_ms=10))
+
+    async def scenario():
+        first = await pipeline.moderate("Купи крипту у меня 👍")
+        rest = await asyncio.gather(*(pipeline.moderate("  КУПИ   крипту у меня 👍🏽👍 ") for _ in range(5)))
+        return [first] + list(rest)
+
+    verdicts = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(v == verdicts[0] for v in verdicts)
+    assert pipeline.stats()["cache_hits"] == 5
+
+def test_error_verdicts_are_not_cached():
+    """Вердикты-заглушки после ошибок анализа не попадают в кэш"""
+    calls = []
+
+    def broken_batch(messages):
+        calls.append(messages)
+        return [dict(FALLBACK_VERDICT) for _ in messages]
+
+    pipeline = ModerationPipeline(ModerationBatcher(broken_batch, window_ms=10))
+
+    async def scenario():
+        await pipeline.moderate("непонятное сообщение")
+        await pipeline.moderate("непонятное сообщение")
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert len(pipeline.cache) == 0
+
+def test_ttl_cache_expiry_and_lru():
+    """Записи истекают по TTL, а при переполнении вытесняются самые старые"""
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+if __name__ == "__main__":
+    test_messages_within_window_share_one_llm_call()
+    test_max_batch_size_flushes_immediately()
+    test_batch_error_keeps_verdict_contract()
+    test_parse_batch_verdicts()
+    test_heuristic_prefilter()
+    test_pipeline_skips_llm_for_safe_messages()
+    test_verdict_cache_for_repeated_messages()
+    test_error_verdicts_are_not_cached()
+    test_ttl_cache_expiry_and_lru()
+    print("🎉 Тесты модерации пройдены")
+    sys.exit(0)
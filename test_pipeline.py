@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Тесты конвейеров /generate: быстрый конвейер против цикла агента на имитациях GigaChat и Tavily
+"""
+
+import sys
+
+import agent_core
+from bench_generate import run_benchmark, FakeGigaChat
+from telegram_bot import parse_pipeline
+
+SIGNATURE = "*Нейро Jekardos*"
+
+def test_fast_pipeline_uses_single_llm_call():
+    """Быстрый конвейер делает один поиск и один вызов LLM и быстрее агента"""
+    result = run_benchmark(posts=3, llm_latency=0.05, search_latency=0.02)
+    agent, fast = result["agent"], result["fast"]
+    print(f"\n📊 Агент: {agent['avg_ms']:.0f} мс, {agent['llm_calls']:.1f} вызова LLM; "
+          f"быстрый: {fast['avg_ms']:.0f} мс, {fast['llm_calls']:.1f} вызов LLM")
+    assert fast["llm_calls"] == 1
+    assert fast["search_calls"] == 1
+    assert agent["llm_calls"] >= 2
+    assert fast["avg_ms"] < agent["avg_ms"]
+    assert fast["sample_post"].endswith(SIGNATURE)
+    assert agent["sample_post"].endswith(SIGNATURE)
+
+def test_fast_pipeline_survives_search_failure():
+    """Если поиск недоступен, быстрый конвейер генерирует пост без него"""
+    llm = FakeGigaChat(latency=0, calls=[])
+
+    class BrokenSearch:
+        def search(self, query):
+            raise ConnectionError("Tavily недоступен")
+
+    saved = agent_core.get_llm, agent_core.search_cache
+    agent_core.get_llm, agent_core.search_cache = (lambda: llm), BrokenSearch()
+    try:
+        post = agent_core.create_telegram_post("поход", pipeline="fast")
+    finally:
+        agent_core.get_llm, agent_core.search_cache = saved
+    assert post.endswith(SIGNATURE)
+    assert len(llm.calls) == 1
+
+def test_pipeline_flag_parsed_per_request():
+    """Флаг --fast или --agent перед темой выбирает конвейер для одного запроса"""
+    assert parse_pipeline(["--fast", "поход", "в", "горы"]) == ("fast", ["поход", "в", "горы"])
+    assert parse_pipeline(["--agent", "поход"]) == ("agent", ["поход"])
+    assert parse_pipeline(["--slow", "поход"]) == (None, ["--slow", "поход"])
+    assert parse_pipeline([]) == (None, [])
+
+if __name__ == "__main__":
+    print("🧪 Тестирование конвейеров генерации...")
+    test_fast_pipeline_uses_single_llm_call()
+    print("✅ Быстрый конвейер: один вызов LLM")
+    test_fast_pipeline_survives_search_failure()
+    print("✅ Быстрый конвейер работает без поиска")
+    test_pipeline_flag_parsed_per_request()
+    print("✅ Конвейер выбирается для запроса")
+    print("🎉 Все тесты конвейеров пройдены успешно!")
+    sys.exit(0)
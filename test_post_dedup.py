@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Тесты поиска повторов: отпечатки опубликованных постов, скорость проверки и перегенерация похожего черновика
+"""
+
+import os
+import sys
+import json
+import random
+import asyncio
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import agent_core
+import telegram_bot
+from agent_core import generate_telegram_post
+from bench_generate import FakeGigaChat, DRAFT
+from bench_load import _install_fakes
+from post_dedup import PostFingerprintIndex, simhash
+
+FRESH_DRAFT = ("**Степь ночью** Разбейте лагерь до заката, ветер в степи к вечеру усиливается. "
+               "Юрту ставьте входом на юг, а воду храните в тени. Jekardos Coin принимают на ярмарках "
+               "кочевников, а спутниковый трекер сообщит близким, где вы остановились.")
+
+def _published_posts() -> list:
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "published_posts.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+class PromptRecordingLLM(FakeGigaChat):
+    """GigaChat, который повторяет DRAFT, пока в запросе нет отрицательного примера, и запоминает запросы"""
+
+    prompts: list = []
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = messages[-1].content if isinstance(messages[-1], HumanMessage) else ""
+        self.prompts.append(prompt)
+        content = FRESH_DRAFT if "уже опубликован в канале" in prompt else DRAFT
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+class FakeMessage:
+    """Сообщение Telegram: запоминает правки и ответы"""
+
+    def __init__(self, text=""):
+        self.text = text
+        self.edits = []
+        self.replies = []
+
+    async def edit_text(self, text, reply_markup=None):
+        self.edits.append((text, reply_markup))
+        self.text = text
+
+    async def reply_text(self, text=None, reply_markup=None, **kwargs):
+        message = FakeMessage(text)
+        self.replies.append((text, reply_markup, message))
+        return message
+
+def _generate_update(user_id: int = 5):
+    user = SimpleNamespace(id=user_id, username="anna", first_name="Анна", last_name=None)
+    return SimpleNamespace(effective_user=user, effective_chat=SimpleNamespace(id=user_id), message=FakeMessage())
+
+def test_title_and_text_duplicates_detected():
+    """Повтор находится по почти тому же заголовку и по слегка измененному тексту, новый пост — нет"""
+    first, second = _published_posts()
+    index = PostFingerprintIndex()
+    assert index.add(first)
+    assert not index.add(first)
+
+    # Два опубликованных поста с одним заголовком расходятся по тексту — их выдает заголовок
+    match = index.find_duplicate(second)
+    assert match is not None and match.reason == "title" and match.text == first
+
+    edited = first.replace("каждый день", "каждое утро").replace("проще", "легче")
+    match = index.find_duplicate(edited)
+    assert match is not None and match.reason == "text" and match.distance <= index.max_distance
+
+    fresh = generate_telegram_post("степь", FRESH_DRAFT)
+    assert index.find_duplicate(fresh) is None
+    assert index.find_duplicate(generate_telegram_post("горы", DRAFT)) is None
+    # Подпись, призыв и хештеги одинаковы у всех постов и не сближают разные тексты
+    assert bin(simhash(fresh) ^ simhash(first)).count("1") > 2 * index.max_distance
+    assert index.stats()["duplicates"] == 2
+
+def test_short_matching_title_beats_longer_partial_one():
+    """Короткий заголовок, совпавший целиком, находится, даже если у длинного общих слов больше"""
+    index = PostFingerprintIndex()
+    long_post = ("**Ночной сплав по горной реке: снаряжение, маршрут, погода, питание и страховка**\n"
+                 "Гидрокостюм, каска и спасжилет обязательны, а маршрут согласуйте с МЧС заранее.")
+    short_post = ("**Сплав по горной реке**\n"
+                  "Инструктор проверит байдарки, а Jekardos Coin пригодятся для оплаты трансфера.")
+    index.add(long_post)
+    index.add(short_post)
+
+    draft = generate_telegram_post("сплав", "**Ночной сплав по горной реке Карелии на байдарках**\n" + FRESH_DRAFT)
+    match = index.find_duplicate(draft)
+    assert match is not None and match.reason == "title" and match.text == short_post
+    assert match.title_overlap == 1.0
+
+def test_check_is_sub_millisecond():
+    """Проверка черновика по индексу из тысячи постов занимает меньше миллисекунды"""
+    rng = random.Random(3)
+    words = ("поход горы вода палатка кочевники монета технологии навигатор рюкзак костер маршрут погода "
+             "карта телефон лагерь степь юрта караван пустыня перевал озеро река лес").split()
+    index = PostFingerprintIndex()
+    for _ in range(1000):
+        index.add("**" + " ".join(rng.sample(words, 5)) + "**\n" + " ".join(rng.choices(words, k=70)))
+    draft = generate_telegram_post("горы", DRAFT)
+    for _ in range(200):
+        index.find_duplicate(draft)
+    stats = index.stats()
+    print(f"\n📊 Проверка по {stats['posts']} постам: в среднем {stats['avg_check_us']:.0f} мкс, "
+          f"максимум {stats['max_check_us']:.0f} мкс")
+    assert stats["posts"] == 1000
+    assert stats["avg_check_us"] < 1000
+
+def test_generate_regenerates_duplicate_draft():
+    """/generate не показывает черновик, повторивший опубликованный пост, а пишет новый с отрицательным примером"""
+    llm, _, _, _, restore = _install_fakes(0.0, 0.0, 0.0, 0.0, streaming=True)
+    recording = PromptRecordingLLM(latency=0.0, prompts=[])
+    agent_core.get_llm = lambda: recording
+    try:
+        published = generate_telegram_post("поход в горы", DRAFT)
+        telegram_bot.save_post_to_history(published, "1")
+
+        update = _generate_update()
+        context = SimpleNamespace(args=["--fast", "поход", "в", "горы"], user_data={})
+        asyncio.run(telegram_bot.generate_start(update, context))
+    finally:
+        restore()
+
+    placeholder = update.message.replies[0][2]
+    final_text, keyboard = placeholder.edits[-1]
+    assert "Степь ночью" in final_text and "Горы зовут" not in final_text
+    assert keyboard is not None
+    assert context.user_data["post_text"] == final_text
+    assert len(update.message.replies) == 1 and not placeholder.replies
+    assert len(recording.prompts) == 2
+    assert "уже опубликован в канале" in recording.prompts[1] and "Горы зовут" in recording.prompts[1]
+    # Призыв, хештеги и подпись в отрицательный пример не попадают
+    assert "#jekardos" not in recording.prompts[1]
+
+def test_duplicate_left_after_retries_is_flagged():
+    """Если новые черновики тоже повторяют опубликованный пост, черновик показывается с предупреждением"""
+    llm, _, _, _, restore = _install_fakes(0.0, 0.0, 0.0, 0.0, streaming=False)
+    try:
+        telegram_bot.save_post_to_history(generate_telegram_post("поход в горы", DRAFT), "1")
+        update = _generate_update()
+        context = SimpleNamespace(args=["--fast", "поход", "в", "горы"], user_data={})
+        asyncio.run(telegram_bot.generate_start(update, context))
+        calls = len(llm.calls)
+    finally:
+        restore()
+
+    texts = [text for text, _, _ in update.message.replies]
+    assert "Горы зовут" in texts[1] and texts[2] == telegram_bot.DUPLICATE_WARNING
+    assert calls == 1 + telegram_bot.POST_DUPLICATE_RETRIES
+
+def test_index_fed_from_firestore_and_history():
+    """В индекс попадают посты из коллекции published_posts и новые записи журнала, в том числе чужие"""
+    _, _, fake_db, _, restore = _install_fakes(0.0, 0.0, 0.0, 0.0)
+    try:
+        first, second = _published_posts()
+        fake_db.collection(f"artifacts/{telegram_bot.app_id}/public/data/published_posts").add(
+            {"text": first, "published_by_user_id": "1"})
+        assert asyncio.run(telegram_bot.find_duplicate_post(second)).text == first
+
+        # Запись другого процесса в тот же журнал подтягивается перед проверкой
+        from post_history import PostHistory
+        other = PostHistory(telegram_bot.post_history.directory, legacy_file=None)
+        fresh = generate_telegram_post("степь", FRESH_DRAFT)
+        other.append(fresh)
+        assert asyncio.run(telegram_bot.find_duplicate_post(fresh)).text == fresh
+        assert len(telegram_bot.post_index) == 2
+    finally:
+        restore()
+
+def test_firestore_posts_load_once_and_retry_after_error():
+    """Одновременные первые проверки ждут одну загрузку из Firestore, а после ошибки она повторяется"""
+    _, _, fake_db, _, restore = _install_fakes(0.0, 0.0, 0.0, 0.05)
+    try:
+        first, second = _published_posts()
+        fake_db.collection(f"artifacts/{telegram_bot.app_id}/public/data/published_posts").add({"text": first})
+        stream = fake_db._stream
+        fake_db._stream = lambda path: (_ for _ in ()).throw(OSError("firestore unavailable"))
+        assert asyncio.run(telegram_bot.find_duplicate_post(second)) is None
+        assert not telegram_bot._published_posts_loaded
+
+        fake_db._stream = stream
+        reads = fake_db.reads
+
+        async def first_checks():
+            return await asyncio.gather(*(telegram_bot.find_duplicate_post(second) for _ in range(4)))
+
+        matches = asyncio.run(first_checks())
+        assert all(match is not None and match.text == first for match in matches)
+        assert fake_db.reads == reads + 1 and telegram_bot._published_posts_loaded
+    finally:
+        restore()
+
+if __name__ == "__main__":
+    print("🧪 Тестирование поиска повторов...")
+    test_title_and_text_duplicates_detected()
+    print("✅ Повторы по заголовку и тексту")
+    test_short_matching_title_beats_longer_partial_one()
+    print("✅ Короткий совпавший заголовок не теряется")
+    test_check_is_sub_millisecond()
+    print("✅ Проверка быстрее миллисекунды")
+    test_generate_regenerates_duplicate_draft()
+    print("✅ Повторивший пост черновик перегенерирован")
+    test_duplicate_left_after_retries_is_flagged()
+    print("✅ Оставшийся повтор помечен предупреждением")
+    test_index_fed_from_firestore_and_history()
+    print("✅ Индекс наполняется из Firestore и журнала")
+    test_firestore_posts_load_once_and_retry_after_error()
+    print("✅ Посты Firestore загружаются один раз и повторно после ошибки")
+    print("🎉 Все тесты поиска повторов пройдены успешно!")
+    sys.exit(0)
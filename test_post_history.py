@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Тесты журнала постов: дозапись, ротация сегментов, окно хранения и одновременные публикации
+"""
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import threading
+import multiprocessing
+from types import SimpleNamespace
+
+from post_history import PostHistory
+
+def _publish_many(directory: str, prefix: str, count: int) -> None:
+    """Публикатор из отдельного процесса: свой экземпляр журнала в том же каталоге"""
+    history = PostHistory(directory, segment_entries=7, legacy_file=None)
+    for i in range(count):
+        history.append(f"{prefix}-{i}")
+
+def test_append_rotate_and_recent():
+    """Посты дописываются по порядку, сегменты сменяются, последние N отдаются из памяти"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history = PostHistory(tmp, segment_entries=3, tail_size=5, legacy_file=None)
+        for i in range(8):
+            history.append(f"пост {i}", published_by_user_id="42")
+
+        assert sorted(os.listdir(tmp)) == [".lock", "posts-000001.jsonl", "posts-000002.jsonl", "posts-000003.jsonl"]
+        assert [entry["text"] for entry in history.recent(3)] == ["пост 5", "пост 6", "пост 7"]
+        assert len(history.recent(50)) == 5
+        assert history.recent(1)[0]["published_by_user_id"] == "42"
+        assert [entry["text"] for entry in history.entries()] == [f"пост {i}" for i in range(8)]
+        stats = history.stats()
+        assert stats["entries"] == 8 and stats["rotations"] == 2
+
+        # Новый экземпляр (перезапуск бота) видит тот же журнал и продолжает текущий сегмент
+        reopened = PostHistory(tmp, segment_entries=3, tail_size=5, legacy_file=None)
+        assert [entry["text"] for entry in reopened.recent(2)] == ["пост 6", "пост 7"]
+        reopened.append("пост 8")
+        assert len(os.listdir(tmp)) == 4
+        # Запись другого экземпляра подтягивается в индекс первого
+        assert history.recent(1)[0]["text"] == "пост 8"
+
+def test_retention_drops_old_segments():
+    """Сегменты, все посты которых старше окна хранения, удаляются при ротации"""
+    now = [1_000_000.0]
+    with tempfile.TemporaryDirectory() as tmp:
+        history = PostHistory(tmp, segment_entries=2, retention_days=1, legacy_file=None, clock=lambda: now[0])
+        for i in range(4):
+            history.append(f"старый {i}")
+        now[0] += 2 * 86400
+        for i in range(3):
+            history.append(f"новый {i}")
+
+        texts = [entry["text"] for entry in history.entries()]
+        assert texts == ["новый 0", "новый 1", "новый 2"]
+        assert [entry["text"] for entry in history.recent(10)] == texts
+        assert history.stats()["removed_segments"] == 2
+
+def test_concurrent_publishers_lose_nothing():
+    """Потоки и процессы публикуют одновременно: ни одна запись не потеряна и не повреждена"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history = PostHistory(tmp, segment_entries=7, legacy_file=None)
+        threads = [threading.Thread(target=lambda n=n: [history.append(f"t{n}-{i}") for i in range(25)])
+                   for n in range(8)]
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=_publish_many, args=(tmp, f"p{n}", 25)) for n in range(2)]
+        for worker in processes + threads:
+            worker.start()
+        for worker in processes + threads:
+            worker.join()
+        assert all(process.exitcode == 0 for process in processes)
+
+        lines = []
+        for name in sorted(os.listdir(tmp)):
+            if name.endswith(".jsonl"):
+                with open(os.path.join(tmp, name), encoding="utf-8") as f:
+                    lines += [json.loads(line) for line in f]
+        texts = [entry["text"] for entry in lines]
+        assert len(texts) == 250
+        assert set(texts) == {f"t{n}-{i}" for n in range(8) for i in range(25)} | \
+                             {f"p{n}-{i}" for n in range(2) for i in range(25)}
+        assert history.stats()["entries"] == 250
+        for name in os.listdir(tmp):
+            if name.endswith(".jsonl"):
+                with open(os.path.join(tmp, name), encoding="utf-8") as f:
+                    assert len(f.readlines()) <= 7
+
+def test_legacy_history_imported_and_publish_appends():
+    """Старый published_posts.json переносится в журнал, а публикация дописывает пост"""
+    import telegram_bot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "published_posts.json")
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump(["первый", "второй"], f, ensure_ascii=False)
+        history = PostHistory(os.path.join(tmp, "history"), legacy_file=legacy)
+        assert [entry["text"] for entry in history.recent(10)] == ["первый", "второй"]
+
+        sent = []
+        user = SimpleNamespace(id=7, username="anna")
+
+        async def send_message(chat_id, text):
+            sent.append(text)
+
+        async def edit_message_text(text, reply_markup=None):
+            pass
+
+        update = SimpleNamespace(effective_user=user, callback_query=SimpleNamespace(
+            data="publish", answer=lambda: asyncio.sleep(0), edit_message_text=edit_message_text))
+        context = SimpleNamespace(user_data={"post_text": "третий"}, bot=SimpleNamespace(send_message=send_message))
+        saved = telegram_bot.post_history, telegram_bot.TELEGRAM_CHANNEL_ID, telegram_bot.db
+        telegram_bot.post_history, telegram_bot.TELEGRAM_CHANNEL_ID, telegram_bot.db = history, "@channel", None
+        try:
+            asyncio.run(telegram_bot.confirm_publish(update, context))
+        finally:
+            telegram_bot.post_history, telegram_bot.TELEGRAM_CHANNEL_ID, telegram_bot.db = saved
+
+        assert sent == ["третий"]
+        assert [entry["text"] for entry in history.recent(10)] == ["первый", "второй", "третий"]
+        assert history.recent(1)[0]["published_by_user_id"] == "7"
+        # Повторная загрузка не переносит старый файл второй раз
+        reopened = PostHistory(os.path.join(tmp, "history"), legacy_file=legacy)
+        assert len(list(reopened.entries())) == 3
+
+if __name__ == "__main__":
+    print("🧪 Тестирование журнала постов...")
+    test_append_rotate_and_recent()
+    print("✅ Дозапись, ротация и последние посты")
+    test_retention_drops_old_segments()
+    print("✅ Окно хранения")
+    test_concurrent_publishers_lose_nothing()
+    print("✅ Одновременные публикации без потерь")
+    test_legacy_history_imported_and_publish_appends()
+    print("✅ Перенос старой истории и публикация")
+    print("🎉 Все тесты журнала постов пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Тесты бюджета промпта: дедупликация фрагментов поиска, обрезка истории и ответов инструментов
+"""
+
+import sys
+import itertools
+import warnings
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+import agent_core
+from prompt_budget import (
+    PromptBudgeter, dedupe_snippets, fit_snippets, estimate_tokens, count_message_tokens
+)
+from search_cache import SearchCache
+from test_agent_memory import FakeChatModel
+
+BASE_SNIPPET = ("Перед походом в горы проверьте прогноз погоды. Возьмите непромокаемую куртку и запас воды. "
+                "Сообщите маршрут близким и не отклоняйтесь от него. ")
+
+def _tavily_response():
+    """Ответ TavilySearch: словарь с длинными и частично повторяющимися фрагментами"""
+    return {
+        "query": "поход в горы",
+        "results": [
+            {"title": "1", "url": "https://a", "content": BASE_SNIPPET * 3},
+            {"title": "2", "url": "https://b", "content": BASE_SNIPPET + "Аптечка обязательна."},
+            {"title": "3", "url": "https://c", "content": "Jekardos Coin принимают в кочевых лагерях. " * 40},
+            {"title": "4", "url": "https://d", "content": "Палатку ставьте до заката, пока светло. " * 30},
+        ],
+    }
+
+def test_snippets_deduplicated_and_fitted():
+    """Повторяющиеся предложения и фрагменты убираются, результат укладывается в бюджет"""
+    snippets = [res["content"] for res in _tavily_response()["results"]]
+    deduped = dedupe_snippets(snippets)
+    assert deduped[0] == BASE_SNIPPET.strip()
+    assert deduped[1] == "Аптечка обязательна."
+    assert len(deduped) == 4
+
+    assert fit_snippets(deduped, 60) == deduped[:2]
+    truncated = fit_snippets(deduped, 40)
+    assert len(truncated) == 1
+    assert estimate_tokens(truncated[0]) < 40
+    assert truncated[0].endswith("воды.")
+
+def test_web_search_context_within_budget():
+    """web_search работает с ответом-словарем Tavily и отдает контекст в пределах бюджета"""
+    budgeter = PromptBudgeter(search_tokens=120)
+    original_cache, original_budgeter = agent_core.search_cache, agent_core.budgeter
+    agent_core.search_cache = SearchCache(lambda query: _tavily_response())
+    agent_core.budgeter = budgeter
+    try:
+        context = agent_core.web_search("поход в горы")
+    finally:
+        agent_core.search_cache, agent_core.budgeter = original_cache, original_budgeter
+
+    stats = budgeter.stats()
+    print(f"\n📊 Контекст поиска: {stats['avg_tokens_before']:.0f} -> {stats['avg_tokens_after']:.0f} токенов")
+    assert "прогноз погоды" in context
+    assert context.count("прогноз погоды") == 1
+    assert estimate_tokens(context) <= 120
+    assert stats["trimmed_calls"] == 1
+
+def test_fit_messages_respects_budget():
+    """История и ответы инструментов вместе с системным промптом укладываются в бюджет"""
+    budgeter = PromptBudgeter(budget=400, tool_output_tokens=100)
+    system_prompt = "Ты — Нейро Jekardos. " * 10
+    history = []
+    for i in range(8):
+        history += [
+            HumanMessage(content=f"вопрос {i} " + "подробности " * 20),
+            AIMessage(content="", tool_calls=[{"name": "web_search", "args": {"query": f"q{i}"}, "id": f"call{i}"}]),
+            ToolMessage(content="результат поиска " * 200, tool_call_id=f"call{i}"),
+            AIMessage(content=f"ответ {i}"),
+        ]
+    history.append(HumanMessage(content="последний вопрос"))
+
+    fitted = budgeter.fit_messages(history, system_prompt)
+    assert count_message_tokens(fitted) + estimate_tokens(system_prompt) <= 400
+    assert isinstance(fitted[0], HumanMessage)
+    assert fitted[-1].content == "последний вопрос"
+    assert all(estimate_tokens(m.content) <= 100 for m in fitted if isinstance(m, ToolMessage))
+    stats = budgeter.stats()
+    assert stats["max_tokens_before"] > 3000
+    assert stats["saved_ratio"] > 0.8
+
+def test_agent_calls_stay_within_budget():
+    """Каждый вызов модели агентом укладывается в бюджет, даже когда история длинная"""
+    from langgraph.prebuilt import create_react_agent
+    from agent_memory import create_bounded_checkpointer, make_history_hook
+
+    prompt_sizes = []
+
+    class RecordingModel(FakeChatModel):
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            prompt_sizes.append(count_message_tokens(messages))
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    system_prompt = "Ты — Нейро Jekardos, помощник сообщества. " * 5
+    budgeter = PromptBudgeter(budget=300)
+    replies = (AIMessage(content="длинный ответ " * 60) for _ in itertools.count())
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        agent = create_react_agent(
+            RecordingModel(messages=replies), [], checkpointer=create_bounded_checkpointer(), prompt=system_prompt,
+            pre_model_hook=make_history_hook(max_messages=100, max_tokens=100000, budgeter=budgeter,
+                                             system_prompt=system_prompt)
+        )
+    config = {"configurable": {"thread_id": "user_1"}}
+    for i in range(10):
+        agent.invoke({"messages": [HumanMessage(content=f"вопрос {i}")]}, config)
+
+    assert max(prompt_sizes) <= 300
+    assert budgeter.stats()["trimmed_calls"] > 0
+
+if __name__ == "__main__":
+    print("🧪 Тестирование бюджета промпта...")
+    test_snippets_deduplicated_and_fitted()
+    print("✅ Фрагменты поиска без повторов")
+    test_web_search_context_within_budget()
+    print("✅ Контекст поиска в пределах бюджета")
+    test_fit_messages_respects_budget()
+    print("✅ История в пределах бюджета")
+    test_agent_calls_stay_within_budget()
+    print("✅ Вызовы агента в пределах бюджета")
+    print("🎉 Все тесты бюджета промпта пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Тесты планировщика LLM: приоритеты, резерв слотов для команд, отбрасывание фоновых вызовов и лимит на пользователя
+"""
+
+import sys
+import time
+import asyncio
+import threading
+
+import llm_executor
+from llm_executor import (
+    LLMScheduler, LLMOverloaded, LLMRateLimited, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+)
+from moderation import ModerationBatcher, OVERLOAD_VERDICT
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def _percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+def _tracked_call(active: dict, lock: threading.Lock, kind: str, seconds: float) -> str:
+    """Имитирует вызов GigaChat и запоминает пиковое число одновременных вызовов каждого вида"""
+    with lock:
+        active[kind] += 1
+        active[f"max_{kind}"] = max(active[f"max_{kind}"], active[kind])
+    time.sleep(seconds)
+    with lock:
+        active[kind] -= 1
+    return kind
+
+def _command_waits(scheduler: LLMScheduler, moderation_priority: int) -> list:
+    """Всплеск вызовов модерации, на фоне которого приходят команды; возвращает ожидание команд"""
+    active = {"background": 0, "interactive": 0, "max_background": 0, "max_interactive": 0}
+    lock = threading.Lock()
+
+    async def command(waits):
+        started = time.perf_counter()
+        await scheduler.acquire(PRIORITY_INTERACTIVE)
+        waits.append(time.perf_counter() - started)
+        try:
+            await asyncio.to_thread(_tracked_call, active, lock, "interactive", 0.02)
+        finally:
+            scheduler.release()
+
+    async def scenario():
+        waits = []
+        burst = [asyncio.ensure_future(scheduler.run(moderation_priority, None, _tracked_call, active, lock,
+                                                      "background", 0.1)) for _ in range(24)]
+        await asyncio.sleep(0.01)
+        commands = []
+        for _ in range(8):
+            commands.append(asyncio.ensure_future(command(waits)))
+            await asyncio.sleep(0.02)
+        await asyncio.gather(*commands)
+        await asyncio.gather(*burst, return_exceptions=True)
+        return waits
+
+    return asyncio.run(scenario()), active
+
+def test_commands_keep_latency_during_moderation_burst():
+    """Во время всплеска модерации команды ждут слот меньше, чем при общей очереди без приоритетов"""
+    llm_executor.shutdown_llm_executor()
+    # Без приоритетов: модерация и команды стоят в одной очереди
+    fifo_waits, _ = _command_waits(LLMScheduler(max_concurrency=4, reserved_interactive=0, shed_queue_depth=1000),
+                                   PRIORITY_INTERACTIVE)
+    llm_executor.shutdown_llm_executor()
+    waits, active = _command_waits(LLMScheduler(max_concurrency=4, reserved_interactive=1, shed_queue_depth=1000),
+                                   PRIORITY_BACKGROUND)
+    llm_executor.shutdown_llm_executor()
+
+    print(f"\n📊 Ожидание слота командой, p95: общая очередь {_percentile(fifo_waits, 0.95) * 1000:.0f} мс, "
+          f"планировщик {_percentile(waits, 0.95) * 1000:.0f} мс")
+    assert _percentile(waits, 0.95) < 0.05
+    assert _percentile(fifo_waits, 0.95) > 0.2
+    # Фоновые вызовы не занимают зарезервированный слот
+    assert active["max_background"] <= 3
+
+def test_background_shed_when_queue_is_deep():
+    """При глубокой очереди новые фоновые вызовы отклоняются, а команда вытесняет самый новый из очереди"""
+    scheduler = LLMScheduler(max_concurrency=1, reserved_interactive=0, shed_queue_depth=3)
+
+    async def scenario():
+        await scheduler.acquire(PRIORITY_BACKGROUND)
+        queued = [asyncio.ensure_future(scheduler.acquire(PRIORITY_BACKGROUND)) for _ in range(3)]
+        await asyncio.sleep(0)
+        try:
+            await scheduler.acquire(PRIORITY_BACKGROUND)
+            assert False, "Ожидался отказ фоновому вызову"
+        except LLMOverloaded:
+            pass
+        command = asyncio.ensure_future(scheduler.acquire(PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0.01)
+        assert isinstance(queued[-1].exception(), LLMOverloaded)
+        scheduler.release()
+        # Освободившийся слот получает команда, а не фоновый вызов, пришедший раньше
+        await command
+        assert not queued[0].done()
+        for task in queued[:2]:
+            task.cancel()
+
+    asyncio.run(scenario())
+    stats = scheduler.stats()
+    assert stats["shed"]["background"] == 2
+    assert stats["granted"]["interactive"] == 1
+
+def test_user_rate_limit():
+    """Пользователь получает всплеск запросов, дальше — не чаще заданной частоты; другие не страдают"""
+    clock = FakeClock()
+    scheduler = LLMScheduler(user_rate=60, user_burst=2, clock=clock)
+    scheduler.check_rate("user_1")
+    scheduler.check_rate("user_1")
+    try:
+        scheduler.check_rate("user_1")
+        assert False, "Ожидался LLMRateLimited"
+    except LLMRateLimited as e:
+        assert 0 < e.retry_after <= 1
+    scheduler.check_rate("user_2")
+    clock.now += 1
+    scheduler.check_rate("user_1")
+    assert scheduler.stats()["rate_limited"] == 1
+
+def test_moderation_degrades_under_overload():
+    """Если планировщик отклонил пакет модерации, сообщения получают вердикт-заглушку, а не ошибку"""
+    saved = llm_executor._scheduler
+    llm_executor._scheduler = LLMScheduler(max_concurrency=1, reserved_interactive=0, shed_queue_depth=0)
+
+    async def scenario():
+        await llm_executor._scheduler.acquire(PRIORITY_INTERACTIVE)
+        batcher = ModerationBatcher(lambda texts: [{"is_toxic": True, "toxicity_score": 9}] * len(texts), window_ms=10)
+        return await asyncio.gather(*(batcher.submit(f"сообщение {i}") for i in range(3))), batcher
+
+    try:
+        verdicts, batcher = asyncio.run(scenario())
+    finally:
+        llm_executor._scheduler = saved
+    assert verdicts == [OVERLOAD_VERDICT] * 3
+    assert batcher.batches_shed == 1
+
+def test_workers_share_global_limit():
+    """В многопроцессном режиме каждый процесс получает свою долю общего LLM_MAX_CONCURRENCY"""
+    saved_limit = llm_executor.LLM_MAX_CONCURRENCY
+    llm_executor.shutdown_llm_executor()
+    llm_executor.LLM_MAX_CONCURRENCY = 8
+    active, lock = {"cmd": 0, "max_cmd": 0}, threading.Lock()
+
+    async def burst():
+        return await asyncio.gather(*(llm_executor.run_blocking(_tracked_call, active, lock, "cmd", 0.05)
+                                      for _ in range(6)))
+
+    try:
+        llm_executor.share_llm_limits(4)
+        scheduler = llm_executor.get_llm_scheduler()
+        assert scheduler.max_concurrency == 2 and scheduler.stats()["max_concurrency"] == 2
+        assert scheduler.shed_queue_depth == llm_executor.LLM_SHED_QUEUE_DEPTH // 4
+        assert llm_executor.get_llm_executor()._max_workers == 2
+        asyncio.run(burst())
+        assert active["max_cmd"] == 2
+    finally:
+        llm_executor.shutdown_llm_executor()
+        llm_executor.share_llm_limits(1)
+        llm_executor.LLM_MAX_CONCURRENCY = saved_limit
+
+if __name__ == "__main__":
+    print("🧪 Тестирование планировщика LLM...")
+    test_commands_keep_latency_during_moderation_burst()
+    print("✅ Команды не ждут за модерацией")
+    test_background_shed_when_queue_is_deep()
+    print("✅ Фоновые вызовы отбрасываются при перегрузке")
+    test_user_rate_limit()
+    print("✅ Лимит запросов на пользователя")
+    test_moderation_degrades_under_overload()
+    print("✅ Модерация деградирует без ошибок")
+    test_workers_share_global_limit()
+    print("✅ Процессы делят общий лимит LLM")
+    print("🎉 Все тесты планировщика пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Тесты многопроцессного режима: раскладка обновлений по пользователям, порядок, падение процесса и рейтинг
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import multiprocessing
+
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+
+from bench_load import FakeTelegram, FakeBotAPI, make_updates, run_sharded_load
+from leaderboard import Leaderboard
+from telegram_shards import ShardRouter, shard_of
+
+def _recording_application(shard: int, shards: int, records):
+    """Приложение рабочего процесса для тестов: записывает, кто и в каком порядке обработал сообщение"""
+    async def record(update, context):
+        if update.message.text == "crash":
+            os._exit(1)
+        seq = int(update.message.text)
+        await asyncio.sleep(random.uniform(0, 0.01))
+        previous = context.user_data.get("last")
+        context.user_data["last"] = seq
+        records.put((update.effective_user.id, seq, previous, shard, os.getpid()))
+
+    application = Application.builder().token("1:TEST").request(FakeBotAPI(FakeTelegram(0))).concurrent_updates(16).build()
+    application.add_handler(MessageHandler(filters.TEXT, record))
+    return application
+
+def _message(update_id: int, user_id: int, text: str) -> Update:
+    _, data = make_updates(1, {"message": 1})[0]
+    data["update_id"] = update_id
+    data["message"]["from"]["id"] = user_id
+    data["message"]["text"] = text
+    return Update.de_json(data, None)
+
+def _collect(records, count: int) -> list:
+    return [records.get(timeout=60) for _ in range(count)]
+
+def test_user_updates_stay_ordered_on_one_shard():
+    """Обновления пользователя идут в один процесс по порядку, и его user_data сохраняется между ними"""
+    records = multiprocessing.get_context("spawn").Queue()
+    router = ShardRouter(2, _recording_application, build_args=(records,))
+    router.start()
+    try:
+        users, per_user = list(range(2000, 2006)), 8
+        update_id = 0
+        for seq in range(1, per_user + 1):
+            for user_id in users:
+                update_id += 1
+                router.dispatch(_message(update_id, user_id, str(seq)))
+        result = _collect(records, len(users) * per_user)
+    finally:
+        router.stop()
+
+    by_user = {}
+    for user_id, seq, previous, shard, pid in result:
+        by_user.setdefault(user_id, []).append((seq, previous, shard, pid))
+    assert sorted(by_user) == users
+    for user_id, entries in by_user.items():
+        assert [seq for seq, _, _, _ in entries] == list(range(1, per_user + 1))
+        assert [previous for _, previous, _, _ in entries] == [None] + list(range(1, per_user))
+        assert {shard for _, _, shard, _ in entries} == {shard_of(user_id, 2)}
+        assert len({pid for _, _, _, pid in entries}) == 1
+    assert router.stats()["dispatched"] == [24, 24]
+
+def test_worker_crash_is_isolated():
+    """Упавший процесс перезапускается, а другой процесс все это время обрабатывает свои обновления"""
+    records = multiprocessing.get_context("spawn").Queue()
+    router = ShardRouter(2, _recording_application, build_args=(records,), check_interval=0.1)
+    router.start()
+    try:
+        crashing_user, healthy_user = 3000, 3001
+        router.dispatch(_message(1, healthy_user, "1"))
+        _collect(records, 1)
+        crashed_pid = router.processes[shard_of(crashing_user, 2)].pid
+        router.dispatch(_message(2, crashing_user, "crash"))
+        router.dispatch(_message(3, healthy_user, "2"))
+        result = _collect(records, 1)
+        # Обновление, пришедшее после падения, дожидается перезапущенного процесса
+        deadline = time.monotonic() + 30
+        while router.processes[shard_of(crashing_user, 2)].pid == crashed_pid and time.monotonic() < deadline:
+            time.sleep(0.05)
+        router.dispatch(_message(4, crashing_user, "5"))
+        result += _collect(records, 1)
+        stats = router.stats()
+    finally:
+        router.stop()
+
+    assert {(user_id, seq) for user_id, seq, _, _, _ in result} == {(healthy_user, 2), (crashing_user, 5)}
+    restarted = [pid for user_id, _, _, _, pid in result if user_id == crashing_user]
+    assert restarted[0] != crashed_pid
+    expected_restarts = [0, 0]
+    expected_restarts[shard_of(crashing_user, 2)] = 1
+    assert stats["restarts"] == expected_restarts
+
+def test_leaderboard_merges_peer_shards():
+    """Каждый процесс сохраняет только своих участников, а рейтинг показывает участников всех процессов"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "leaderboard.json")
+        first, second = Leaderboard(snapshot_file=path), Leaderboard(snapshot_file=path)
+        first.use_shard(0, 2)
+        second.use_shard(1, 2)
+        first.update("10", {"activity_score": 5, "username": "anna"})
+        second.update("11", {"activity_score": 9, "username": "boris"})
+        first.save_snapshot()
+        second.save_snapshot()
+
+        first.merge_peer_snapshots()
+        assert first.top() == [("boris", 9), ("anna", 5)]
+        first.update("12", {"activity_score": 1, "username": "vera"})
+        first.save_snapshot()
+        second.merge_peer_snapshots()
+        assert second.top() == [("boris", 9), ("anna", 5), ("vera", 1)]
+
+        restored = Leaderboard(snapshot_file=path)
+        restored.use_shard(0, 2)
+        restored.load_snapshot()
+        assert restored.top() == [("boris", 9), ("anna", 5), ("vera", 1)]
+        assert os.path.exists(os.path.join(tmp, "leaderboard.shard0.json"))
+        assert not os.path.exists(path)
+
+def test_leaderboard_repartitions_after_worker_count_change():
+    """После изменения числа процессов каждый участник принадлежит одному процессу и не задваивается"""
+    scores = {str(user_id): user_id for user_id in range(10, 16)}
+
+    def start(shards: int, path: str) -> list:
+        boards = [Leaderboard(snapshot_file=path) for _ in range(shards)]
+        for shard, board in enumerate(boards):
+            board.use_shard(shard, shards)
+            board.load_snapshot()
+        return boards
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "leaderboard.json")
+        for shard, board in enumerate(start(2, path)):
+            for user_id, score in scores.items():
+                if shard_of(user_id, 2) == shard:
+                    board.update(user_id, {"activity_score": score, "username": f"user{user_id}"})
+            board.save_snapshot()
+
+        boards = start(3, path)
+        owned = [board._owned for board in boards]
+        assert sorted(user_id for users in owned for user_id in users) == sorted(scores)
+        assert all(shard_of(user_id, 3) == shard for shard, users in enumerate(owned) for user_id in users)
+        # Счет участника меняется только у нового владельца, соседи видят его без старого значения
+        boards[shard_of("12", 3)].update("12", {"activity_score": 50, "username": "user12"})
+        for board in boards:
+            board.save_snapshot()
+        for board in boards:
+            board.merge_peer_snapshots()
+            assert len(board) == len(scores) and board.top()[0] == ("user12", 50)
+
+        # Возврат к одному процессу: все участники снова свои, старые снимки процессов не мешают
+        single = Leaderboard(snapshot_file=path)
+        single.load_snapshot()
+        assert len(single) == len(scores) and single.top()[0] == ("user12", 50)
+        assert sorted(single._owned) == sorted(scores)
+
+def test_sharded_load_processes_all_updates():
+    """Через рабочие процессы проходит весь поток бенчмарка без ошибок, нагрузка делится между ними"""
+    started = time.perf_counter()
+    report = run_sharded_load(120, workers=2, llm_latency=0.01, search_latency=0.0, telegram_latency=0.0,
+                              firestore_latency=0.0)
+    print(f"\n📊 2 процесса: {report['messages_per_sec']:.0f} сообщ./с, p50 {report['p50_ms']:.0f} мс, "
+          f"всего с запуском {time.perf_counter() - started:.1f} с")
+    assert report["updates"] == 120
+    assert report["errors"] == 0
+    assert report["restarts"] == 0
+    assert all(count > 0 for count in report["dispatched"])
+
+if __name__ == "__main__":
+    print("🧪 Тестирование многопроцессного режима...")
+    test_user_updates_stay_ordered_on_one_shard()
+    print("✅ Порядок обновлений пользователя сохраняется")
+    test_worker_crash_is_isolated()
+    print("✅ Падение процесса изолировано")
+    test_leaderboard_merges_peer_shards()
+    print("✅ Рейтинг собирается из всех процессов")
+    test_leaderboard_repartitions_after_worker_count_change()
+    print("✅ Рейтинг перераспределяется при изменении числа процессов")
+    test_sharded_load_processes_all_updates()
+    print("✅ Поток обновлений обработан рабочими процессами")
+    print("🎉 Все тесты многопроцессного режима пройдены успешно!")
+    sys.exit(0)
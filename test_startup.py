@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Тесты запуска: импорт бота не тянет langchain/langgraph/Firebase и укладывается в бюджет времени
+"""
+
+import os
+import sys
+import json
+import threading
+import subprocess
+
+# Бюджет на импорт модулей проекта (без самой библиотеки python-telegram-bot), мс
+IMPORT_BUDGET_MS = 500
+HEAVY_PACKAGES = ("langchain", "langchain_core", "langchain_community", "langgraph",
+                  "langchain_gigachat", "langchain_tavily", "gigachat", "firebase_admin", "requests")
+
+def _run_python(code: str, *flags) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    for name in ("GIGACHAT_CLIENT_ID", "GIGACHAT_CLIENT_SECRET", "GIGACHAT_SCOPE", "TAVILY_API_KEY"):
+        env.setdefault(name, "test")
+    env.pop("__firebase_config", None)
+    return subprocess.run([sys.executable, *flags, "-c", code], capture_output=True, text=True,
+                          env=env, cwd=os.path.dirname(os.path.abspath(__file__)), timeout=120)
+
+def _cumulative_import_us(stderr: str) -> dict:
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            pass
+    return times
+
+def test_bot_import_skips_heavy_packages():
+    """После импорта telegram_bot в процессе нет langchain, langgraph, Firebase и requests"""
+    result = _run_python(
+        "import sys, json, telegram_bot; "
+        f"print(json.dumps(sorted({{m.split('.')[0] for m in sys.modules}} & set({HEAVY_PACKAGES!r}))))"
+    )
+    assert result.returncode == 0, result.stderr
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    assert loaded == [], f"При импорте загружены тяжелые пакеты: {loaded}"
+
+def test_core_modules_skip_telegram():
+    """agent_core и рейтинг не загружают python-telegram-bot: номер процесса берется из sharding.py"""
+    result = _run_python("import sys, agent_core, leaderboard; print('telegram' in sys.modules)")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "False"
+
+def test_entry_points_share_concurrent_updates():
+    """bot.py и telegram_bot.py берут TELEGRAM_CONCURRENT_UPDATES из общей настройки"""
+    result = _run_python(
+        "import os; os.environ['TELEGRAM_CONCURRENT_UPDATES'] = '3'; os.environ['TELEGRAM_BOT_TOKEN'] = '1:test'\n"
+        "import bot, telegram_bot\n"
+        "built = []\n"
+        "bot.run_application = built.append\n"
+        "bot.main()\n"
+        "print(built[0].concurrent_updates, telegram_bot.build_application('1:test').concurrent_updates)"
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "3 3"
+
+def test_bot_import_within_budget():
+    """Импорт модулей проекта (без python-telegram-bot) укладывается в бюджет"""
+    result = _run_python("import telegram_bot", "-X", "importtime")
+    assert result.returncode == 0, result.stderr
+    times = _cumulative_import_us(result.stderr)
+    own_ms = (times["telegram_bot"] - times.get("telegram", 0)) / 1000
+    print(f"\n📊 Импорт telegram_bot: {times['telegram_bot'] / 1000:.0f} мс, "
+          f"из них модули проекта: {own_ms:.0f} мс")
+    assert own_ms < IMPORT_BUDGET_MS
+
+def test_lazy_components_created_once():
+    """Одновременные первые обращения создают компонент ровно один раз"""
+    import agent_core
+
+    created = []
+    barrier = threading.Barrier(8)
+
+    class FakeTavily:
+        def __init__(self, max_results):
+            created.append(max_results)
+
+    import langchain_tavily
+    original = langchain_tavily.TavilySearch
+    langchain_tavily.TavilySearch = FakeTavily
+    agent_core._tavily_search_tool = None
+    try:
+        def worker(results):
+            barrier.wait()
+            results.append(agent_core.get_tavily_search_tool())
+
+        results = []
+        threads = [threading.Thread(target=worker, args=(results,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        langchain_tavily.TavilySearch = original
+        agent_core._tavily_search_tool = None
+
+    assert created == [5]
+    assert len({id(tool) for tool in results}) == 1
+
+if __name__ == "__main__":
+    print("🧪 Тестирование запуска бота...")
+    test_bot_import_skips_heavy_packages()
+    print("✅ Тяжелые пакеты не загружаются при импорте")
+    test_core_modules_skip_telegram()
+    print("✅ agent_core и рейтинг не загружают Telegram")
+    test_entry_points_share_concurrent_updates()
+    print("✅ Обе точки входа используют общий TELEGRAM_CONCURRENT_UPDATES")
+    test_bot_import_within_budget()
+    print("✅ Импорт укладывается в бюджет")
+    test_lazy_components_created_once()
+    print("✅ Ленивые компоненты создаются один раз")
+    print("🎉 Все тесты запуска пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Тесты хранилища: отложенная пакетная запись в Firestore статистика пользователей и рейтинг
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+import itertools
+from types import SimpleNamespace
+
+from firestore_writer import FirestoreWriteBehind
+from user_stats import UserStatsStore, format_user_stats
+from leaderboard import Leaderboard
+
+_ids = itertools.count()
+
+class FakeDocument:
+    def __init__(self, path):
+        self.path = path
+
+class FakeCollection:
+    def __init__(self, path):
+        self.path = path
+
+    def document(self, document_id=None):
+        return FakeDocument(f"{self.path}/{document_id or next(_ids)}")
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.operations = []
+
+    def set(self, ref, data, merge=False):
+        self.operations.append((ref.path, data, merge))
+
+    def commit(self):
+        self.db.commits.append(self.operations)
+
+class FakeFirestore:
+    """Минимальная замена клиента Firestore для проверки пакетной записи"""
+    def __init__(self):
+        self.commits = []
+
+    def collection(self, path):
+        return FakeCollection(path)
+
+    def batch(self):
+        return FakeBatch(self)
+
+def test_write_behind_flushes_by_size():
+    """При накоплении batch_size записей они уходят одним WriteBatch"""
+    db = FakeFirestore()
+    writer = FirestoreWriteBehind(db, batch_size=5, flush_interval=60)
+    messages = db.collection("artifacts/app/users/1/messages")
+    for i in range(10):
+        writer.add(messages, {"text": f"сообщение {i}"})
+
+    deadline = time.time() + 2
+    while writer.stats()["records_written"] < 10 and time.time() < deadline:
+        time.sleep(0.01)
+    assert [len(batch) for batch in db.commits] == [5, 5]
+    writer.close()
+
+def test_write_behind_flushes_by_timer_and_drains_on_close():
+    """Неполный пакет отправляется по таймеру, а остаток — при остановке"""
+    db = FakeFirestore()
+    writer = FirestoreWriteBehind(db, batch_size=100, flush_interval=0.05)
+    writer.add(db.collection("messages"), {"text": "а"})
+    time.sleep(0.3)
+    assert writer.stats()["flushes"] == 1
+
+    writer.flush_interval = 60
+    writer.add(db.collection("messages"), {"text": "б"})
+    writer.close()
+    assert writer.stats()["records_written"] == 2 and writer.stats()["pending"] == 0
+
+def test_write_behind_bounded_queue_and_known_users():
+    """Очередь ограничена по размеру, а известные пользователи запоминаются"""
+    db = FakeFirestore()
+    writer = FirestoreWriteBehind(db, batch_size=1000, flush_interval=60, max_pending=3, known_users_max=2)
+    for i in range(5):
+        writer.add(db.collection("messages"), {"text": str(i)})
+    assert writer.stats()["pending"] <= 3 and writer.stats()["dropped"] == 2
+
+    assert not writer.is_known_user("42")
+    writer.mark_user_known("42")
+    assert writer.is_known_user("42")
+    writer.close()
+
+def test_user_stats_incremental_counters():
+    """Статистика обновляется при каждом сообщении и читается без сканирования сообщений"""
+    store = UserStatsStore()
+    store.warm("1", {"message_count": 9, "activity_score": 9, "jk_earned": 0, "username": "jek"})
+    increments = store.record_message("1", "jek", timestamp=1_700_000_000)
+    assert increments == {"message_count": 1, "activity_score": 1, "jk_earned": 1}
+
+    stats = store.get("1")
+    assert stats["message_count"] == 10 and stats["activity_score"] == 10 and stats["jk_earned"] == 1
+    assert stats["last_activity"] == 1_700_000_000
+    assert "Сообщений: 10" in format_user_stats("1", stats)
+
+def test_user_stats_loads_profile_once_on_miss():
+    """При промахе статистика читается одним запросом профиля, дальше — из памяти"""
+    loads = []
+
+    def load_profile(user_id):
+        loads.append(user_id)
+        return {"message_count": 3, "activity_score": 30, "jk_earned": 3}
+
+    store = UserStatsStore(load_profile=load_profile)
+    assert store.get("7")["activity_score"] == 30
+    assert store.get("7")["message_count"] == 3
+    assert loads == ["7"]
+    assert UserStatsStore().get("unknown") is None
+
+def test_leaderboard_follows_activity():
+    """Рейтинг обновляется вместе со статистикой и отдает топ без пересчета"""
+    board = Leaderboard(top_size=2, snapshot_file=os.devnull)
+    store = UserStatsStore()
+    store.add_listener(board.update)
+    for user_id, name, messages in [("1", "alice", 3), ("2", "bob", 5), ("3", "carol", 1)]:
+        for _ in range(messages):
+            store.record_message(user_id, name)
+
+    assert board.top() == [("bob", 5), ("alice", 3)]
+    assert board.rank("3") == 3
+    first_text = board.format_top()
+    assert "1. bob - 5 очков" in first_text and "carol" not in first_text
+    assert board.format_top() is first_text
+
+    for _ in range(4):
+        store.record_message("3", "carol")
+    assert board.top() == [("bob", 5), ("carol", 5)]
+    assert "carol" in board.format_top()
+
+def test_leaderboard_snapshot_roundtrip():
+    """Снимок рейтинга сохраняется атомарно и восстанавливается после перезапуска"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "leaderboard.json")
+        board = Leaderboard(snapshot_file=path)
+        board.update("1", {"activity_score": 10, "username": "alice"})
+        board.update("2", {"activity_score": 20, "username": "bob"})
+        board.save_snapshot()
+
+        restored = Leaderboard(snapshot_file=path)
+        restored.load_snapshot()
+        assert restored.top() == [("bob", 20), ("alice", 10)]
+        assert os.listdir(tmp) == ["leaderboard.json"]
+
+def test_leaderboard_snapshot_concurrent_and_failed_saves():
+    """Одновременные сохранения не портят снимок, а неудачное не оставляет временный файл"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "leaderboard.json")
+        board = Leaderboard(snapshot_file=path)
+
+        def save_many(offset):
+            for i in range(50):
+                board.update(str(offset + i % 5), {"activity_score": i, "username": f"user{offset}"})
+                board.save_snapshot()
+
+        threads = [threading.Thread(target=save_many, args=(offset,)) for offset in (0, 100, 200)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        board.stop_snapshots()
+        restored = Leaderboard(snapshot_file=path)
+        restored.load_snapshot()
+        assert len(restored) == 15 and restored.top() == board.top()
+        assert os.listdir(tmp) == ["leaderboard.json"]
+
+        # Замена не удалась (на месте снимка каталог): временный файл удаляется, снимок останется «грязным»
+        broken = Leaderboard(snapshot_file=os.path.join(tmp, "broken"))
+        os.mkdir(broken.snapshot_file)
+        broken.update("1", {"activity_score": 1, "username": "alice"})
+        broken.save_snapshot()
+        assert broken._dirty
+        assert sorted(os.listdir(tmp)) == ["broken", "leaderboard.json"]
+
+def test_concurrent_first_messages_keep_increments():
+    """Одновременные первые сообщения нового пользователя читают профиль один раз и не затирают счетчики"""
+    import telegram_bot
+    from bench_load import _install_fakes
+
+    _, _, fake_db, writer, restore = _install_fakes(0.0, 0.0, 0.0, 0.05)
+    try:
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=9001, username="eva", first_name="Ева", last_name=None))
+
+        async def first_messages():
+            await asyncio.gather(*(telegram_bot.register_user_and_save_message(update, f"привет {i}") for i in range(3)))
+
+        asyncio.run(first_messages())
+        writer.flush()
+        profile = fake_db.documents[f"artifacts/{telegram_bot.app_id}/users/9001/profile/data"]
+    finally:
+        restore()
+
+    assert profile["message_count"] == 3 and profile["activity_score"] == 3
+    assert profile["username"] == "eva" and "registration_date" in profile
+    assert fake_db.reads == 1
+    assert not telegram_bot._registration_locks
+
+def test_stats_command_reads_profile_off_event_loop():
+    """/stats при промахе кэша читает профиль в Firestore в потоке: другие обработчики не ждут"""
+    import telegram_bot
+    from bench_load import _install_fakes
+
+    replies = []
+
+    async def reply_text(text=None, **kwargs):
+        replies.append(text)
+
+    async def no_register(update, message_text):
+        pass
+
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=9002, username="gleb"),
+                             message=SimpleNamespace(reply_text=reply_text))
+    _, _, fake_db, _, restore = _install_fakes(0.0, 0.0, 0.0, 0.3)
+    saved_register = telegram_bot.register_user_and_save_message
+    telegram_bot.register_user_and_save_message = no_register
+
+    async def scenario():
+        gaps, stop = [], asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not stop.is_set():
+                await asyncio.sleep(0.01)
+                gaps.append(time.perf_counter() - last)
+                last = time.perf_counter()
+
+        task = asyncio.create_task(ticker())
+        await telegram_bot.stats_command(update, SimpleNamespace())
+        stop.set()
+        await task
+        # Если цикл был занят все время чтения, ticker не успел ни разу
+        return max(gaps, default=float("inf"))
+
+    try:
+        fake_db.documents[f"artifacts/{telegram_bot.app_id}/users/9002/profile/data"] = {
+            "message_count": 4, "activity_score": 4, "username": "gleb"}
+        max_gap = asyncio.run(scenario())
+    finally:
+        telegram_bot.register_user_and_save_message = saved_register
+        restore()
+
+    assert "Сообщений: 4" in replies[0]
+    assert max_gap < 0.2
+
+def test_score_survives_restart_without_firestore():
+    """Без Firestore первое сообщение после перезапуска продолжает счет из снимка рейтинга"""
+    import telegram_bot
+    assert telegram_bot.db is None and telegram_bot.stats_store.load_profile == telegram_bot.leaderboard.profile
+
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=7, username="dina"))
+    saved_store = telegram_bot.stats_store
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "leaderboard.json")
+        try:
+            for restart in range(2):
+                # Новый процесс: пустая статистика и рейтинг, подключенные так же, как в боте
+                board = Leaderboard(snapshot_file=path)
+                board.load_snapshot()
+                store = UserStatsStore(load_profile=board.profile)
+                store.add_listener(board.update)
+                telegram_bot.stats_store = store
+                for _ in range(3):
+                    asyncio.run(telegram_bot.register_user_and_save_message(update, "привет"))
+                board.save_snapshot()
+        finally:
+            telegram_bot.stats_store = saved_store
+
+    assert board.top() == [("dina", 6)]
+    assert store.get("7")["activity_score"] == 6
+
+if __name__ == "__main__":
+    test_write_behind_flushes_by_size()
+    test_write_behind_flushes_by_timer_and_drains_on_close()
+    test_write_behind_bounded_queue_and_known_users()
+    test_user_stats_incremental_counters()
+    test_user_stats_loads_profile_once_on_miss()
+    test_leaderboard_follows_activity()
+    test_leaderboard_snapshot_roundtrip()
+    test_leaderboard_snapshot_concurrent_and_failed_saves()
+    test_concurrent_first_messages_keep_increments()
+    test_stats_command_reads_profile_off_event_loop()
+    test_score_survives_restart_without_firestore()
+    print("🎉 Тесты хранилища пройдены")
+    sys.exit(0)
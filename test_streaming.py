@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Тесты потоковой генерации поста: перенос генератора в пул потоков и правки сообщения с ограничением частоты
+"""
+
+import sys
+import time
+import asyncio
+from functools import partial
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from telegram.error import RetryAfter
+
+import agent_core
+from llm_executor import iterate_blocking
+from telegram_stream import ThrottledMessageEditor, STREAM_CURSOR, TELEGRAM_MESSAGE_LIMIT
+
+class FakeMessage:
+    """Сообщение Telegram, которое запоминает правки и может ответить RetryAfter"""
+
+    def __init__(self, text="Генерирую пост...", retry_after_on=()):
+        self.text = text
+        self.edits = []
+        self.retry_after_on = set(retry_after_on)
+        self.calls = 0
+
+    async def edit_text(self, text, reply_markup=None):
+        self.calls += 1
+        if self.calls in self.retry_after_on:
+            raise RetryAfter(0.2)
+        self.edits.append((time.perf_counter(), text, reply_markup))
+        self.text = text
+
+def fake_token_stream(count=40, delay=0.01):
+    for i in range(count):
+        time.sleep(delay)
+        yield f"слово{i} "
+
+def test_iterate_blocking_yields_before_generator_finishes():
+    """Первый фрагмент приходит в цикл событий до окончания генерации, ошибки пробрасываются"""
+    async def scenario():
+        started = time.perf_counter()
+        first_at = None
+        items = []
+        async for item in iterate_blocking(fake_token_stream, 20, 0.02):
+            if first_at is None:
+                first_at = time.perf_counter() - started
+            items.append(item)
+        total = time.perf_counter() - started
+        return first_at, total, items
+
+    first_at, total, items = asyncio.run(scenario())
+    assert items == [f"слово{i} " for i in range(20)]
+    assert first_at < total / 4
+
+    def failing():
+        yield "начало"
+        raise ValueError("обрыв потока")
+
+    async def consume_failing():
+        received = []
+        try:
+            async for item in iterate_blocking(failing):
+                received.append(item)
+        except ValueError as e:
+            return received, str(e)
+        return received, None
+
+    assert asyncio.run(consume_failing()) == (["начало"], "обрыв потока")
+
+def test_editor_throttles_intermediate_edits():
+    """Промежуточные правки не чаще интервала, итоговая — с полным текстом и клавиатурой"""
+    message = FakeMessage()
+    editor = ThrottledMessageEditor(message, min_interval=0.1)
+
+    async def scenario():
+        draft = ""
+        started = time.perf_counter()
+        async for delta in iterate_blocking(fake_token_stream, 40, 0.01):
+            draft += delta
+            await editor.update(draft)
+        await editor.finish("Готовый пост", reply_markup="keyboard")
+        return started
+
+    started = asyncio.run(scenario())
+    times = [at for at, _, _ in message.edits]
+    assert times[0] - started < 0.1
+    assert all(later - earlier >= 0.099 for earlier, later in zip(times, times[1:]))
+    assert len(message.edits) <= 7
+    assert editor.skipped > 20
+    assert all(text.endswith(STREAM_CURSOR) for _, text, _ in message.edits[:-1])
+    assert message.edits[-1][1:] == ("Готовый пост", "keyboard")
+
+def test_editor_respects_retry_after():
+    """После RetryAfter правки пропускаются до конца паузы, итоговая правка повторяется"""
+    now = [0.0]
+    message = FakeMessage(retry_after_on={1, 3})
+    editor = ThrottledMessageEditor(message, min_interval=0.01, clock=lambda: now[0])
+
+    async def scenario():
+        assert not await editor.update("черновик 1")
+        assert not await editor.update("черновик 2")
+        now[0] = 0.25
+        assert await editor.update("черновик 3")
+        started = time.perf_counter()
+        await editor.finish("x" * (TELEGRAM_MESSAGE_LIMIT + 100), reply_markup="keyboard")
+        return time.perf_counter() - started
+
+    finish_time = asyncio.run(scenario())
+    assert editor.rate_limited == 2
+    assert editor.skipped == 1
+    assert finish_time >= 0.19
+    assert len(message.edits[-1][1]) == TELEGRAM_MESSAGE_LIMIT
+    assert message.edits[-1][2] == "keyboard"
+
+def test_generate_post_streaming_shows_draft_early():
+    """Черновик появляется сразу, а итоговый пост оформляется и получает клавиатуру"""
+    import telegram_bot
+
+    async def fake_stream(topic, user_id=None):
+        for i in range(30):
+            await asyncio.sleep(0.02)
+            yield f"часть{i} "
+
+    async def fail_if_called(topic, *args):
+        raise AssertionError("при успешном потоке агент не вызывается")
+
+    original = telegram_bot.stream_post_async, telegram_bot.create_telegram_post_async
+    telegram_bot.stream_post_async, telegram_bot.create_telegram_post_async = fake_stream, fail_if_called
+    try:
+        message = FakeMessage()
+        started = time.perf_counter()
+        post_text = asyncio.run(telegram_bot.generate_post_streaming("поход", message, pipeline="fast"))
+    finally:
+        telegram_bot.stream_post_async, telegram_bot.create_telegram_post_async = original
+
+    first_edit_at = message.edits[0][0] - started
+    print(f"\n📊 Первый фрагмент через {first_edit_at * 1000:.0f} мс, правок: {len(message.edits)}")
+    assert first_edit_at < 0.2
+    assert post_text.startswith("часть0")
+    assert post_text.endswith("*Нейро Jekardos*")
+    assert message.edits[-1][1] == post_text
+    assert message.edits[-1][2] is not None
+
+def test_generate_streams_both_pipelines():
+    """Без --fast /generate идет агентом с показом хода работы, а запасной путь потока сохраняет конвейер и пользователя"""
+    import telegram_bot
+
+    calls = []
+
+    async def fake_create(topic, thread_id="default_thread", pipeline=None, user_id=None, on_progress=None, charge=True):
+        calls.append((pipeline, user_id, on_progress is not None, charge))
+        return "Пост " * 20
+
+    async def broken_stream(topic, user_id=None):
+        raise RuntimeError("поток оборвался")
+        yield
+
+    async def no_duplicates(query, post_text, on_retry=None, user_id=None):
+        return post_text, None
+
+    async def no_register(update, message_text):
+        pass
+
+    def make_update():
+        message = FakeMessage()
+
+        async def reply_text(text=None, reply_markup=None, **kwargs):
+            return FakeMessage(text)
+
+        message.reply_text = reply_text
+        return SimpleNamespace(effective_user=SimpleNamespace(id=9), effective_chat=SimpleNamespace(id=9), message=message)
+
+    saved = (telegram_bot.create_telegram_post_async, telegram_bot.stream_post_async, telegram_bot.avoid_duplicate_post,
+             telegram_bot.register_user_and_save_message, telegram_bot.GENERATE_STREAMING, telegram_bot.POST_PIPELINE)
+    (telegram_bot.create_telegram_post_async, telegram_bot.stream_post_async, telegram_bot.avoid_duplicate_post,
+     telegram_bot.register_user_and_save_message) = fake_create, broken_stream, no_duplicates, no_register
+    telegram_bot.GENERATE_STREAMING, telegram_bot.POST_PIPELINE = True, "agent"
+    try:
+        asyncio.run(telegram_bot.generate_start(make_update(), SimpleNamespace(args=["поход"], user_data={})))
+        asyncio.run(telegram_bot.generate_start(make_update(), SimpleNamespace(args=["--fast", "поход"], user_data={})))
+    finally:
+        (telegram_bot.create_telegram_post_async, telegram_bot.stream_post_async, telegram_bot.avoid_duplicate_post,
+         telegram_bot.register_user_and_save_message, telegram_bot.GENERATE_STREAMING, telegram_bot.POST_PIPELINE) = saved
+
+    # Запасной путь быстрого конвейера не списывает запрос из лимита второй раз: поток уже списал
+    assert calls == [("agent", "9", True, True), ("fast", "9", False, False)]
+
+def test_agent_stream_yields_steps_and_answer_tokens():
+    """Цикл агента отдает шаги с инструментами и токены итогового ответа, но не токены хода с вызовом инструмента"""
+    class TokenAgent:
+        def stream(self, payload, config=None, stream_mode=None, **kwargs):
+            assert stream_mode == ["updates", "messages"]
+            call = {"name": "web_search", "args": {"query": "q"}, "id": "call1"}
+            yield "messages", (AIMessageChunk(content="", tool_calls=[call]), {"langgraph_node": "agent"})
+            yield "updates", {"agent": {"messages": [AIMessage(content="", tool_calls=[call])]}}
+            yield "messages", (SimpleNamespace(content="найдено"), {"langgraph_node": "tools"})
+            for token in ("**Горы** ", "зовут"):
+                yield "messages", (AIMessageChunk(content=token), {"langgraph_node": "agent"})
+            yield "updates", {"agent": {"messages": [AIMessage(content="**Горы** зовут")]}}
+
+    saved = agent_core._agent_executor
+    agent_core._agent_executor = TokenAgent()
+    try:
+        events = list(agent_core.stream_agent_for_post("горы"))
+        post = agent_core.run_agent_for_post("горы")
+    finally:
+        agent_core._agent_executor = saved
+
+    assert events == [("status", agent_core.AGENT_TOOL_STATUS["web_search"]), ("token", "**Горы** "),
+                      ("token", "зовут"), ("post", "**Горы** зовут")]
+    assert post == "**Горы** зовут"
+
+def test_generate_shows_agent_steps():
+    """/generate агентом сразу показывает его шаги в сообщении, а итоговый пост получает клавиатуру"""
+    import telegram_bot
+    from bench_load import _install_fakes
+
+    placeholder = FakeMessage("Генерирую пост...")
+
+    async def reply_text(text=None, reply_markup=None, **kwargs):
+        return placeholder
+
+    user = SimpleNamespace(id=11, username="ivan", first_name="Иван", last_name=None)
+    update = SimpleNamespace(effective_user=user, effective_chat=SimpleNamespace(id=11),
+                             message=SimpleNamespace(reply_text=reply_text))
+    context = SimpleNamespace(args=["поход", "в", "горы"], user_data={})
+    _, _, _, _, restore = _install_fakes(0.05, 0.0, 0.0, 0.0, streaming=True)
+    saved = telegram_bot.POST_PIPELINE, telegram_bot.ThrottledMessageEditor
+    telegram_bot.POST_PIPELINE = "agent"
+    telegram_bot.ThrottledMessageEditor = partial(ThrottledMessageEditor, min_interval=0)
+    try:
+        asyncio.run(telegram_bot.generate_start(update, context))
+    finally:
+        restore()
+        telegram_bot.POST_PIPELINE, telegram_bot.ThrottledMessageEditor = saved
+
+    texts = [text for _, text, _ in placeholder.edits]
+    assert texts[0] == agent_core.AGENT_TOOL_STATUS["web_search"] + STREAM_CURSOR
+    assert agent_core.AGENT_TOOL_STATUS["generate_telegram_post"] + STREAM_CURSOR in texts
+    assert "Горы зовут" in texts[-1] and placeholder.edits[-1][2] is not None
+    assert context.user_data["post_text"] == texts[-1]
+
+if __name__ == "__main__":
+    print("🧪 Тестирование потоковой генерации...")
+    test_iterate_blocking_yields_before_generator_finishes()
+    print("✅ Фрагменты приходят до окончания генерации")
+    test_editor_throttles_intermediate_edits()
+    print("✅ Частота правок ограничена")
+    test_editor_respects_retry_after()
+    print("✅ RetryAfter соблюдается")
+    test_generate_post_streaming_shows_draft_early()
+    print("✅ Черновик появляется сразу")
+    test_generate_streams_both_pipelines()
+    print("✅ Потоком выводятся оба конвейера")
+    test_agent_stream_yields_steps_and_answer_tokens()
+    print("✅ Агент отдает шаги и токены ответа")
+    test_generate_shows_agent_steps()
+    print("✅ Шаги агента видны в сообщении")
+    print("🎉 Все тесты потоковой генерации пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Тесты режима вебхука: прием обновлений по HTTP, проверка секрета и дренаж при остановке
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+
+import httpx
+from telegram.ext import Application, CommandHandler
+
+import telegram_bot
+from bench_load import FakeTelegram, FakeBotAPI, FakeTelegramServer, free_port, make_updates, run_load
+from telegram_webhook import serve_webhook, bot_api_base_url
+
+SECRET = "test-secret"
+
+async def _start(application, drain_timeout: float = 30) -> tuple:
+    """Поднимает вебхук на свободном порту и ждет, пока приложение запустится"""
+    port, stop_event = free_port(), asyncio.Event()
+    server = asyncio.create_task(serve_webhook(
+        application, stop_event, listen="127.0.0.1", port=port, url_path="telegram",
+        webhook_url=f"http://127.0.0.1:{port}/telegram", secret_token=SECRET, drain_timeout=drain_timeout))
+    while not application.running:
+        assert not server.done(), server.exception()
+        await asyncio.sleep(0.02)
+    return f"http://127.0.0.1:{port}/telegram", stop_event, server
+
+def _slow_application(telegram: FakeTelegram, delay: float, finished: list) -> Application:
+    async def slow(update, context):
+        await asyncio.sleep(delay)
+        finished.append(update.update_id)
+
+    application = Application.builder().token("1:TEST").request(FakeBotAPI(telegram)).concurrent_updates(8).build()
+    application.add_handler(CommandHandler("start", slow))
+    return application
+
+def test_webhook_load_processes_all_updates():
+    """Через вебхук обрабатываются все обновления смешанного потока, ответы и регистрация вебхука идут в Bot API по HTTP"""
+    report = run_load(60, 16, llm_latency=0.01, search_latency=0.0, telegram_latency=0.0, firestore_latency=0.0,
+                      transport="webhook")
+    print(f"\n📊 Вебхук: {report['messages_per_sec']:.0f} сообщ./с, p50 {report['p50_ms']:.0f} мс")
+    assert report["errors"] == 0
+    assert report["telegram_calls"].get("setWebhook") == 1
+    assert report["telegram_http_calls"] == sum(report["telegram_calls"].values())
+    assert sum(data["count"] for data in report["by_kind"].values()) == 60
+
+def test_webhook_checks_secret_and_uses_api_base_url():
+    """Запрос без секрета отклоняется, а ответы бота уходят на адрес из api_base_url"""
+    assert bot_api_base_url(None) is None
+    assert bot_api_base_url("http://localhost:8081/") == "http://localhost:8081/bot"
+    telegram = FakeTelegram(latency=0)
+
+    async def scenario():
+        with FakeTelegramServer(telegram) as fake_server:
+            application = telegram_bot.build_application("123456:TEST", api_base_url=fake_server.base_url)
+            url, stop_event, server = await _start(application)
+            kind, update = make_updates(1, {"start": 1})[0]
+            async with httpx.AsyncClient(timeout=10) as client:
+                rejected = await client.post(url, json=update)
+                accepted = await client.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            stop_event.set()
+            await server
+            return rejected.status_code, accepted.status_code, update["message"]["chat"]["id"]
+
+    # Остановка вебхука сохраняет снимок рейтинга: пишем его во временный каталог, а не в рабочий
+    saved_snapshot = telegram_bot.leaderboard.snapshot_file
+    with tempfile.TemporaryDirectory() as tmp:
+        telegram_bot.leaderboard.snapshot_file = os.path.join(tmp, "leaderboard.json")
+        try:
+            rejected, accepted, chat_id = asyncio.run(scenario())
+        finally:
+            telegram_bot.leaderboard.snapshot_file = saved_snapshot
+    assert rejected == 403
+    assert accepted == 200
+    assert telegram.calls.get("setWebhook") == 1
+    assert telegram.calls.get("sendMessage") == 1
+    assert chat_id in telegram.last_call_at
+
+def test_stop_drains_accepted_updates():
+    """При остановке принятые обновления дорабатываются, а зависшие прерываются по таймауту дренажа"""
+    telegram = FakeTelegram(latency=0)
+
+    async def scenario(delay: float, drain_timeout: float) -> tuple:
+        finished = []
+        application = _slow_application(telegram, delay, finished)
+        url, stop_event, server = await _start(application, drain_timeout)
+        updates = make_updates(3, {"start": 1})
+        async with httpx.AsyncClient(timeout=10, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as client:
+            for _, update in updates:
+                assert (await client.post(url, json=update)).status_code == 200
+        started = time.perf_counter()
+        stop_event.set()
+        await server
+        return finished, time.perf_counter() - started
+
+    finished, _ = asyncio.run(scenario(delay=0.3, drain_timeout=10))
+    assert sorted(finished) == [1, 2, 3]
+
+    finished, seconds = asyncio.run(scenario(delay=30, drain_timeout=0.3))
+    assert finished == []
+    assert seconds < 5
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    print("🧪 Тестирование режима вебхука...")
+    test_webhook_load_processes_all_updates()
+    print("✅ Поток обновлений обработан через вебхук")
+    test_webhook_checks_secret_and_uses_api_base_url()
+    print("✅ Секрет вебхука проверяется")
+    test_stop_drains_accepted_updates()
+    print("✅ Остановка с дренажом")
+    print("🎉 Все тесты режима вебхука пройдены успешно!")
+    sys.exit(0)
@@ -0,0 +1,66 @@
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением размера и временем жизни записей.
+    Ведет счетчики попаданий и промахов.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if self._clock() < expires_at:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """Как get, но без обновления порядка LRU и счетчиков."""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and self._clock() < item[1]:
+                return item[0]
+            return default
+
+    def set(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, self._clock() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+        }
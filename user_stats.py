@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+
+# --- Базовая настройка ---
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# --- Конфигурация (читается из .env) ---
+# Сколько очков активности дает одно сообщение
+ACTIVITY_POINTS_PER_MESSAGE = int(os.getenv("ACTIVITY_POINTS_PER_MESSAGE", 1))
+# Сколько очков активности нужно для начисления 1 JK
+ACTIVITY_POINTS_PER_JK = int(os.getenv("ACTIVITY_POINTS_PER_JK", 10))
+
+STAT_FIELDS = ("message_count", "activity_score", "jk_earned")
+
+def _to_timestamp(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+class UserStatsStore:
+    """
+    Агрегаты активности пользователей, которые обновляются при каждом сообщении:
+    число сообщений, время последней активности, activity_score и jk_earned.
+    Чтение статистики — поиск в памяти или одно чтение документа профиля.
+    """
+
+    def __init__(self, load_profile=None):
+        self.load_profile = load_profile
+        self._stats = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def configure(self, load_profile=None) -> None:
+        """Задает функцию чтения профиля пользователя из базы (user_id -> dict или None)."""
+        self.load_profile = load_profile
+
+    def add_listener(self, callback) -> None:
+        """Подписывает callback(user_id, stats) на изменения статистики (например, рейтинг)."""
+        self._listeners.append(callback)
+
+    def _notify(self, user_id: str, stats: dict) -> None:
+        for callback in self._listeners:
+            try:
+                callback(user_id, stats)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика обновления статистики: {e}", exc_info=True)
+
+    def warm(self, user_id: str, profile: dict) -> None:
+        """Заполняет статистику из документа профиля, если она еще не загружена."""
+        with self._lock:
+            if user_id in self._stats:
+                return
+            stats = self._from_profile(profile or {})
+            self._stats[user_id] = stats
+            snapshot = dict(stats)
+        self._notify(user_id, snapshot)
+
+    @staticmethod
+    def _from_profile(profile: dict) -> dict:
+        stats = {field: int(profile.get(field) or 0) for field in STAT_FIELDS}
+        stats["last_activity"] = _to_timestamp(profile.get("last_activity"))
+        stats["username"] = profile.get("username")
+        return stats
+
+    def record_message(self, user_id: str, username: str = None, timestamp: float = None) -> dict:
+        """
+        Учитывает новое сообщение пользователя.
+        Возвращает приращения полей для атомарного обновления профиля в базе.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(user_id, self._from_profile({}))
+            points_before = stats["activity_score"]
+            stats["message_count"] += 1
+            stats["activity_score"] += ACTIVITY_POINTS_PER_MESSAGE
+            jk_delta = 0
+            if ACTIVITY_POINTS_PER_JK > 0:
+                jk_delta = stats["activity_score"] // ACTIVITY_POINTS_PER_JK - points_before // ACTIVITY_POINTS_PER_JK
+            stats["jk_earned"] += jk_delta
+            stats["last_activity"] = timestamp or time.time()
+            if username:
+                stats["username"] = username
+            snapshot = dict(stats)
+        self._notify(user_id, snapshot)
+        return {"message_count": 1, "activity_score": ACTIVITY_POINTS_PER_MESSAGE, "jk_earned": jk_delta}
+
+    def get(self, user_id: str):
+        """Возвращает статистику пользователя (при промахе — одно чтение профиля) или None."""
+        with self._lock:
+            stats = self._stats.get(user_id)
+        if stats is not None:
+            return dict(stats)
+        if self.load_profile is None:
+            return None
+        profile = self.load_profile(user_id)
+        if profile is None:
+            return None
+        self.warm(user_id, profile)
+        with self._lock:
+            return dict(self._stats[user_id])
+
+    def __len__(self) -> int:
+        return len(self._stats)
+
+def format_user_stats(user_id: str, stats: dict, rank: int = None) -> str:
+    """Форматирует статистику пользователя для ответа в Telegram."""
+    last_activity = stats.get("last_activity")
+    last_activity_text = datetime.fromtimestamp(last_activity).strftime("%d.%m.%Y %H:%M") if last_activity else "нет данных"
+    return (
+        f"Статистика пользователя {user_id}:\n"
+        f"- Сообщений: {stats.get('message_count', 0)}\n"
+        f"- Активность: {stats.get('activity_score', 0)}\n"
+        f"- JK заработано: {stats.get('jk_earned', 0)}\n"
+        f"- Последняя активность: {last_activity_text}\n"
+        f"- Рейтинг: {rank if rank else 'N/A'}"
+    )
+
+# Общее хранилище статистики процесса
+stats_store = UserStatsStore()
+
+# --- Разовое заполнение агрегатов по существующим данным ---
+def backfill_user_stats(db, app_id: str) -> int:
+    """
+    Пересчитывает агрегаты для всех пользователей по подколлекции messages
+    и записывает их в документ профиля. Возвращает число обработанных пользователей.
+    Запускается один раз перед включением инкрементальных счетчиков.
+    """
+    from google.cloud.firestore_v1 import Query
+
+    processed = 0
+    for user_ref in db.collection(f"artifacts/{app_id}/users").list_documents():
+        user_id = user_ref.id
+        messages_ref = db.collection(f"artifacts/{app_id}/users/{user_id}/messages")
+        message_count = int(messages_ref.count().get()[0][0].value)
+        last_activity = None
+        for doc in messages_ref.order_by("timestamp", direction=Query.DESCENDING).limit(1).stream():
+            last_activity = doc.to_dict().get("timestamp")
+
+        activity_score = message_count * ACTIVITY_POINTS_PER_MESSAGE
+        aggregates = {
+            "message_count": message_count,
+            "activity_score": activity_score,
+            "jk_earned": activity_score // ACTIVITY_POINTS_PER_JK if ACTIVITY_POINTS_PER_JK > 0 else 0,
+            "last_activity": last_activity,
+        }
+        db.collection(f"artifacts/{app_id}/users/{user_id}/profile").document("data").set(aggregates, merge=True)
+        processed += 1
+        logger.info(f"Статистика пользователя {user_id} пересчитана: {aggregates['message_count']} сообщений.")
+    return processed
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    firebase_config_str = os.getenv("__firebase_config")
+    if not firebase_config_str:
+        logger.critical("Отсутствует __firebase_config в переменных окружения.")
+        raise SystemExit(1)
+    firebase_admin.initialize_app(credentials.Certificate(json.loads(firebase_config_str)))
+    total = backfill_user_stats(firestore.client(), os.getenv("__app_id", "default-app-id"))
+    print(f"Статистика пересчитана для {total} пользователей.")